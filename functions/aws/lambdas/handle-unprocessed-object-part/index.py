@@ -1,72 +1,243 @@
-import json
+import time
+
+INIT_STARTED_AT = time.perf_counter()
+
+import asyncio
+import functools
 import os
+from typing import Optional
 
 from aws_lambda_powertools import Logger
 
 from llm_retrieval.utils.aws.s3 import S3ObjectPartId
+from llm_retrieval.utils.aws.s3 import DEFAULT_MAX_CONCURRENT_RANGES
+from llm_retrieval.utils.aws.s3 import DEFAULT_MAX_POOL_CONNECTIONS
+from llm_retrieval.utils.aws.s3 import DEFAULT_RANGE_SIZE
+from llm_retrieval.utils.aws.s3 import S3ObjectPartRangeReader
+from llm_retrieval.utils.aws.s3 import parse_object_part_ids
 from llm_retrieval.utils.aws.s3 import S3ObjectPartReader
+from llm_retrieval.utils.aws.s3 import S3ObjectReader
+from llm_retrieval.utils.aws.s3 import create_s3_client
 from llm_retrieval.utils.aws.secrets import SecretsReader
 from llm_retrieval.configuration import Configuration
 from llm_retrieval.document.chunk.stream import EncodedChunkStream
-from llm_retrieval.document.chunk.stream.conversion import EncodedToDecodedChunkStreamConverterWithSplitCharacterHealing
+from llm_retrieval.document.chunk.stream.conversion import EncodedToDecodedChunkStreamConverterWithIncrementalDecoding
+from llm_retrieval.document.chunk.stream.transformation import DecodedChunkStreamBoundaryTrimmer
 from llm_retrieval.document.chunk.stream.transformation import DecodedChunkStreamSplitWordHealer
 from llm_retrieval.document.chunk.stream.transformation import DecodedChunkStreamResizerByNumTokens
-from llm_retrieval.document.chunk.stream.processing import embed_and_upsert_decoded_chunk_stream
+from llm_retrieval.document.chunk.stream.transformation import MAX_BOUNDARY_OVERHANG_DEFAULT
+from llm_retrieval.document.chunk.stream.processing import EmbedAndUpsertPipeline
 from llm_retrieval.vector.store import StoredVectorMetadata
+from llm_retrieval.embedding.cache import CachedEmbeddingClient
 from llm_retrieval.embedding.factory import get_embedding_client
 from llm_retrieval.vector.store.factory import get_vector_store_client
+from llm_retrieval.tokenizer import tokenizer_registry
+from llm_retrieval.tokenizer import TOKEN_ENCODING_DEFAULT
+from llm_retrieval.utils.common.asynchronous import shared_event_loop
+from llm_retrieval.utils.common.concurrency import AimdConcurrencyLimit
+from llm_retrieval.utils.common.read_ahead import READ_AHEAD_CHUNKS_DEFAULT
+from llm_retrieval.utils.common.read_ahead import ReadAheadReader
 
 
 CHUNK_SIZE = int(os.environ['CHUNK_SIZE'])
+READ_AHEAD_CHUNKS = int(os.environ.get('READ_AHEAD_CHUNKS', READ_AHEAD_CHUNKS_DEFAULT))
+MAX_CONCURRENT_RANGES = int(os.environ.get('MAX_CONCURRENT_RANGES', DEFAULT_MAX_CONCURRENT_RANGES))
+# Unless set, ranges are a few chunks long, but short enough that the ranges fetched at once take
+# only a fraction of the function's memory, which the Lambda runtime sets in megabytes.
+RANGE_CHUNKS = 4
+RANGE_MEMORY_FRACTION = 1 / 8
+LAMBDA_MEMORY_SIZE = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', 0)) * 1024 * 1024
+
+
+def derive_range_size() -> int:
+    range_size = min(CHUNK_SIZE * RANGE_CHUNKS, DEFAULT_RANGE_SIZE)
+    if LAMBDA_MEMORY_SIZE:
+        range_size = min(range_size, int(LAMBDA_MEMORY_SIZE * RANGE_MEMORY_FRACTION) // MAX_CONCURRENT_RANGES)
+    return max(CHUNK_SIZE, range_size)
+
+
+# Parts larger than a range are read as ranges fetched concurrently.
+RANGE_SIZE = int(os.environ['RANGE_SIZE']) if os.environ.get('RANGE_SIZE') else derive_range_size()
+# Part boundaries are moved by up to this many bytes to fall between words, so parts are read past their end.
+BOUNDARY_OVERHANG = int(os.environ.get('BOUNDARY_OVERHANG', MAX_BOUNDARY_OVERHANG_DEFAULT))
+# Bytes invalid in the part's encoding are replaced rather than failing the part, whose encoding was detected
+# from the object's head only, after some of its batches may have been upserted. See the codecs module for the options.
+DECODE_ERRORS = os.environ.get('DECODE_ERRORS', 'replace')
 MAX_CONCURRENT_BATCHES = int(os.environ['MAX_CONCURRENT_BATCHES'])
+MAX_CONCURRENT_UPSERT_BATCHES = int(os.environ.get('MAX_CONCURRENT_UPSERT_BATCHES', MAX_CONCURRENT_BATCHES))
+ADAPTIVE_CONCURRENCY = os.environ.get('ADAPTIVE_CONCURRENCY', 'false').lower() == 'true'
+ADAPTIVE_CONCURRENCY_INITIAL_LIMIT = 8
+# If unset, the embedding client's per-request token limit is used.
+EMBED_BATCH_TOKENS = int(os.environ['EMBED_BATCH_TOKENS']) if 'EMBED_BATCH_TOKENS' in os.environ else None
+# If set, the embedding batches of the records processed at once are pooled, waiting up to this long to fill.
+EMBED_BATCH_WAIT_SECONDS = float(os.environ['EMBED_BATCH_WAIT_SECONDS']) if os.environ.get('EMBED_BATCH_WAIT_SECONDS') else None
 OPENAI_API_KEY_SECRET_ARN = os.environ['OPENAI_API_KEY_SECRET_ARN']
 PINECONE_API_KEY_SECRET_ARN = os.environ['PINECONE_API_KEY_SECRET_ARN']
 
 
 logger = Logger()
 
-s3_object_part_reader = S3ObjectPartReader()
+# One connection pool, sized for the concurrent ranges, shared by both part readers.
+s3_object_reader = S3ObjectReader(create_s3_client(max(MAX_CONCURRENT_RANGES, DEFAULT_MAX_POOL_CONNECTIONS)))
+s3_object_part_reader = S3ObjectPartReader(s3_object_reader)
+s3_object_part_range_reader = S3ObjectPartRangeReader(s3_object_reader, RANGE_SIZE, MAX_CONCURRENT_RANGES)
 
 secrets_reader = SecretsReader()
 configuration = Configuration()
 configuration.set_openai_api_key_callback(lambda: secrets_reader.get_secret_string(OPENAI_API_KEY_SECRET_ARN))
 configuration.set_pinecone_api_key_callback(lambda: secrets_reader.get_secret_string(PINECONE_API_KEY_SECRET_ARN))
 
-embedding_client = get_embedding_client(configuration)
-vector_store_client = get_vector_store_client(configuration)
+
+# At module level, so that adaptive limits carry what they learned over to warm invocations.
+if ADAPTIVE_CONCURRENCY:
+    embed_concurrency = AimdConcurrencyLimit(
+        initial_limit=min(ADAPTIVE_CONCURRENCY_INITIAL_LIMIT, MAX_CONCURRENT_BATCHES),
+        max_limit=MAX_CONCURRENT_BATCHES,
+    )
+    upsert_concurrency = AimdConcurrencyLimit(
+        initial_limit=min(ADAPTIVE_CONCURRENCY_INITIAL_LIMIT, MAX_CONCURRENT_UPSERT_BATCHES),
+        max_limit=MAX_CONCURRENT_UPSERT_BATCHES,
+    )
+else:
+    embed_concurrency = MAX_CONCURRENT_BATCHES
+    upsert_concurrency = MAX_CONCURRENT_UPSERT_BATCHES
+
+
+@functools.lru_cache(maxsize=None)
+def get_clients():
+    # Built on first use rather than at import, so the init phase only pays for imports.
+    return get_embedding_client(configuration), get_vector_store_client(configuration)
+
+
+@functools.lru_cache(maxsize=None)
+def get_pipeline() -> EmbedAndUpsertPipeline:
+    # One pipeline for every record and invocation, so that records processed at once share its limits.
+    embedding_client, vector_store_client = get_clients()
+    return EmbedAndUpsertPipeline(
+        embedding_client,
+        vector_store_client,
+        max_concurrent_batches=embed_concurrency,
+        max_concurrent_upsert_batches=upsert_concurrency,
+        batch_tokens=EMBED_BATCH_TOKENS,
+        max_batch_wait_seconds=EMBED_BATCH_WAIT_SECONDS,
+    )
+
+
+INIT_SECONDS = time.perf_counter() - INIT_STARTED_AT
+is_cold_start = True
+
+
+def log_cold_start():
+    """Logs the time spent initialising the module, clients and tokenizer on a cold start."""
+    started_at = time.perf_counter()
+    get_clients()
+    clients_seconds = time.perf_counter() - started_at
+    tokenizer_registry.get(TOKEN_ENCODING_DEFAULT)
+    logger.info(
+        'Initialised on cold start',
+        init_seconds=INIT_SECONDS,
+        clients_seconds=clients_seconds,
+        range_size=RANGE_SIZE,
+        tokenizer_load_seconds_by_name=tokenizer_registry.load_seconds_by_name,
+    )
+
+
+def read_object_part(object_part_id: S3ObjectPartId) -> tuple[EncodedChunkStream, Optional[ReadAheadReader]]:
+    """Reads an object part as a stream of encoded chunks, along with its read-ahead reader, if any.
+
+    The part is read past its end by the overhang its end boundary may be moved by, which S3 truncates
+    at the end of the object.
+    """
+    object_part_id = object_part_id.copy(
+        update={'end': object_part_id.end + DecodedChunkStreamBoundaryTrimmer.read_overhang(BOUNDARY_OVERHANG)},
+    )
+    encoded_chunk_stream = EncodedChunkStream(object_part_id.encoding)
+    if object_part_id.end - object_part_id.start > RANGE_SIZE:
+        encoded_chunk_stream.append_wrapped(s3_object_part_range_reader.read(object_part_id), start=object_part_id.start)
+        return encoded_chunk_stream, None
+    object_part = s3_object_part_reader.get(object_part_id)
+    # Reads the next chunks of the body while the current ones are tokenized.
+    object_part_reader = ReadAheadReader(object_part['Body'], CHUNK_SIZE, READ_AHEAD_CHUNKS)
+    encoded_chunk_stream.append_wrapped(object_part_reader, start=object_part_id.start)
+    return encoded_chunk_stream, object_part_reader
+
+
+async def process_object_part(object_part_id: S3ObjectPartId) -> None:
+    logger.info('Processing unprocessed object part', object_part_id=object_part_id)
+
+    # TODO: add text extraction for PDFs, images, etc.
+    # Opening the part makes a blocking request, so it is made off the event loop.
+    encoded_chunk_stream, object_part_reader = await asyncio.to_thread(read_object_part, object_part_id)
+    decoded_chunk_stream = EncodedToDecodedChunkStreamConverterWithIncrementalDecoding(DECODE_ERRORS).decode(encoded_chunk_stream)
+    decoded_chunk_stream = DecodedChunkStreamBoundaryTrimmer(
+        decoded_chunk_stream,
+        object_part_id.start,
+        object_part_id.end,
+        BOUNDARY_OVERHANG,
+    )
+    # The trimmed part starts and ends between words, so its first and last words are whole.
+    decoded_chunk_stream = DecodedChunkStreamSplitWordHealer(decoded_chunk_stream, trust_stream_boundaries=True)
+    decoded_chunk_stream = DecodedChunkStreamResizerByNumTokens(decoded_chunk_stream, emit_trailing_chunk=True)
+
+    try:
+        await get_pipeline().run(
+            decoded_chunk_stream,
+            vector_prefixes=f"{object_part_id.object_id.bucket}/{object_part_id.object_id.key}",
+            metadata=StoredVectorMetadata(),
+        )
+    except UnicodeDecodeError:
+        logger.exception("Failed to decode unprocessed object part", object_part_id=object_part_id)
+        raise
+
+    logger.info(
+        'Successfully processed unprocessed object part',
+        object_part_id=object_part_id,
+        read_ahead=object_part_reader.stats() if object_part_reader else None,
+    )
+
+
+async def process_sqs_record(sqs_record: dict) -> None:
+    # A message is a single part, a group of parts, e.g. of small objects packed together, or a range of parts.
+    for object_part_id in parse_object_part_ids(sqs_record['body']):
+        await process_object_part(object_part_id)
+
+
+async def process_sqs_records(sqs_records: list) -> list[dict]:
+    """Processes the records at once, returning the failed ones as SQS batch item failures."""
+    results = await asyncio.gather(*map(process_sqs_record, sqs_records), return_exceptions=True)
+    batch_item_failures = []
+    for sqs_record, result in zip(sqs_records, results):
+        if isinstance(result, BaseException):
+            logger.error(
+                'Failed to process record',
+                message_id=sqs_record['messageId'],
+                exc_info=(type(result), result, result.__traceback__),
+            )
+            batch_item_failures.append({'itemIdentifier': sqs_record['messageId']})
+    return batch_item_failures
 
 
 @logger.inject_lambda_context()
 def handler(event, context):
-    sqs_records = event['Records']
-    for sqs_record in sqs_records:
-        sqs_body = json.loads(sqs_record['body'])
-
-        object_part_id = S3ObjectPartId.parse_raw(sqs_body)
-
-        logger.info('Processing unprocessed object part', object_part_id=object_part_id)
-
-        object_part = s3_object_part_reader.get(object_part_id)
-
-        encoded_chunk_stream = object_part['Body'].iter_chunks(CHUNK_SIZE)
-        # TODO: add support for other encodings
-        # TODO: add text extraction for PDFs, images, etc.
-        encoded_chunk_stream = EncodedChunkStream('utf-8').append_wrapped(encoded_chunk_stream, start=object_part_id.start)
-        decoded_chunk_stream = EncodedToDecodedChunkStreamConverterWithSplitCharacterHealing().decode(encoded_chunk_stream)
-        decoded_chunk_stream = DecodedChunkStreamSplitWordHealer(decoded_chunk_stream)
-        decoded_chunk_stream = DecodedChunkStreamResizerByNumTokens(decoded_chunk_stream)
-
-        try:
-            embed_and_upsert_decoded_chunk_stream(
-                decoded_chunk_stream=decoded_chunk_stream,
-                vector_prefixes=f"{object_part_id.object_id.bucket}/{object_part_id.object_id.key}",
-                metadata=StoredVectorMetadata(),
-                embedding_client=embedding_client,
-                vector_store_client=vector_store_client,
-                max_concurrent_batches=MAX_CONCURRENT_BATCHES,
-            )
-        except UnicodeDecodeError:
-            logger.exception("Failed to decode unprocessed object part", object_part_id=object_part_id)
-            raise
-
-        logger.info('Successfully processed unprocessed object part', object_part_id=object_part_id)
+    global is_cold_start
+    if is_cold_start:
+        log_cold_start()
+        is_cold_start = False
+
+    # Only the failed records are returned to the queue, so that the parts already embedded are not embedded again.
+    batch_item_failures = shared_event_loop.run(process_sqs_records(event['Records']))
+
+    embedding_client, vector_store_client = get_clients()
+    logger.info(
+        'Processed records',
+        n_records=len(event['Records']),
+        n_failed_records=len(batch_item_failures),
+        embedding_rate_limit=embedding_client.rate_limiter.stats() if embedding_client.rate_limiter else None,
+        vector_store_rate_limit=vector_store_client.rate_limiter.stats() if vector_store_client.rate_limiter else None,
+        embed_concurrency=repr(embed_concurrency),
+        upsert_concurrency=repr(upsert_concurrency),
+        pooled_embed_batches=get_pipeline().stats(),
+        embedding_cache=embedding_client.stats() if isinstance(embedding_client, CachedEmbeddingClient) else None,
+        embedding_connections=embedding_client.connection_stats(),
+    )
+    return {'batchItemFailures': batch_item_failures}
@@ -1,52 +1,126 @@
+import concurrent.futures
+import itertools
 import json
 import os
+from typing import Iterable
 
+import pydantic
 from aws_lambda_powertools import Logger
 
-from llm_retrieval.utils.common.iterable import batched
+from llm_retrieval.utils.common.encoding import detect_encoding
+from llm_retrieval.utils.common.encoding import DETECTION_SAMPLE_SIZE_DEFAULT
 from llm_retrieval.utils.aws.s3 import S3ObjectId
+from llm_retrieval.utils.aws.s3 import S3ObjectPartId
+from llm_retrieval.utils.aws.s3 import S3ObjectReader
 from llm_retrieval.utils.aws.s3 import S3ObjectPartitioner
+from llm_retrieval.utils.aws.s3 import S3ObjectPartSizePolicy
+from llm_retrieval.utils.aws.s3 import DEFAULT_MAX_PART_SIZE
+from llm_retrieval.utils.aws.s3 import DEFAULT_MIN_PART_SIZE
+from llm_retrieval.utils.aws.s3 import DEFAULT_TARGET_PARTS_PER_OBJECT
+from llm_retrieval.utils.aws.s3 import pack_object_part_ids
 from llm_retrieval.utils.aws.sqs import SqsQueueId
 from llm_retrieval.utils.aws.sqs import SqsMessageSender
+from llm_retrieval.utils.aws.sqs import create_sqs_client
+from llm_retrieval.utils.aws.sqs import DEFAULT_MAX_CONCURRENT_BATCHES
 
 
 UPLOAD_BUCKET_NAME = os.environ['UPLOAD_BUCKET_NAME']
-PART_SIZE = int(os.environ['PART_SIZE'])
+MIN_PART_SIZE = int(os.environ.get('MIN_PART_SIZE', DEFAULT_MIN_PART_SIZE))
+MAX_PART_SIZE = int(os.environ.get('MAX_PART_SIZE', DEFAULT_MAX_PART_SIZE))
+TARGET_PARTS_PER_OBJECT = int(os.environ.get('TARGET_PARTS_PER_OBJECT', DEFAULT_TARGET_PARTS_PER_OBJECT))
 UNPROCESSED_OBJECT_PART_QUEUE_URL = os.environ['UNPROCESSED_OBJECT_PART_QUEUE_URL']
-OBJECT_PART_IDS_PER_BATCH = 10
+ENCODING_DETECTION_SAMPLE_SIZE = int(os.environ.get('ENCODING_DETECTION_SAMPLE_SIZE', DETECTION_SAMPLE_SIZE_DEFAULT))
+# Parts of large objects are sent this many to a message, as compact ranges, if more than one.
+PARTS_PER_MESSAGE = int(os.environ.get('PARTS_PER_MESSAGE', 1))
+MAX_CONCURRENT_SEND_BATCHES = int(os.environ.get('MAX_CONCURRENT_SEND_BATCHES', DEFAULT_MAX_CONCURRENT_BATCHES))
+# The most records in a batch, i.e. the event source's batch size.
+MAX_CONCURRENT_RECORDS = 10
 
 logger = Logger()
-s3_object_partitioner = S3ObjectPartitioner()
+s3_object_reader = S3ObjectReader()
+s3_object_partitioner = S3ObjectPartitioner(s3_object_reader)
+s3_object_part_size_policy = S3ObjectPartSizePolicy(MIN_PART_SIZE, MAX_PART_SIZE, TARGET_PARTS_PER_OBJECT)
 sqs_queue_id = SqsQueueId(url=UNPROCESSED_OBJECT_PART_QUEUE_URL)
-sqs_message_sender = SqsMessageSender()
+# Every record being processed at once may send its batches at once.
+sqs_message_sender = SqsMessageSender(create_sqs_client(MAX_CONCURRENT_RECORDS * MAX_CONCURRENT_SEND_BATCHES))
+
+
+def process_sqs_record(sqs_record: dict) -> list[S3ObjectPartId]:
+    """Sends the work items of the object in an upload notification.
+
+    Returns:
+        The parts of the object if it is smaller than a part, to be packed with other small objects instead.
+    """
+    sqs_body = json.loads(sqs_record['body'])
+
+    if 'Event' in sqs_body and sqs_body['Event'] == 's3:TestEvent':
+        logger.info('Skipping S3 test event')
+        return []
+
+    s3_object = sqs_body['Records'][0]['s3']['object']
+    object_id = S3ObjectId(bucket=UPLOAD_BUCKET_NAME, key=s3_object['key'])
+    # The notification carries the size, so the object need only be HEADed for it if it is missing.
+    object_size = s3_object.get('size')
+    if object_size is None:
+        object_size = s3_object_reader.get(object_id, metadata_only=True)['ContentLength']
+
+    # Detect the encoding once per object, so that every part is decoded with it.
+    encoding = detect_encoding(s3_object_reader.read_head(object_id, ENCODING_DETECTION_SAMPLE_SIZE))
+    part_size = s3_object_part_size_policy.part_size(object_size)
+    logger.info(
+        'Partitioning object',
+        object_id=object_id,
+        object_size=object_size,
+        encoding=encoding,
+        part_size=part_size,
+    )
+
+    if object_size < MIN_PART_SIZE:
+        return list(s3_object_partitioner.iter_part_ids(object_id, part_size, encoding, object_size))
+    if PARTS_PER_MESSAGE > 1:
+        work_items = s3_object_partitioner.iter_part_ranges(object_id, part_size, PARTS_PER_MESSAGE, encoding, object_size)
+    else:
+        work_items = s3_object_partitioner.iter_part_ids(object_id, part_size, encoding, object_size)
+    n_sent = send_work_items(work_items)
+    logger.info('Sent work items to SQS', object_id=object_id, n_work_items=n_sent)
+    return []
+
+
+def send_work_items(work_items: Iterable[pydantic.BaseModel]) -> int:
+    return sqs_message_sender.send_all(
+        sqs_queue_id,
+        (work_item.json(by_alias=True) for work_item in work_items),
+        max_concurrent_batches=MAX_CONCURRENT_SEND_BATCHES,
+    )
 
 
 @logger.inject_lambda_context()
 def handler(event, context):
     sqs_records = event['Records']
-    for sqs_record in sqs_records:
-        sqs_body = json.loads(sqs_record['body'])
-
-        if 'Event' in sqs_body and sqs_body['Event'] == 's3:TestEvent':
-            logger.info('Skipping S3 test event')
-            continue
-
-        object_key = sqs_body['Records'][0]['s3']['object']['key']
-        object_id = S3ObjectId(bucket=UPLOAD_BUCKET_NAME, key=object_key)
-        object_part_ids = s3_object_partitioner.iter_part_ids(object_id, PART_SIZE)
-
-        for object_part_id_batch in batched(object_part_ids, OBJECT_PART_IDS_PER_BATCH):
-            logger.info(
-                'Sending batch of object part IDs to SQS',
-                batch_size=len(object_part_id_batch),
-            )
-            sqs_message_sender.send_batch(
-                sqs_queue_id,
-                [
-                    {
-                        'Id': str(i),
-                        'MessageBody': json.dumps(object_part_id.json(by_alias=True)),
-                    }
-                    for i, object_part_id in enumerate(object_part_id_batch)
-                ],
-            )
+    failed_message_ids = []
+    small_object_part_ids_by_message_id = {}
+
+    # The records are processed at once, and only the failed ones are returned to the queue.
+    with concurrent.futures.ThreadPoolExecutor(MAX_CONCURRENT_RECORDS) as executor:
+        futures = [executor.submit(process_sqs_record, sqs_record) for sqs_record in sqs_records]
+    for sqs_record, future in zip(sqs_records, futures):
+        try:
+            small_object_part_ids_by_message_id[sqs_record['messageId']] = future.result()
+        except Exception:
+            logger.exception('Failed to process record', message_id=sqs_record['messageId'])
+            failed_message_ids.append(sqs_record['messageId'])
+
+    # Small objects are packed together across records, so that each worker gets a part's worth.
+    small_object_part_ids = list(itertools.chain.from_iterable(small_object_part_ids_by_message_id.values()))
+    if small_object_part_ids:
+        object_part_groups = pack_object_part_ids(small_object_part_ids, MIN_PART_SIZE)
+        try:
+            # A group of one is sent as the part ID itself.
+            n_sent = send_work_items(g.parts[0] if len(g.parts) == 1 else g for g in object_part_groups)
+            logger.info('Sent small object work items to SQS', n_work_items=n_sent)
+        except Exception:
+            logger.exception('Failed to send small object work items')
+            # Which groups were sent is unknown, so every record with a small object is retried.
+            failed_message_ids.extend(m for m, part_ids in small_object_part_ids_by_message_id.items() if part_ids)
+
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]}
@@ -1,8 +1,45 @@
+import collections
+import concurrent.futures
 import enum
-from typing import Iterable
+import itertools
+import json
+import math
+import os
+from typing import Iterable, Iterator, Optional
 
 import boto3
 import pydantic
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+
+DEFAULT_OBJECT_ENCODING = 'utf-8'
+# botocore's own default, i.e. the number of requests a client can make at once.
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+DEFAULT_RANGE_SIZE = 8 * 1024 * 1024
+DEFAULT_MAX_CONCURRENT_RANGES = 8
+DEFAULT_MIN_PART_SIZE = 1024 * 1024
+DEFAULT_MAX_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_TARGET_PARTS_PER_OBJECT = 100
+# e.g. http://localhost:4566 to use the localstack started by scripts/start-localstack.sh.
+S3_ENDPOINT_URL_ENV_VAR = 'S3_ENDPOINT_URL'
+
+
+def create_s3_client(
+    max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS,
+    endpoint_url: Optional[str] = None,
+):
+    """Create an S3 client whose connection pool can serve the given number of requests at once.
+
+    Args:
+        max_pool_connections: The maximum number of connections kept open by the client.
+        endpoint_url: The URL of the S3 endpoint. Defaults to the S3_ENDPOINT_URL environment variable, if set.
+    """
+    return boto3.client(
+        's3',
+        endpoint_url=endpoint_url or os.environ.get(S3_ENDPOINT_URL_ENV_VAR),
+        config=Config(max_pool_connections=max_pool_connections),
+    )
 
 
 class S3ObjectId(pydantic.BaseModel):
@@ -14,11 +51,126 @@ class S3ObjectPartId(pydantic.BaseModel):
     object_id: S3ObjectId = pydantic.Field(alias='objectId')
     start: int
     end: int
+    encoding: str = DEFAULT_OBJECT_ENCODING
 
     class Config:
         allow_population_by_field_name = True
 
 
+class S3ObjectPartGroup(pydantic.BaseModel):
+    """Object parts processed together as one work item, e.g. the parts of several small objects."""
+    parts: list[S3ObjectPartId]
+
+    @property
+    def size(self) -> int:
+        return sum(part.end - part.start for part in self.parts)
+
+
+class S3ObjectPartRange(pydantic.BaseModel):
+    """Consecutive, equally sized parts of an object, encoded compactly as one work item.
+
+    The parts start at start and every stride bytes after it, and the last part is cut short at end.
+    """
+    object_id: S3ObjectId = pydantic.Field(alias='objectId')
+    start: int
+    stride: int
+    count: int
+    end: int
+    encoding: str = DEFAULT_OBJECT_ENCODING
+
+    class Config:
+        allow_population_by_field_name = True
+
+    @property
+    def parts(self) -> list[S3ObjectPartId]:
+        return [
+            S3ObjectPartId(
+                object_id=self.object_id,
+                start=start,
+                end=min(start + self.stride, self.end),
+                encoding=self.encoding,
+            )
+            for start in range(self.start, min(self.start + self.count * self.stride, self.end), self.stride)
+        ]
+
+
+def parse_object_part_ids(raw: str) -> list[S3ObjectPartId]:
+    """Parse a work item, which is a single object part ID, a group of them or a range of them."""
+    data = json.loads(raw)
+    if isinstance(data, str):
+        # Work items used to be encoded as JSON twice.
+        data = json.loads(data)
+    if 'parts' in data:
+        return S3ObjectPartGroup.parse_obj(data).parts
+    if 'stride' in data:
+        return S3ObjectPartRange.parse_obj(data).parts
+    return [S3ObjectPartId.parse_obj(data)]
+
+
+class S3ObjectPartSizePolicy:
+    """Picks the size of the parts of an object from its size.
+
+    Objects are split into about target_parts_per_object parts, so that large objects are
+    spread over that many workers, but parts are kept between the minimum and maximum size,
+    so that small objects are not split into parts too small to be worth a worker, and huge
+    objects are not assigned to workers in parts too large for them to process.
+    """
+
+    def __init__(
+        self,
+        min_part_size: int = DEFAULT_MIN_PART_SIZE,
+        max_part_size: int = DEFAULT_MAX_PART_SIZE,
+        target_parts_per_object: int = DEFAULT_TARGET_PARTS_PER_OBJECT,
+    ):
+        if not 1 <= min_part_size <= max_part_size:
+            raise ValueError('part sizes must satisfy 1 <= min_part_size <= max_part_size')
+        if target_parts_per_object < 1:
+            raise ValueError('target_parts_per_object must be at least one')
+        self._min_part_size = min_part_size
+        self._max_part_size = max_part_size
+        self._target_parts_per_object = target_parts_per_object
+
+    @property
+    def min_part_size(self) -> int:
+        return self._min_part_size
+
+    def part_size(self, object_size: int) -> int:
+        part_size = math.ceil(object_size / self._target_parts_per_object)
+        return min(self._max_part_size, max(self._min_part_size, part_size))
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}({self._min_part_size!r}, {self._max_part_size!r}, '
+            f'{self._target_parts_per_object!r})'
+        )
+
+
+def pack_object_part_ids(
+    object_part_ids: Iterable[S3ObjectPartId],
+    min_group_size: int,
+) -> Iterator[S3ObjectPartGroup]:
+    """Pack object parts into groups of at least min_group_size bytes, in order.
+
+    Parts of at least min_group_size bytes are grouped on their own, so only small parts,
+    e.g. whole small objects, are packed together. The last group may be smaller.
+    """
+    group = []
+    group_size = 0
+    for object_part_id in object_part_ids:
+        part_size = object_part_id.end - object_part_id.start
+        if part_size >= min_group_size:
+            yield S3ObjectPartGroup(parts=[object_part_id])
+            continue
+        group.append(object_part_id)
+        group_size += part_size
+        if group_size >= min_group_size:
+            yield S3ObjectPartGroup(parts=group)
+            group = []
+            group_size = 0
+    if group:
+        yield S3ObjectPartGroup(parts=group)
+
+
 class S3MethodPresigner:
 
     DEFAULT_LIFETIME = 120
@@ -28,7 +180,7 @@ class S3MethodPresigner:
         GET = 'get_object'
 
     def __init__(self, client = None):
-        self._client = client or boto3.client('s3')
+        self._client = client or create_s3_client()
 
     def presign(
         self,
@@ -51,7 +203,7 @@ class S3MethodPresigner:
 class S3ObjectReader:
 
     def __init__(self, client = None):
-        self._client = client or boto3.client('s3')
+        self._client = client or create_s3_client()
 
     def get(
         self,
@@ -72,6 +224,26 @@ class S3ObjectReader:
                 **kwargs,
             )
 
+    def read_head(
+        self,
+        object_id: S3ObjectId,
+        size: int,
+        **kwargs,
+    ) -> bytes:
+        """Read up to the given number of bytes from the start of an object.
+
+        Returns:
+            The bytes read, which are empty if the object is empty.
+        """
+        try:
+            response = self.get(object_id, Range=f'bytes=0-{size - 1}', **kwargs)
+        except ClientError as e:
+            # S3 rejects any range on an empty object
+            if e.response['Error']['Code'] == 'InvalidRange':
+                return b''
+            raise
+        return response['Body'].read()
+
 
 class S3ObjectPartitioner:
 
@@ -82,12 +254,53 @@ class S3ObjectPartitioner:
         self,
         object_id: S3ObjectId,
         part_size: int,
+        encoding: str = DEFAULT_OBJECT_ENCODING,
+        object_size: Optional[int] = None,
     ) -> Iterable[S3ObjectPartId]:
-        object_metadata = self._reader.get(object_id, metadata_only=True)
-        object_size = object_metadata['ContentLength']
+        """Split an object into parts of the given size.
+
+        Args:
+            object_id: The object to split.
+            part_size: The size of each part, except possibly the last.
+            encoding: The encoding of the object.
+            object_size: The size of the object, e.g. from an S3 event notification. If None, it is read with a HEAD request.
+        """
+        if object_size is None:
+            object_size = self._reader.get(object_id, metadata_only=True)['ContentLength']
         for start in range(0, object_size, part_size):
             end = min(start + part_size, object_size)
-            yield S3ObjectPartId(object_id=object_id, start=start, end=end)
+            yield S3ObjectPartId(object_id=object_id, start=start, end=end, encoding=encoding)
+
+    def iter_part_ranges(
+        self,
+        object_id: S3ObjectId,
+        part_size: int,
+        parts_per_range: int,
+        encoding: str = DEFAULT_OBJECT_ENCODING,
+        object_size: Optional[int] = None,
+    ) -> Iterable[S3ObjectPartRange]:
+        """Split an object into parts of the given size, in ranges of up to parts_per_range parts each.
+
+        Args:
+            object_id: The object to split.
+            part_size: The size of each part, except possibly the last.
+            parts_per_range: The maximum number of parts in each range.
+            encoding: The encoding of the object.
+            object_size: The size of the object, e.g. from an S3 event notification. If None, it is read with a HEAD request.
+        """
+        if object_size is None:
+            object_size = self._reader.get(object_id, metadata_only=True)['ContentLength']
+        range_size = part_size * parts_per_range
+        for start in range(0, object_size, range_size):
+            end = min(start + range_size, object_size)
+            yield S3ObjectPartRange(
+                object_id=object_id,
+                start=start,
+                stride=part_size,
+                count=math.ceil((end - start) / part_size),
+                end=end,
+                encoding=encoding,
+            )
 
 
 class S3ObjectPartReader:
@@ -105,3 +318,87 @@ class S3ObjectPartReader:
             Range=f'bytes={object_part_id.start}-{object_part_id.end - 1}',
             **kwargs,
         )
+
+
+class S3ObjectPartRangeReader:
+    """Reads object parts as sub-ranges fetched concurrently.
+
+    A single ranged GET is limited to the bandwidth of one connection, so large parts are split
+    into sub-ranges that are fetched at once, each over its own connection, and returned in order.
+    The client's connection pool should have at least max_concurrent_ranges connections
+    (see create_s3_client), and may be shared with other readers.
+    """
+
+    def __init__(
+        self,
+        reader: S3ObjectReader = None,
+        range_size: int = DEFAULT_RANGE_SIZE,
+        max_concurrent_ranges: int = DEFAULT_MAX_CONCURRENT_RANGES,
+    ):
+        """
+        Args:
+            reader: The reader used to fetch each sub-range.
+            range_size: The maximum number of bytes in each sub-range.
+            max_concurrent_ranges: The maximum number of sub-ranges fetched, or fetched but not yet consumed, at once.
+        """
+        if range_size < 1:
+            raise ValueError('range_size must be at least one')
+        if max_concurrent_ranges < 1:
+            raise ValueError('max_concurrent_ranges must be at least one')
+        self._reader = reader or S3ObjectReader(create_s3_client(max_concurrent_ranges))
+        self._range_size = range_size
+        self._max_concurrent_ranges = max_concurrent_ranges
+        # Kept for the life of the reader, so that warm invocations reuse its threads.
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_concurrent_ranges)
+
+    def iter_ranges(self, object_part_id: S3ObjectPartId) -> Iterable[tuple[int, int]]:
+        """Iterate the start and end of each sub-range of a part."""
+        for start in range(object_part_id.start, object_part_id.end, self._range_size):
+            yield start, min(start + self._range_size, object_part_id.end)
+
+    def read(self, object_part_id: S3ObjectPartId, **kwargs) -> Iterator[bytes]:
+        """Read the sub-ranges of a part in order.
+
+        The sub-ranges are contiguous, so the start of each in the object is the part's start
+        plus the length of those before it, e.g. for EncodedChunkStream.append_wrapped. A part
+        read past the end of the object stops at the first sub-range that comes back short.
+
+        Args:
+            object_part_id: The part to read.
+            **kwargs: Additional arguments to pass to each get object request.
+        """
+        ranges = iter(self.iter_ranges(object_part_id))
+        pending = collections.deque()
+
+        def fetch_next() -> None:
+            for start, end in itertools.islice(ranges, 1):
+                future = self._executor.submit(self._read_range, object_part_id.object_id, start, end, kwargs)
+                pending.append((future, end - start))
+
+        try:
+            for _ in range(self._max_concurrent_ranges):
+                fetch_next()
+            while pending:
+                future, range_length = pending.popleft()
+                data = future.result()
+                if len(data) < range_length:
+                    # The object ends within this sub-range, so those after it are past its end and not fetched.
+                    if data:
+                        yield data
+                    break
+                # Fetch the next sub-range in the place of the consumed one, so the window stays full.
+                fetch_next()
+                yield data
+        finally:
+            for future, _ in pending:
+                future.cancel()
+
+    def _read_range(self, object_id: S3ObjectId, start: int, end: int, kwargs: dict) -> bytes:
+        try:
+            response = self._reader.get(object_id, Range=f'bytes={start}-{end - 1}', **kwargs)
+        except ClientError as e:
+            # S3 rejects a range that starts past the end of the object, e.g. one read past a part's end.
+            if e.response['Error']['Code'] == 'InvalidRange':
+                return b''
+            raise
+        return response['Body'].read()
@@ -1,5 +1,30 @@
+import concurrent.futures
+import itertools
+import time
+from typing import Iterable
+
 import boto3
 import pydantic
+from botocore.config import Config
+
+
+# The most entries SQS accepts in one batch.
+MAX_BATCH_ENTRIES = 10
+# botocore's own default, i.e. the number of requests a client can make at once.
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+DEFAULT_MAX_CONCURRENT_BATCHES = 8
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_BACKOFF_BASE_SECONDS = 0.1
+RETRY_BACKOFF_MAX_SECONDS = 5.0
+
+
+def create_sqs_client(max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS):
+    """Create an SQS client whose connection pool can serve the given number of requests at once.
+
+    Args:
+        max_pool_connections: The maximum number of connections kept open by the client.
+    """
+    return boto3.client('sqs', config=Config(max_pool_connections=max_pool_connections))
 
 
 class SqsQueueId(pydantic.BaseModel):
@@ -21,7 +46,7 @@ class SqsMessageSenderError(Exception):
 class SqsMessageSender:
 
     def __init__(self, client = None):
-        self._client = client or boto3.client('sqs')
+        self._client = client or create_sqs_client()
 
     def send(
         self,
@@ -61,6 +86,79 @@ class SqsMessageSender:
         self._raise_on_sender_error(response)
         return response
 
+    def send_all(
+        self,
+        queue_id: SqsQueueId,
+        messages: Iterable[str],
+        max_concurrent_batches: int = DEFAULT_MAX_CONCURRENT_BATCHES,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        **kwargs,
+    ) -> int:
+        """Send any number of messages to a queue, in batches sent concurrently.
+
+        The messages are read lazily, so that no more than max_concurrent_batches batches are
+        held at once. The client's connection pool should serve max_concurrent_batches requests
+        at once, times the number of threads calling send_all at once (see create_sqs_client). Entries that fail for reasons other than the sender's fault (e.g. throttling)
+        are retried on their own, with exponential backoff.
+
+        Args:
+            queue_id: The queue to send the messages to.
+            messages: The bodies of the messages to send.
+            max_concurrent_batches: The maximum number of batches sent at once.
+            max_attempts: The maximum number of times each entry is sent.
+            **kwargs: Additional arguments to pass to the batch send method.
+
+        Returns:
+            The number of messages sent.
+
+        Raises:
+            SqsMessageSenderError: If any of the entries failed to send due to a sender error,
+                or still failed after max_attempts attempts.
+        """
+        messages = iter(messages)
+        n_sent = 0
+        with concurrent.futures.ThreadPoolExecutor(max_concurrent_batches) as executor:
+            pending = set()
+            try:
+                while True:
+                    batch = list(itertools.islice(messages, MAX_BATCH_ENTRIES))
+                    if not batch:
+                        break
+                    if len(pending) >= max_concurrent_batches:
+                        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                        n_sent += sum(future.result() for future in done)
+                    pending.add(executor.submit(self._send_batch_with_retries, queue_id, batch, max_attempts, kwargs))
+                for future in concurrent.futures.as_completed(pending):
+                    n_sent += future.result()
+            finally:
+                for future in pending:
+                    future.cancel()
+        return n_sent
+
+    def _send_batch_with_retries(
+        self,
+        queue_id: SqsQueueId,
+        messages: list[str],
+        max_attempts: int,
+        kwargs: dict,
+    ) -> int:
+        message_by_id = {str(i): message for i, message in enumerate(messages)}
+        failed = []
+        for attempt in range(max_attempts):
+            if attempt:
+                time.sleep(min(RETRY_BACKOFF_MAX_SECONDS, RETRY_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+            response = self.send_batch(
+                queue_id,
+                [{'Id': id, 'MessageBody': message} for id, message in message_by_id.items()],
+                **kwargs,
+            )
+            # Only the failed entries are sent again, so that none is sent twice.
+            failed = response.get('Failed', [])
+            message_by_id = {e['Id']: message_by_id[e['Id']] for e in failed}
+            if not message_by_id:
+                return len(messages)
+        raise SqsMessageSenderError(failed)
+
     def _raise_on_sender_error(
         self,
         response: dict,
@@ -1,9 +1,19 @@
 import os
-from typing import Callable
+from typing import Callable, Optional
 
 from llm_retrieval.vector.store import StoredVectorMetadata
 
 
+def _get_float_env(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+def _get_int_env(name: str) -> Optional[int]:
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
 class Configuration:
 
     def __init__(
@@ -14,6 +24,11 @@ class Configuration:
         pinecone_dimension: int = None,
         pinecone_index_name: str = None,
         pinecone_metadata_type: type = None,
+        embedding_requests_per_minute: float = None,
+        embedding_tokens_per_minute: float = None,
+        vector_store_requests_per_minute: float = None,
+        embedding_cache_path: str = None,
+        embedding_max_connections: int = None,
     ):
         self._embedding_model_name = embedding_model_name
         self._vector_store_provider_name = vector_store_provider_name
@@ -21,6 +36,11 @@ class Configuration:
         self._pinecone_dimension = pinecone_dimension
         self._pinecone_index_name = pinecone_index_name
         self._pinecone_metadata_type = pinecone_metadata_type
+        self._embedding_requests_per_minute = embedding_requests_per_minute
+        self._embedding_tokens_per_minute = embedding_tokens_per_minute
+        self._vector_store_requests_per_minute = vector_store_requests_per_minute
+        self._embedding_cache_path = embedding_cache_path
+        self._embedding_max_connections = embedding_max_connections
         self._openai_api_key_callback = None
         self._pinecone_api_key_callback = None
 
@@ -85,3 +105,43 @@ class Configuration:
     @pinecone_metadata_type.setter
     def pinecone_metadata_type(self, value: type[StoredVectorMetadata]) -> None:
         self._pinecone_metadata_type = value
+
+    @property
+    def embedding_requests_per_minute(self) -> Optional[float]:
+        return self._embedding_requests_per_minute or _get_float_env("EMBEDDING_REQUESTS_PER_MINUTE")
+
+    @embedding_requests_per_minute.setter
+    def embedding_requests_per_minute(self, value: float) -> None:
+        self._embedding_requests_per_minute = value
+
+    @property
+    def embedding_tokens_per_minute(self) -> Optional[float]:
+        return self._embedding_tokens_per_minute or _get_float_env("EMBEDDING_TOKENS_PER_MINUTE")
+
+    @embedding_tokens_per_minute.setter
+    def embedding_tokens_per_minute(self, value: float) -> None:
+        self._embedding_tokens_per_minute = value
+
+    @property
+    def vector_store_requests_per_minute(self) -> Optional[float]:
+        return self._vector_store_requests_per_minute or _get_float_env("VECTOR_STORE_REQUESTS_PER_MINUTE")
+
+    @vector_store_requests_per_minute.setter
+    def vector_store_requests_per_minute(self, value: float) -> None:
+        self._vector_store_requests_per_minute = value
+
+    @property
+    def embedding_cache_path(self) -> Optional[str]:
+        return self._embedding_cache_path or os.environ.get("EMBEDDING_CACHE_PATH") or None
+
+    @embedding_cache_path.setter
+    def embedding_cache_path(self, value: str) -> None:
+        self._embedding_cache_path = value
+
+    @property
+    def embedding_max_connections(self) -> Optional[int]:
+        return self._embedding_max_connections or _get_int_env("EMBEDDING_MAX_CONNECTIONS")
+
+    @embedding_max_connections.setter
+    def embedding_max_connections(self, value: int) -> None:
+        self._embedding_max_connections = value
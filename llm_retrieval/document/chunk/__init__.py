@@ -1,2 +1,3 @@
 from ._decoded_chunk import DecodedChunk
-from ._encoded_chunk import EncodedChunk
\ No newline at end of file
+from ._encoded_chunk import EncodedChunk
+from ._encoded_chunk import EncodedChunkData
\ No newline at end of file
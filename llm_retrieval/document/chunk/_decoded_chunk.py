@@ -1,3 +1,8 @@
+from typing import Optional
+
+from llm_retrieval.utils.common.encoding import has_one_byte_per_char
+
+
 class DecodedChunk:
     """A decoded chunk of text.
     
@@ -6,13 +11,16 @@ class DecodedChunk:
         start: The start index of the chunk in the original bytes.
         end: The end index of the chunk in the original bytes.
         encoding: The encoding of the text.
+        n_tokens: The number of tokens in the text, if known.
     """
 
-    def __init__(self, text: str, start: int, end: int, encoding: str):
+    def __init__(self, text: str, start: int, end: int, encoding: str, n_tokens: Optional[int] = None):
         self._text = text
         self._start = start
         self._end = end
         self._encoding = encoding
+        self._n_tokens = n_tokens
+        self._has_one_byte_per_char = None
 
     @property
     def text(self) -> str:
@@ -29,6 +37,47 @@ class DecodedChunk:
     @property
     def encoding(self) -> str:
         return self._encoding
+
+    @property
+    def n_tokens(self) -> Optional[int]:
+        return self._n_tokens
+
+    @property
+    def size(self) -> int:
+        """The number of bytes in the encoded text."""
+        return self._end - self._start
+
+    def byte_offset(self, index: int) -> int:
+        """Find the index in the original bytes of the character at the given index in the text.
+
+        Pure ASCII text in an ASCII-compatible encoding is resolved arithmetically. Otherwise,
+        the shorter of the text before and after the index is encoded to count its bytes.
+        """
+        if index < 0:
+            index += len(self._text)
+        if self._has_one_byte_per_char is None:
+            self._has_one_byte_per_char = has_one_byte_per_char(self._text, self._encoding)
+        if self._has_one_byte_per_char:
+            return self._start + index
+        if index <= len(self._text) // 2:
+            return self._start + len(self._text[:index].encode(self._encoding))
+        return self._end - len(self._text[index:].encode(self._encoding))
+
+    def char_index(self, byte_offset: int) -> int:
+        """Find the index in the text of the first character at or after the given index in the original bytes.
+
+        This is the inverse of byte_offset for indices that start a character.
+        """
+        n_bytes = min(max(byte_offset - self._start, 0), self.size)
+        if self._has_one_byte_per_char is None:
+            self._has_one_byte_per_char = has_one_byte_per_char(self._text, self._encoding)
+        if self._has_one_byte_per_char:
+            return n_bytes
+        # A character split by the offset is dropped, leaving the index of the character it starts.
+        index = len(self._text.encode(self._encoding)[:n_bytes].decode(self._encoding, errors='ignore'))
+        if self.byte_offset(index) < self._start + n_bytes:
+            index += 1
+        return index
     
     def __eq__(self, other):
         if not isinstance(other, DecodedChunk):
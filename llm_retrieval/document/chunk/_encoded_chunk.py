@@ -1,21 +1,27 @@
+from typing import Union
+
+
+EncodedChunkData = Union[bytes, bytearray, memoryview]
+
+
 class EncodedChunk:
     """An encoded chunk of bytes.
 
     Attributes:
-        data: The encoded bytes.
+        data: The encoded bytes, or a view of them.
         start: The start index of the chunk in the original bytes.
         end: The end index of the chunk in the original bytes.
         encoding: The encoding of the bytes.
     """
 
-    def __init__(self, data: bytes, start: int, end: int, encoding: str):
+    def __init__(self, data: EncodedChunkData, start: int, end: int, encoding: str):
         self._data = data
         self._start = start
         self._end = end
         self._encoding = encoding
 
     @property
-    def data(self) -> bytes:
+    def data(self) -> EncodedChunkData:
         return self._data
 
     @property
@@ -36,4 +42,4 @@ class EncodedChunk:
         return self.data == other.data and self.start == other.start and self.end == other.end
 
     def __repr__(self):
-        return f'{self.__class__.__name__}({self.data!r}, {self.start!r}, {self.end!r}, {self.encoding!r})'
+        return f'{self.__class__.__name__}({bytes(self.data)!r}, {self.start!r}, {self.end!r}, {self.encoding!r})'
@@ -1,9 +1,13 @@
 import abc
 import itertools
+from typing import AsyncIterator
 from typing import Iterable
 from typing import Union
 
 from llm_retrieval.document.chunk import DecodedChunk
+from llm_retrieval.utils.common.asynchronous import MAX_BUFFERED_ITEMS_DEFAULT
+from llm_retrieval.utils.common.asynchronous import iterate_in_thread
+from llm_retrieval.utils.common.encoding import encoded_length
 
 
 RawDecodedChunkStream = Iterable[str]
@@ -15,6 +19,18 @@ class DecodedChunkStreamInterface(Iterable[DecodedChunk], abc.ABC):
     def __iter__(self):
         pass
 
+    def __aiter__(self) -> AsyncIterator[DecodedChunk]:
+        """Iterates the stream on a worker thread, so that decoding and transforming do not block the running loop."""
+        return self.aiter()
+
+    def aiter(self, max_buffered: int = MAX_BUFFERED_ITEMS_DEFAULT) -> AsyncIterator[DecodedChunk]:
+        """Iterates the stream on a worker thread, transforming at most max_buffered chunks ahead.
+
+        The stream and the streams it is built on (e.g. an encoded chunk stream being read) run
+        together on the worker thread, so they advance only as fast as the chunks are consumed.
+        """
+        return iterate_in_thread(self, max_buffered)
+
     @abc.abstractmethod
     def __repr__(self):
         pass
@@ -86,10 +102,10 @@ class DecodedChunkStream(DecodedChunkStreamInterface):
             for raw_decoded_chunk, start in itertools.zip_longest(raw_stream, starts):
                 if start is None or raw_decoded_chunk is None:
                     raise ValueError('raw_stream and start must be the same length')
-                end = start + len(raw_decoded_chunk.encode(self._encoding))
+                end = start + encoded_length(raw_decoded_chunk, self._encoding)
                 yield DecodedChunk(raw_decoded_chunk, start, end, self._encoding)
         else:
             for raw_decoded_chunk in raw_stream:
-                end = start + len(raw_decoded_chunk.encode(self._encoding))
+                end = start + encoded_length(raw_decoded_chunk, self._encoding)
                 yield DecodedChunk(raw_decoded_chunk, start, end, self._encoding)
                 start = end
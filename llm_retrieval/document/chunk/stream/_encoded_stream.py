@@ -1,11 +1,16 @@
 import itertools
+from typing import AsyncIterator
+from typing import BinaryIO
 from typing import Iterable
 from typing import Union
 
 from llm_retrieval.document.chunk import EncodedChunk
+from llm_retrieval.document.chunk import EncodedChunkData
+from llm_retrieval.utils.common.asynchronous import MAX_BUFFERED_ITEMS_DEFAULT
+from llm_retrieval.utils.common.asynchronous import iterate_in_thread
 
 
-RawEncodedChunkStream = Iterable[bytes]
+RawEncodedChunkStream = Iterable[EncodedChunkData]
 
 
 class EncodedChunkStream(Iterable[EncodedChunk]):
@@ -26,6 +31,18 @@ class EncodedChunkStream(Iterable[EncodedChunk]):
     def __iter__(self):
         return iter(self._stream)
 
+    def __aiter__(self) -> AsyncIterator[EncodedChunk]:
+        """Iterates the stream on a worker thread, so that reading does not block the running loop."""
+        return self.aiter()
+
+    def aiter(self, max_buffered: int = MAX_BUFFERED_ITEMS_DEFAULT) -> AsyncIterator[EncodedChunk]:
+        """Iterates the stream on a worker thread, reading at most max_buffered chunks ahead.
+
+        The chunks are read ahead of the consumer, so the data of chunks read into a reused
+        buffer is copied.
+        """
+        return iterate_in_thread(map(self._owned, self), max_buffered)
+
     def __repr__(self):
         return f'{self.__class__.__name__}({self._stream!r})'
 
@@ -51,6 +68,41 @@ class EncodedChunkStream(Iterable[EncodedChunk]):
         """
         return self.append(self._wrap(raw_stream, start))
 
+    def append_read(
+        self,
+        readable: BinaryIO,
+        chunk_size: int,
+        start: int = 0,
+    ) -> 'EncodedChunkStream':
+        """Read a binary file-like object in chunks and append them to the stream.
+
+        If the readable supports readinto, every chunk is read into the same buffer
+        and the data of each chunk is a view that is only valid until the next chunk is read.
+
+        Args:
+            readable: The binary file-like object to read.
+            chunk_size: The maximum number of bytes in each chunk.
+            start: The start index of the first chunk in the original bytes.
+        """
+        return self.append_wrapped(self._read(readable, chunk_size), start)
+
+    @staticmethod
+    def _owned(encoded_chunk: EncodedChunk) -> EncodedChunk:
+        if isinstance(encoded_chunk.data, bytes):
+            return encoded_chunk
+        return EncodedChunk(bytes(encoded_chunk.data), encoded_chunk.start, encoded_chunk.end, encoded_chunk.encoding)
+
+    @staticmethod
+    def _read(readable: BinaryIO, chunk_size: int) -> RawEncodedChunkStream:
+        readinto = getattr(readable, 'readinto', None)
+        if readinto is None:
+            while raw_encoded_chunk := readable.read(chunk_size):
+                yield raw_encoded_chunk
+            return
+        buffer = memoryview(bytearray(chunk_size))
+        while n := readinto(buffer):
+            yield buffer[:n]
+
     def _wrap(
         self,
         raw_stream: RawEncodedChunkStream,
@@ -1,10 +1,20 @@
 import abc
+import codecs
+import itertools
 from typing import Iterable
+from typing import Iterator
 
 from . import EncodedChunkStream
 from . import DecodedChunkStream
 from llm_retrieval.document.chunk import DecodedChunk
-from llm_retrieval.utils.common.utf8 import lstrip_continuation_bytes
+from llm_retrieval.document.chunk import EncodedChunk
+from llm_retrieval.utils.common.encoding import MAX_BOM_SIZE
+from llm_retrieval.utils.common.encoding import may_start_with_bom
+from llm_retrieval.utils.common.encoding import resolve_bom
+from llm_retrieval.utils.common.encoding import LEADING_PARTIAL_CHARACTER_PROBE_SIZE
+from llm_retrieval.utils.common.encoding import leading_partial_character_size
+from llm_retrieval.utils.common.utf8 import MAX_UTF8_CONTINUATION_BYTES_PER_CHAR
+from llm_retrieval.utils.common.utf8 import leading_continuation_bytes
 from llm_retrieval.utils.common.utf8 import truncation_point
 
 
@@ -26,8 +36,11 @@ class EncodedToDecodedChunkStreamConverterWithSplitCharacterHealing(EncodedToDec
         """Decode a stream of encoded chunks into a stream of decoded chunks.
 
         The encoded chunks may be split in the middle of a character. This method will
-        attempt to heal the split by prepending the split bytes to the next chunk, if
-        the next chunk is contiguous. Otherwise, the split bytes will be discarded.
+        attempt to heal the split by joining the split bytes with the start of the next chunk,
+        if the next chunk is contiguous. Otherwise, the split bytes will be discarded.
+
+        Chunks are decoded from views of their data, so the data of each encoded chunk only
+        needs to remain valid until the next encoded chunk is requested.
 
         Raises:
             UnicodeDecodeError: If the encoded chunks cannot be decoded.
@@ -37,29 +50,180 @@ class EncodedToDecodedChunkStreamConverterWithSplitCharacterHealing(EncodedToDec
             raise NotImplementedError(f'Only utf-8 encoding is supported.')
 
         def converted_stream() -> Iterable[DecodedChunk]:
-            truncated_bytes = b''
+            # Holds the bytes of a character split across chunks, followed by the bytes of the
+            # next chunk that complete it. Reused across chunks.
+            buffer = bytearray()
+            n_truncated_bytes = 0
             start = 0
 
             for encoded_chunk in encoded_chunk_stream:
 
-                if encoded_chunk.start - len(truncated_bytes) != start:
-                    truncated_bytes = b''
+                encoded_chunk_bytes = memoryview(encoded_chunk.data)
+                healed_text = ''
+                n_healed_bytes = 0
+
+                if encoded_chunk.start - n_truncated_bytes != start:
+                    n_truncated_bytes = 0
                     start = encoded_chunk.start
-                    encoded_chunk_bytes = lstrip_continuation_bytes(encoded_chunk.data)
-                else:
-                    encoded_chunk_bytes = truncated_bytes + encoded_chunk.data
+                    encoded_chunk_bytes = encoded_chunk_bytes[leading_continuation_bytes(encoded_chunk_bytes):]
+                elif n_truncated_bytes:
+                    # Only the continuation bytes that complete the split character are copied in
+                    # after the truncated bytes, which stay in place at the front of the buffer.
+                    n_completing_bytes = leading_continuation_bytes(
+                        encoded_chunk_bytes[:MAX_UTF8_CONTINUATION_BYTES_PER_CHAR])
+                    n_bytes = n_truncated_bytes + n_completing_bytes
+                    buffer[n_truncated_bytes:n_bytes] = encoded_chunk_bytes[:n_completing_bytes]
+                    if n_completing_bytes == len(encoded_chunk_bytes):
+                        # The chunk may end before the character does, so it is decoded as the rest of the buffer.
+                        encoded_chunk_bytes = memoryview(buffer)[:n_bytes]
+                    else:
+                        with memoryview(buffer) as buffer_bytes:
+                            healed_text = str(buffer_bytes[:n_bytes], encoded_chunk_stream.encoding)
+                        n_healed_bytes = n_bytes
+                        encoded_chunk_bytes = encoded_chunk_bytes[n_completing_bytes:]
 
                 split = truncation_point(encoded_chunk_bytes)
-
-                if split < len(encoded_chunk_bytes):
-                    truncated_bytes = encoded_chunk_bytes[split:]
-                    encoded_chunk_bytes = encoded_chunk_bytes[:split]
-                else:
-                    truncated_bytes = b''
-
-                if encoded_chunk_bytes:
-                    end = start + len(encoded_chunk_bytes)
-                    yield DecodedChunk(encoded_chunk_bytes.decode(encoded_chunk_stream.encoding), start, end, encoded_chunk_stream.encoding)
+                n_truncated_bytes = len(encoded_chunk_bytes) - split
+
+                if n_healed_bytes or split:
+                    end = start + n_healed_bytes + split
+                    text = str(encoded_chunk_bytes[:split], encoded_chunk_stream.encoding)
+                    # The rest of the chunk is decoded in place, and its text joined to the healed character.
+                    text = healed_text + text if healed_text else text
+                    yield DecodedChunk(text, start, end, encoded_chunk_stream.encoding)
                     start = end
 
+                if n_truncated_bytes:
+                    truncated_bytes = bytes(encoded_chunk_bytes[split:])
+                    encoded_chunk_bytes.release()
+                    buffer[:n_truncated_bytes] = truncated_bytes
+
         return DecodedChunkStream(encoded_chunk_stream.encoding).append(converted_stream())
+
+
+class EncodedToDecodedChunkStreamConverterWithIncrementalDecoding(EncodedToDecodedChunkStreamConverter):
+    """Converts encoded chunk streams of any encoding supported by the codecs module."""
+
+    def __init__(self, errors: str = 'strict'):
+        """
+        Args:
+            errors: The error handling scheme of the decoder. See the codecs module for the options.
+        """
+        self._errors = errors
+
+    def decode(self, encoded_chunk_stream: 'EncodedChunkStream') -> DecodedChunkStream:
+        """Decode a stream of encoded chunks into a stream of decoded chunks.
+
+        Characters split across contiguous chunks are healed by an incremental decoder.
+        Partial characters at the start of noncontiguous chunks and at the end of the
+        stream are discarded.
+
+        A byte order mark at the start of the original bytes is skipped. If the encoding
+        expects one (e.g., utf-16 or utf-8-sig), the decoded chunks use the equivalent encoding
+        without one (e.g., utf-16-le), so that their offsets can be found by encoding their text.
+        The byte order is taken from the mark, requiring the first chunk to be read immediately.
+
+        Raises:
+            UnicodeDecodeError: If the encoded chunks cannot be decoded.
+            LookupError: If the encoding is unknown.
+        """
+
+        encoded_chunks = iter(encoded_chunk_stream)
+        encoding = encoded_chunk_stream.encoding
+        n_bom_bytes = 0
+
+        if may_start_with_bom(encoding):
+            head, encoded_chunks = self._peek_head(encoded_chunks, MAX_BOM_SIZE)
+            encoding, n_bom_bytes = resolve_bom(head, encoding)
+
+        decoder = codecs.getincrementaldecoder(encoding)(self._errors)
+
+        def converted_stream() -> Iterable[DecodedChunk]:
+            # The offset of the first byte that has not been decoded, and of the byte after the last one read.
+            start = None
+            position = None
+            # The first bytes of a noncontiguous chunk, held until there are enough of them to find the
+            # partial character that they start with, which may span several short chunks.
+            head = bytearray()
+            is_head = False
+
+            def decode_head() -> str:
+                nonlocal start
+                n_skipped_bytes = leading_partial_character_size(head, start, encoding)
+                start += n_skipped_bytes
+                text = decoder.decode(bytes(head[n_skipped_bytes:]))
+                head.clear()
+                return text
+
+            def decoded_end() -> int:
+                # The decoder holds the bytes of a character split across chunks until it is complete.
+                return position - len(decoder.getstate()[0])
+
+            for encoded_chunk in encoded_chunks:
+
+                encoded_chunk_bytes = memoryview(encoded_chunk.data)
+                encoded_chunk_start = encoded_chunk.start
+
+                if encoded_chunk_start < n_bom_bytes:
+                    n_skipped_bytes = min(n_bom_bytes - encoded_chunk_start, len(encoded_chunk_bytes))
+                    encoded_chunk_bytes = encoded_chunk_bytes[n_skipped_bytes:]
+                    encoded_chunk_start += n_skipped_bytes
+
+                if position is None or encoded_chunk_start != position:
+                    if is_head:
+                        text = decode_head()
+                        if text:
+                            yield DecodedChunk(text, start, decoded_end(), encoding)
+                    decoder.reset()
+                    start = position = encoded_chunk_start
+                    is_head = start != n_bom_bytes
+
+                text = ''
+                if is_head:
+                    n_head_bytes = min(LEADING_PARTIAL_CHARACTER_PROBE_SIZE - len(head), len(encoded_chunk_bytes))
+                    head += encoded_chunk_bytes[:n_head_bytes]
+                    encoded_chunk_bytes = encoded_chunk_bytes[n_head_bytes:]
+                    position += n_head_bytes
+                    if len(head) < LEADING_PARTIAL_CHARACTER_PROBE_SIZE:
+                        continue
+                    text = decode_head()
+                    is_head = False
+
+                chunk_text = decoder.decode(encoded_chunk_bytes)
+                text = text + chunk_text if text else chunk_text
+                position += len(encoded_chunk_bytes)
+                end = decoded_end()
+                if text:
+                    yield DecodedChunk(text, start, end, encoding)
+                start = end
+
+            if is_head:
+                text = decode_head()
+                if text:
+                    yield DecodedChunk(text, start, decoded_end(), encoding)
+
+        return DecodedChunkStream(encoding).append(converted_stream())
+
+    @staticmethod
+    def _peek_head(encoded_chunks: Iterator[EncodedChunk], size: int) -> tuple[bytes, Iterator[EncodedChunk]]:
+        """Read up to the given number of bytes from the start of the original bytes, without consuming any chunks.
+
+        Chunks shorter than the head are copied, in case the next chunk is read into the same buffer.
+        """
+        head = b''
+        peeked_encoded_chunks = []
+        for encoded_chunk in encoded_chunks:
+            if encoded_chunk.start != len(head):
+                peeked_encoded_chunks.append(encoded_chunk)
+                break
+            head += bytes(encoded_chunk.data[:size - len(head)])
+            if len(head) >= size:
+                peeked_encoded_chunks.append(encoded_chunk)
+                break
+            peeked_encoded_chunks.append(EncodedChunk(
+                bytes(encoded_chunk.data),
+                encoded_chunk.start,
+                encoded_chunk.end,
+                encoded_chunk.encoding,
+            ))
+        return head, itertools.chain(peeked_encoded_chunks, encoded_chunks)
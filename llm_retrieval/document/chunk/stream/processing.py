@@ -1,8 +1,20 @@
+import asyncio
+import functools
 import itertools
-from typing import Iterable, Union
+import math
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Iterator, Optional, Union
 
+from llm_retrieval.utils.common.asynchronous import iterate_in_thread
+from llm_retrieval.utils.common.asynchronous import shared_event_loop
+from llm_retrieval.utils.common.concurrency import AsyncConcurrencyGate
+from llm_retrieval.utils.common.concurrency import ConcurrencyLimit
+from llm_retrieval.utils.common.concurrency import FixedConcurrencyLimit
+from llm_retrieval.utils.common.concurrency import as_concurrency_limit
+from llm_retrieval.utils.common.encoding import encoded_length
 from llm_retrieval.utils.common.iterable import batched
-from llm_retrieval.utils.common.iterable import ConcurrentAsyncMapper
+from llm_retrieval.utils.common.iterable import abatched_with_budget
+from llm_retrieval.utils.common.iterable import batched_with_budget
+from llm_retrieval.utils.common.micro_batch import AsyncMicroBatcher
 from llm_retrieval.document.chunk import DecodedChunk
 from llm_retrieval.embedding.provider.base import EmbeddingClient
 from llm_retrieval.vector.store.provider.base import VectorStoreClient
@@ -10,17 +22,58 @@ from llm_retrieval.vector.store import StoredVector
 from llm_retrieval.vector.store import StoredVectorMetadata
 
 
-async def _embed_and_upsert_decoded_chunk_batch_async(
+QUEUED_EMBED_BATCHES_PER_CONCURRENT_EMBED_BATCH = 2
+QUEUED_UPSERT_BATCHES_PER_CONCURRENT_UPSERT_BATCH = 2
+MAX_BATCH_ATTEMPTS_DEFAULT = 3
+
+# The chunks of an embedding batch, with the prefix of their vector IDs and their metadata.
+_EmbedBatch = tuple[tuple[DecodedChunk, ...], str, StoredVectorMetadata]
+
+
+def _estimate_n_tokens(decoded_chunk: DecodedChunk) -> int:
+    if decoded_chunk.n_tokens is not None:
+        return decoded_chunk.n_tokens
+    # Every token is at least one byte of UTF-8, so the byte count bounds the token count.
+    return encoded_length(decoded_chunk.text, 'utf-8')
+
+
+def _abatched_for_embed(
+    decoded_chunks: AsyncIterable[DecodedChunk],
+    batch_size: int,
+    batch_tokens: Optional[int],
+) -> AsyncIterator[tuple[DecodedChunk, ...]]:
+    if batch_tokens is None:
+        return abatched_with_budget(decoded_chunks, batch_size, math.inf, lambda _: 0)
+    return abatched_with_budget(decoded_chunks, batch_size, batch_tokens, _estimate_n_tokens)
+
+
+def _batched_for_upsert(
+    stored_vectors: list[StoredVector],
+    vector_store_client: VectorStoreClient,
+    upsert_batch_size: int,
+) -> Iterable[tuple[StoredVector, ...]]:
+    if vector_store_client.UPSERT_PAYLOAD_BYTES is None:
+        return batched(stored_vectors, upsert_batch_size)
+    return batched_with_budget(
+        stored_vectors,
+        upsert_batch_size,
+        vector_store_client.UPSERT_PAYLOAD_BYTES,
+        vector_store_client.estimate_upsert_payload_bytes,
+    )
+
+
+async def _embed_decoded_chunk_batch_async(
     decoded_chunk_batch: Iterable[DecodedChunk],
     vector_prefix: str,
     metadata: StoredVectorMetadata,
-    embedding_client: EmbeddingClient,
+    embed: Callable[[list[DecodedChunk]], Awaitable[list]],
     vector_store_client: VectorStoreClient,
+    upsert_batch_size: int,
+    upsert_queue: asyncio.Queue,
 ) -> None:
     if not decoded_chunk_batch:
         return
-    texts = [decoded_chunk.text for decoded_chunk in decoded_chunk_batch]
-    embeddings = await embedding_client.embed_batch_async(texts)
+    embeddings = await embed(list(decoded_chunk_batch))
     stored_vectors = [
         StoredVector(
             id = f'{vector_prefix}:{decoded_chunk.start}-{decoded_chunk.end}',
@@ -29,47 +82,436 @@ async def _embed_and_upsert_decoded_chunk_batch_async(
         )
         for embedding, decoded_chunk in zip(embeddings, decoded_chunk_batch)
     ]
-    await vector_store_client.upsert_batch_async(stored_vectors)
+    for stored_vector_batch in _batched_for_upsert(stored_vectors, vector_store_client, upsert_batch_size):
+        # Waits while the queue is full, so embedding cannot run ahead of upserting.
+        await upsert_queue.put(list(stored_vector_batch))
 
 
-def embed_and_upsert_decoded_chunk_stream(
-    decoded_chunk_stream: Iterable[DecodedChunk],
-    vector_prefixes: Union[str, Iterable[str]],
-    metadata: Union[StoredVectorMetadata, Iterable[StoredVectorMetadata]],
-    embedding_client: EmbeddingClient,
+async def _upsert_stored_vector_batches_async(
+    upsert_queue: asyncio.Queue,
     vector_store_client: VectorStoreClient,
-    max_concurrent_batches: int,
-    batch_size: int = None,
+    upsert_concurrency_limit: ConcurrencyLimit,
+    upsert_gate: AsyncConcurrencyGate,
+    failures: list[BaseException],
+    failed_upsert_batches: list[tuple[list[StoredVector], BaseException]],
+) -> None:
+    while (stored_vector_batch := await upsert_queue.get()) is not None:
+        # Keep draining the queue after a failure, so that embedding never waits on a dead stage.
+        if failures:
+            continue
+        await upsert_gate.acquire()
+        try:
+            await vector_store_client.upsert_batch_async(
+                stored_vector_batch,
+                record_request=upsert_concurrency_limit.record,
+            )
+        except Exception as e:
+            # Only this batch is upserted again, so the other batches carry on.
+            failed_upsert_batches.append((stored_vector_batch, e))
+        finally:
+            upsert_gate.release()
+
+
+async def _aiter_embed_batches(
+    decoded_chunks: AsyncIterator[DecodedChunk],
+    vector_prefixes: Iterator[str],
+    metadata: Iterator[StoredVectorMetadata],
+    batch_size: int,
+    batch_tokens: Optional[int],
+) -> AsyncIterator[_EmbedBatch]:
+    try:
+        async for decoded_chunk_batch in _abatched_for_embed(decoded_chunks, batch_size, batch_tokens):
+            # The prefix and metadata go with the batch, so that a failed batch is embedded again as it was.
+            yield decoded_chunk_batch, next(vector_prefixes), next(metadata)
+    finally:
+        # Stops the stream's worker thread, if any, when stopping early.
+        aclose = getattr(decoded_chunks, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+
+
+async def _aiter_list(items: list) -> AsyncIterator:
+    for item in items:
+        yield item
+
+
+async def _queue_embed_batches_async(
+    embed_batches: AsyncIterator[_EmbedBatch],
+    embed_queue: asyncio.Queue,
+    failures: list[BaseException],
 ) -> None:
-    assert batch_size is None or batch_size > 0
-    assert max_concurrent_batches > 0
+    try:
+        async for embed_batch in embed_batches:
+            if failures:
+                break
+            # Waits while the queue is full, so the stream is read no faster than it is embedded.
+            await embed_queue.put(embed_batch)
+    except Exception as e:
+        failures.append(e)
+    finally:
+        await embed_batches.aclose()
+        await embed_queue.put(None)
+
+
+async def _embed_and_upsert_batches_async(
+    embed_batches: AsyncIterator[_EmbedBatch],
+    upsert_batches: list[list[StoredVector]],
+    embed: Callable[[list[DecodedChunk]], Awaitable[list]],
+    vector_store_client: VectorStoreClient,
+    upsert_concurrency_limit: ConcurrencyLimit,
+    embed_gate: AsyncConcurrencyGate,
+    upsert_gate: AsyncConcurrencyGate,
+    max_queued_embed_batches: int,
+    max_queued_upsert_batches: int,
+    upsert_batch_size: int,
+) -> tuple[list[tuple[_EmbedBatch, BaseException]], list[tuple[list[StoredVector], BaseException]]]:
+    # A failure to read the stream is fatal, but a failed batch is only recorded, to be run again.
+    failures = []
+    failed_embed_batches = []
+    failed_upsert_batches = []
+    embed_queue = asyncio.Queue(max_queued_embed_batches)
+    upsert_queue = asyncio.Queue(max_queued_upsert_batches)
+    embed_tasks = set()
+    batching_task = asyncio.ensure_future(_queue_embed_batches_async(embed_batches, embed_queue, failures))
+    # Enough workers for the highest limit; the gate holds back those beyond the current limit.
+    upsert_tasks = [
+        asyncio.ensure_future(_upsert_stored_vector_batches_async(
+            upsert_queue,
+            vector_store_client,
+            upsert_concurrency_limit,
+            upsert_gate,
+            failures,
+            failed_upsert_batches,
+        ))
+        for _ in range(upsert_concurrency_limit.max_limit)
+    ]
+
+    def cleanup_embed_task(embed_batch: _EmbedBatch, task: asyncio.Future) -> None:
+        embed_tasks.discard(task)
+        embed_gate.release()
+        if not task.cancelled() and task.exception() is not None:
+            failed_embed_batches.append((embed_batch, task.exception()))
+
+    try:
+        for stored_vector_batch in upsert_batches:
+            await upsert_queue.put(stored_vector_batch)
 
-    max_batch_size = min(embedding_client.EMBED_BATCH_SIZE, vector_store_client.UPSERT_BATCH_SIZE)
-    if batch_size is None:
-        batch_size = max_batch_size
-    assert batch_size <= max_batch_size
+        while (embed_batch := await embed_queue.get()) is not None:
+            # Keep draining the queue after a failure, so that batching never waits on a dead stage.
+            if failures:
+                continue
+            decoded_chunk_batch, vector_prefix, batch_metadata = embed_batch
+            await embed_gate.acquire()
+            embed_task = asyncio.ensure_future(_embed_decoded_chunk_batch_async(
+                decoded_chunk_batch,
+                vector_prefix=vector_prefix,
+                metadata=batch_metadata,
+                embed=embed,
+                vector_store_client=vector_store_client,
+                upsert_batch_size=upsert_batch_size,
+                upsert_queue=upsert_queue,
+            ))
+            embed_tasks.add(embed_task)
+            embed_task.add_done_callback(functools.partial(cleanup_embed_task, embed_batch))
 
-    if isinstance(vector_prefixes, str):
-        vector_prefixes = itertools.repeat(vector_prefixes)
+        await batching_task
+        await asyncio.gather(*embed_tasks, return_exceptions=True)
+        for _ in upsert_tasks:
+            await upsert_queue.put(None)
+        await asyncio.gather(*upsert_tasks)
+    finally:
+        for task in itertools.chain([batching_task], embed_tasks, upsert_tasks):
+            task.cancel()
+        await asyncio.gather(batching_task, *embed_tasks, *upsert_tasks, return_exceptions=True)
 
-    if isinstance(metadata, StoredVectorMetadata):
-        metadata = itertools.repeat(metadata)
+    if failures:
+        raise failures[0]
+    return failed_embed_batches, failed_upsert_batches
 
-    vector_prefixes = iter(vector_prefixes)
-    metadata = iter(metadata)
 
-    async def _embed_and_upsert_decoded_chunk_batch_async_wrapper(decoded_chunk_batch: Iterable[DecodedChunk]) -> None:
-        await _embed_and_upsert_decoded_chunk_batch_async(
-            decoded_chunk_batch,
-            vector_prefix=next(vector_prefixes),
-            metadata=next(metadata),
-            embedding_client=embedding_client,
+async def _embed_and_upsert_decoded_chunks_async(
+    decoded_chunks: AsyncIterator[DecodedChunk],
+    vector_prefixes: Iterator[str],
+    metadata: Iterator[StoredVectorMetadata],
+    embed: Callable[[list[DecodedChunk]], Awaitable[list]],
+    vector_store_client: VectorStoreClient,
+    upsert_concurrency_limit: ConcurrencyLimit,
+    embed_gate: AsyncConcurrencyGate,
+    upsert_gate: AsyncConcurrencyGate,
+    max_queued_embed_batches: int,
+    max_queued_upsert_batches: int,
+    batch_size: int,
+    batch_tokens: Optional[int],
+    upsert_batch_size: int,
+    max_batch_attempts: int,
+) -> None:
+    embed_batches = _aiter_embed_batches(decoded_chunks, vector_prefixes, metadata, batch_size, batch_tokens)
+    upsert_batches = []
+    for _ in range(max_batch_attempts):
+        failed_embed_batches, failed_upsert_batches = await _embed_and_upsert_batches_async(
+            embed_batches,
+            upsert_batches,
+            embed=embed,
             vector_store_client=vector_store_client,
+            upsert_concurrency_limit=upsert_concurrency_limit,
+            embed_gate=embed_gate,
+            upsert_gate=upsert_gate,
+            max_queued_embed_batches=max_queued_embed_batches,
+            max_queued_upsert_batches=max_queued_upsert_batches,
+            upsert_batch_size=upsert_batch_size,
+        )
+        if not failed_embed_batches and not failed_upsert_batches:
+            return
+        # Only the failed batches are run again, not the whole stream.
+        embed_batches = _aiter_list([embed_batch for embed_batch, _ in failed_embed_batches])
+        upsert_batches = [stored_vector_batch for stored_vector_batch, _ in failed_upsert_batches]
+
+    raise (failed_embed_batches or failed_upsert_batches)[0][1]
+
+
+class EmbedAndUpsertPipeline:
+    """Embeds the chunks of streams and upserts the embeddings into a vector store.
+
+    The chunks pass through three stages: batching, in batches of up to batch_size chunks and
+    batch_tokens tokens, then embedding, then upserting, in batches of up to upsert_batch_size
+    vectors and the store's payload limit. The embedding and upserting stages have their own
+    concurrency limits, and the stages are joined by bounded queues, so that a slow vector store
+    holds back embedding, which holds back the reading of the stream.
+
+    Any number of streams may be run through the pipeline at once. Each has its own batches and
+    queues, and fails on its own, but the requests of all of them are admitted within the same
+    concurrency limits, so that running more streams at once does not multiply the load on the
+    providers. The pipeline must only be run on one event loop, e.g. the shared one.
+
+    A failed embedding or upsert batch does not stop the rest of its stream. Once the stream has
+    been read, only the failed batches are run again, up to max_batch_attempts times in all, before
+    the stream fails with the first error of the last attempt. A failure to read the stream fails
+    it at once.
+
+    If max_batch_wait_seconds is set, the embedding batches of all streams are pooled into shared
+    requests (see AsyncMicroBatcher), so that the partly filled batches at the ends of many short
+    streams fill a few requests rather than one each. The embeddings are routed back to the streams
+    the chunks came from, but a failed request then fails every stream with chunks in it.
+    """
+
+    def __init__(
+        self,
+        embedding_client: EmbeddingClient,
+        vector_store_client: VectorStoreClient,
+        max_concurrent_batches: Union[int, ConcurrencyLimit],
+        batch_size: int = None,
+        batch_tokens: int = None,
+        upsert_batch_size: int = None,
+        max_concurrent_upsert_batches: Union[int, ConcurrencyLimit] = None,
+        max_queued_upsert_batches: int = None,
+        max_queued_embed_batches: int = None,
+        max_batch_wait_seconds: Optional[float] = None,
+        max_batch_attempts: int = MAX_BATCH_ATTEMPTS_DEFAULT,
+    ):
+        """
+        Args:
+            embedding_client: The client used to embed the chunks.
+            vector_store_client: The client used to upsert the vectors.
+            max_concurrent_batches: The maximum number of concurrent embedding batches, or a concurrency
+                limit (e.g. AimdConcurrencyLimit) that adapts to the latency and errors of the requests.
+            batch_size: The number of chunks per embedding batch. Defaults to the embedding client's limit.
+            batch_tokens: The number of tokens per embedding batch. Defaults to the embedding client's limit.
+                Chunks without a known token count are counted by their UTF-8 bytes, an upper bound.
+            upsert_batch_size: The number of vectors per upsert batch. Defaults to the vector store client's limit.
+            max_concurrent_upsert_batches: The maximum number of concurrent upsert batches, or a concurrency
+                limit. Defaults to the same number as max_concurrent_batches, but not the same adaptive limit.
+            max_queued_upsert_batches: The maximum number of upsert batches waiting for an upsert, per stream.
+                Defaults to a multiple of max_concurrent_upsert_batches.
+            max_queued_embed_batches: The maximum number of embedding batches waiting for an embedding, per stream.
+                Defaults to a multiple of max_concurrent_batches.
+            max_batch_wait_seconds: The longest a chunk waits for chunks of other streams to fill its embedding
+                request. If None, each stream's batches are sent as they are.
+            max_batch_attempts: The number of times a stream's failed embedding or upsert batches are run
+                before the stream fails. The batches that succeeded are not run again.
+        """
+        embed_concurrency_limit = as_concurrency_limit(max_concurrent_batches)
+        if max_concurrent_upsert_batches is None:
+            max_concurrent_upsert_batches = embed_concurrency_limit.limit
+        upsert_concurrency_limit = as_concurrency_limit(max_concurrent_upsert_batches)
+        if max_queued_upsert_batches is None:
+            max_queued_upsert_batches = upsert_concurrency_limit.limit * QUEUED_UPSERT_BATCHES_PER_CONCURRENT_UPSERT_BATCH
+        if max_queued_embed_batches is None:
+            max_queued_embed_batches = embed_concurrency_limit.limit * QUEUED_EMBED_BATCHES_PER_CONCURRENT_EMBED_BATCH
+        if batch_size is None:
+            batch_size = embedding_client.EMBED_BATCH_SIZE
+        if batch_tokens is None:
+            batch_tokens = embedding_client.EMBED_BATCH_TOKENS
+        if upsert_batch_size is None:
+            upsert_batch_size = vector_store_client.UPSERT_BATCH_SIZE
+
+        assert max_queued_upsert_batches > 0
+        assert max_queued_embed_batches > 0
+        assert 0 < batch_size <= embedding_client.EMBED_BATCH_SIZE
+        assert batch_tokens is None or batch_tokens > 0
+        assert 0 < upsert_batch_size <= vector_store_client.UPSERT_BATCH_SIZE
+        assert max_batch_attempts > 0
+
+        self._embedding_client = embedding_client
+        self._vector_store_client = vector_store_client
+        self._embed_concurrency_limit = embed_concurrency_limit
+        self._upsert_concurrency_limit = upsert_concurrency_limit
+        # Shared by every stream run through the pipeline.
+        self._embed_gate = AsyncConcurrencyGate(embed_concurrency_limit)
+        self._upsert_gate = AsyncConcurrencyGate(upsert_concurrency_limit)
+        self._max_queued_embed_batches = max_queued_embed_batches
+        self._max_queued_upsert_batches = max_queued_upsert_batches
+        self._batch_size = batch_size
+        self._batch_tokens = batch_tokens
+        self._upsert_batch_size = upsert_batch_size
+        self._max_batch_attempts = max_batch_attempts
+        self._micro_batcher = None
+        if max_batch_wait_seconds is not None:
+            self._micro_batcher = AsyncMicroBatcher(
+                self._embed_gated,
+                batch_size,
+                max_batch_wait_seconds,
+                math.inf if batch_tokens is None else batch_tokens,
+                _estimate_n_tokens if batch_tokens is not None else None,
+            )
+
+    def stats(self) -> Optional[dict[str, float]]:
+        """Returns the statistics of the pooled embedding requests, or None if they are not pooled."""
+        return self._micro_batcher.stats() if self._micro_batcher is not None else None
+
+    async def _embed(self, decoded_chunks: list[DecodedChunk]) -> list:
+        texts = [decoded_chunk.text for decoded_chunk in decoded_chunks]
+        # The chunks were counted when they were resized, so the client need not count them again.
+        n_tokens_per_text = [decoded_chunk.n_tokens for decoded_chunk in decoded_chunks]
+        if None in n_tokens_per_text:
+            n_tokens_per_text = None
+        return await self._embedding_client.embed_batch_async(
+            texts,
+            n_tokens_per_text=n_tokens_per_text,
+            record_request=self._embed_concurrency_limit.record,
+        )
+
+    async def _embed_gated(self, decoded_chunks: list[DecodedChunk]) -> list:
+        await self._embed_gate.acquire()
+        try:
+            return await self._embed(decoded_chunks)
+        finally:
+            self._embed_gate.release()
+
+    async def run(
+        self,
+        decoded_chunk_stream: Union[Iterable[DecodedChunk], AsyncIterable[DecodedChunk]],
+        vector_prefixes: Union[str, Iterable[str]],
+        metadata: Union[StoredVectorMetadata, Iterable[StoredVectorMetadata]],
+    ) -> None:
+        """Embeds the chunks of a stream and upserts the embeddings, returning once all are upserted.
+
+        A stream that is only synchronously iterable is iterated on a worker thread.
+
+        Args:
+            decoded_chunk_stream: The chunks to embed and upsert.
+            vector_prefixes: The prefix of the vector IDs, or a prefix per embedding batch.
+            metadata: The metadata of the vectors, or the metadata per embedding batch.
+        """
+        if isinstance(vector_prefixes, str):
+            vector_prefixes = itertools.repeat(vector_prefixes)
+
+        if isinstance(metadata, StoredVectorMetadata):
+            metadata = itertools.repeat(metadata)
+
+        if hasattr(decoded_chunk_stream, '__aiter__'):
+            decoded_chunks = decoded_chunk_stream.__aiter__()
+        else:
+            decoded_chunks = iterate_in_thread(decoded_chunk_stream)
+
+        if self._micro_batcher is None:
+            embed = self._embed
+            embed_gate = self._embed_gate
+        else:
+            embed = self._micro_batcher.submit
+            # The shared gate admits the pooled requests, so a stream's own batches are only bounded per stream,
+            # and never hold a slot that a pooled request needs.
+            embed_gate = AsyncConcurrencyGate(FixedConcurrencyLimit(self._embed_concurrency_limit.max_limit))
+
+        await _embed_and_upsert_decoded_chunks_async(
+            decoded_chunks,
+            vector_prefixes=iter(vector_prefixes),
+            metadata=iter(metadata),
+            embed=embed,
+            vector_store_client=self._vector_store_client,
+            upsert_concurrency_limit=self._upsert_concurrency_limit,
+            embed_gate=embed_gate,
+            upsert_gate=self._upsert_gate,
+            max_queued_embed_batches=self._max_queued_embed_batches,
+            max_queued_upsert_batches=self._max_queued_upsert_batches,
+            batch_size=self._batch_size,
+            batch_tokens=self._batch_tokens,
+            upsert_batch_size=self._upsert_batch_size,
+            max_batch_attempts=self._max_batch_attempts,
         )
 
-    mapper = ConcurrentAsyncMapper(
-        _embed_and_upsert_decoded_chunk_batch_async_wrapper,
+
+async def embed_and_upsert_decoded_chunk_stream_async(
+    decoded_chunk_stream: Union[Iterable[DecodedChunk], AsyncIterable[DecodedChunk]],
+    vector_prefixes: Union[str, Iterable[str]],
+    metadata: Union[StoredVectorMetadata, Iterable[StoredVectorMetadata]],
+    embedding_client: EmbeddingClient,
+    vector_store_client: VectorStoreClient,
+    max_concurrent_batches: Union[int, ConcurrencyLimit],
+    batch_size: int = None,
+    batch_tokens: int = None,
+    upsert_batch_size: int = None,
+    max_concurrent_upsert_batches: Union[int, ConcurrencyLimit] = None,
+    max_queued_upsert_batches: int = None,
+    max_queued_embed_batches: int = None,
+) -> None:
+    """Embeds the chunks of a stream and upserts the embeddings into a vector store.
+
+    Runs the stream through a pipeline of its own. See EmbedAndUpsertPipeline for the arguments.
+    """
+    pipeline = EmbedAndUpsertPipeline(
+        embedding_client,
+        vector_store_client,
         max_concurrent_batches,
+        batch_size=batch_size,
+        batch_tokens=batch_tokens,
+        upsert_batch_size=upsert_batch_size,
+        max_concurrent_upsert_batches=max_concurrent_upsert_batches,
+        max_queued_upsert_batches=max_queued_upsert_batches,
+        max_queued_embed_batches=max_queued_embed_batches,
     )
+    await pipeline.run(decoded_chunk_stream, vector_prefixes, metadata)
+
 
-    mapper(batched(decoded_chunk_stream, batch_size))
+def embed_and_upsert_decoded_chunk_stream(
+    decoded_chunk_stream: Union[Iterable[DecodedChunk], AsyncIterable[DecodedChunk]],
+    vector_prefixes: Union[str, Iterable[str]],
+    metadata: Union[StoredVectorMetadata, Iterable[StoredVectorMetadata]],
+    embedding_client: EmbeddingClient,
+    vector_store_client: VectorStoreClient,
+    max_concurrent_batches: Union[int, ConcurrencyLimit],
+    batch_size: int = None,
+    batch_tokens: int = None,
+    upsert_batch_size: int = None,
+    max_concurrent_upsert_batches: Union[int, ConcurrencyLimit] = None,
+    max_queued_upsert_batches: int = None,
+    max_queued_embed_batches: int = None,
+) -> None:
+    """Embeds the chunks of a stream and upserts the embeddings into a vector store, waiting until done.
+
+    Runs embed_and_upsert_decoded_chunk_stream_async on the process-wide shared loop, which outlives
+    the call, and so do the connections the clients bind to it. See it for the arguments.
+    """
+    shared_event_loop.run(embed_and_upsert_decoded_chunk_stream_async(
+        decoded_chunk_stream,
+        vector_prefixes,
+        metadata,
+        embedding_client,
+        vector_store_client,
+        max_concurrent_batches,
+        batch_size=batch_size,
+        batch_tokens=batch_tokens,
+        upsert_batch_size=upsert_batch_size,
+        max_concurrent_upsert_batches=max_concurrent_upsert_batches,
+        max_queued_upsert_batches=max_queued_upsert_batches,
+        max_queued_embed_batches=max_queued_embed_batches,
+    ))
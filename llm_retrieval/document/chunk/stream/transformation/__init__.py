@@ -1,3 +1,5 @@
 from ._decoded_transformation import DecodedChunkStreamTransformer
+from ._decoded_transformation import DecodedChunkStreamBoundaryTrimmer
 from ._decoded_transformation import DecodedChunkStreamSplitWordHealer
-from ._decoded_transformation import DecodedChunkStreamResizerByNumTokens
\ No newline at end of file
+from ._decoded_transformation import DecodedChunkStreamResizerByNumTokens
+from ._decoded_transformation import MAX_BOUNDARY_OVERHANG_DEFAULT
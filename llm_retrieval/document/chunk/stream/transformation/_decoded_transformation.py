@@ -1,22 +1,28 @@
 import abc
-import itertools
+import codecs
 from typing import Iterable
+from typing import Optional
 from typing import Union
 
 import tiktoken
 
 from llm_retrieval.document.chunk import DecodedChunk
 from llm_retrieval.document.chunk.stream import DecodedChunkStreamInterface
-from llm_retrieval.utils.common.sequence import index_any
+from llm_retrieval.tokenizer import TOKEN_ENCODING_DEFAULT
+from llm_retrieval.tokenizer import get_tokenizer
+from llm_retrieval.utils.common.encoding import encoded_length
+from llm_retrieval.utils.common.sequence import DelimiterScanner
+from llm_retrieval.utils.common.utf8 import truncation_point
 
 
-TOKEN_ENCODING_DEFAULT = 'cl100k_base'
+TOKEN_BYTES_ENCODING = 'utf-8'
 PREFERRED_CHUNK_DELIMITERS_DEFAULT = '.!?\n'
 WORD_DELIMITERS_DEFAULT = ' .,;:!?-—\t\n\r\f\v'
 MIN_TOKENS_PER_CHUNK_DEFAULT = 50
 MAX_TOKENS_PER_CHUNK_DEFAULT = 200
-
-tokenizer_default = tiktoken.get_encoding(TOKEN_ENCODING_DEFAULT)
+MAX_BOUNDARY_OVERHANG_DEFAULT = 4096
+# The most bytes a character takes in any supported encoding (UTF-8 and UTF-32).
+MAX_CHARACTER_SIZE = 4
 
 
 class DecodedChunkStreamTransformer(DecodedChunkStreamInterface, abc.ABC):
@@ -52,6 +58,143 @@ class DecodedChunkStreamTransformer(DecodedChunkStreamInterface, abc.ABC):
         pass
 
 
+class DecodedChunkStreamBoundaryTrimmer(DecodedChunkStreamTransformer):
+    """Trims a decoded chunk stream to one part of the original bytes, cut at word boundaries.
+
+    Each boundary of the part is moved to the first word delimiter within max_overhang bytes at
+    or after it. If there is none, it is left in place, or moved to the end of the original bytes
+    if they end within the overhang. The cut depends only on the bytes after the
+    boundary, so the parts on either side of a boundary cut it at the same place, and every byte
+    of the original bytes is in exactly one trimmed part. The stream must extend read_overhang bytes
+    past the end of the part, unless the part ends at the end of the original bytes, so that a
+    stream ending within the overhang means that the original bytes end there.
+
+    The trimmed stream starts and ends at word boundaries, so it is meant to be followed by
+    a DecodedChunkStreamSplitWordHealer that trusts them.
+    """
+
+    def __init__(
+        self,
+        stream: DecodedChunkStreamInterface,
+        start: int,
+        end: int,
+        max_overhang: int = MAX_BOUNDARY_OVERHANG_DEFAULT,
+        word_delimiters: str = WORD_DELIMITERS_DEFAULT,
+    ):
+        """
+        Args:
+            stream: The stream to trim, which must be contiguous.
+            start: The start index of the part in the original bytes.
+            end: The end index of the part in the original bytes.
+            max_overhang: The maximum number of bytes that a boundary is moved by.
+            word_delimiters: The characters that delimit words.
+        """
+        super().__init__(stream)
+        if not 0 <= start <= end:
+            raise ValueError('start and end must satisfy 0 <= start <= end')
+        self._start = start
+        self._end = end
+        self._max_overhang = max_overhang
+        self._word_delimiter_scanner = DelimiterScanner(word_delimiters)
+
+    @staticmethod
+    def read_overhang(max_overhang: int = MAX_BOUNDARY_OVERHANG_DEFAULT) -> int:
+        """The number of bytes past the end of a part that must be read to trim it.
+
+        The character that starts last within the overhang must be read in full.
+        """
+        return max_overhang + MAX_CHARACTER_SIZE - 1
+
+    def _transformed_iter(self) -> Iterable[DecodedChunk]:
+        # Chunks within a boundary's overhang are held until it is known where the boundary is cut.
+        held = []
+        start = 0 if self._start == 0 else None
+
+        for chunk in self._decoratee:
+
+            if start is None:
+                chunk = self._slice(chunk, self._start, None)
+                if chunk is None:
+                    continue
+                start = self._find_cut(chunk, self._start)
+                if start is not None:
+                    held.clear()
+                    chunk = self._slice(chunk, start, None)
+                elif chunk.end < self._start + self._max_overhang:
+                    held.append(chunk)
+                    continue
+                else:
+                    start = self._start
+                    chunk = self._joined(held, chunk)
+                    held.clear()
+                if chunk is None:
+                    continue
+
+            if chunk.end <= self._end:
+                yield chunk
+                continue
+
+            before_end = self._slice(chunk, None, self._end)
+            if before_end is not None:
+                yield before_end
+            after_end = self._slice(chunk, self._end, None)
+            if after_end is None:
+                # The last character starts before the end, but ends after it.
+                continue
+            end = self._find_cut(after_end, self._end)
+            if end is not None:
+                yield from held
+                before_cut = self._slice(after_end, None, end)
+                if before_cut is not None:
+                    yield before_cut
+                return
+            if after_end.end >= self._end + self._max_overhang:
+                # No word boundary near the end, so the part is cut at its end.
+                return
+            held.append(after_end)
+
+        # The original bytes ended within an overhang, which makes their end the cut. If it was the
+        # start's overhang, the part is empty, having been taken by the part before.
+        if start is not None:
+            yield from held
+
+    def _find_cut(self, chunk: DecodedChunk, boundary: int) -> Optional[int]:
+        """Find the index in the original bytes of the first word delimiter in a chunk within the overhang of a boundary."""
+        index = self._word_delimiter_scanner.find(
+            chunk.text,
+            chunk.char_index(boundary),
+            chunk.char_index(boundary + self._max_overhang),
+        )
+        return chunk.byte_offset(index) if index != -1 else None
+
+    @staticmethod
+    def _slice(chunk: DecodedChunk, start: Optional[int], end: Optional[int]) -> Optional[DecodedChunk]:
+        """Slice a chunk by indices in the original bytes, returning None if the slice is empty."""
+        text_start = 0 if start is None else chunk.char_index(start)
+        text_end = len(chunk.text) if end is None else chunk.char_index(end)
+        if text_start >= text_end:
+            return None
+        if text_start == 0 and text_end == len(chunk.text):
+            return chunk
+        return DecodedChunk(
+            chunk.text[text_start:text_end],
+            chunk.byte_offset(text_start),
+            chunk.byte_offset(text_end),
+            chunk.encoding,
+        )
+
+    @staticmethod
+    def _joined(chunks: list[DecodedChunk], chunk: DecodedChunk) -> DecodedChunk:
+        if not chunks:
+            return chunk
+        return DecodedChunk(
+            ''.join(c.text for c in chunks) + chunk.text,
+            chunks[0].start,
+            chunk.end,
+            chunk.encoding,
+        )
+
+
 class DecodedChunkStreamSplitWordHealer(DecodedChunkStreamTransformer):
     """Heals a decoded chunk stream by moving words split across chunks to the next chunk."""
 
@@ -59,14 +202,21 @@ class DecodedChunkStreamSplitWordHealer(DecodedChunkStreamTransformer):
         self,
         stream: DecodedChunkStreamInterface,
         word_delimiters: str = WORD_DELIMITERS_DEFAULT,
+        trust_stream_boundaries: bool = False,
     ):
         """
         Args:
             stream: The stream to heal.
             word_delimiters: The characters that delimit words.
+            trust_stream_boundaries: Whether the stream starts and ends at word boundaries, e.g. when
+                trimmed by DecodedChunkStreamBoundaryTrimmer, so that its first and last words are kept
+                rather than discarded as possibly split, and whitespace is kept, between words and at the end,
+                so that the healed stream covers the same bytes as the stream, e.g. the whole trimmed part.
         """
         super().__init__(stream)
         self._word_delimiters = word_delimiters
+        self._word_delimiter_scanner = DelimiterScanner(word_delimiters)
+        self._trust_stream_boundaries = trust_stream_boundaries
 
     def _transformed_iter(self) -> Iterable[DecodedChunk]:
         """Repair words split across chunks by moving them entirely to the next chunk.
@@ -75,40 +225,103 @@ class DecodedChunkStreamSplitWordHealer(DecodedChunkStreamTransformer):
         """
 
         prefix = ''
+        prefix_size = 0
         start = 0
+        is_first_chunk = True
+        skipped_whitespace = ''
 
         for chunk in self._decoratee:
 
-            is_contiguous_with_previous_chunk = chunk.start - len(prefix.encode(self._decoratee.encoding)) == start
+            is_contiguous_with_previous_chunk = chunk.start - prefix_size == start
 
             if not is_contiguous_with_previous_chunk:
                 prefix = ''
+                skipped_whitespace = ''
                 start = chunk.start
 
             chunk_text = prefix + chunk.text
-            last_word_delimiter = index_any(chunk_text, set(self._word_delimiters), reverse=True)
+            last_word_delimiter = self._word_delimiter_scanner.rfind(chunk_text)
             missing_prefix = not is_contiguous_with_previous_chunk and start > 0
+            if is_first_chunk and self._trust_stream_boundaries:
+                missing_prefix = False
+            is_first_chunk = False
 
             if missing_prefix:
-                first_word_delimiter = index_any(chunk_text, set(self._word_delimiters))
+                first_word_delimiter = self._word_delimiter_scanner.find(chunk_text)
 
+            # The prefix never contains a word delimiter, so any delimiter found is within the chunk's own text.
+            chunk_text_offset = len(prefix)
             prefix = ''
+            prefix_size = 0
             end = chunk.end
 
             if last_word_delimiter != -1:
                 prefix = chunk_text[last_word_delimiter + 1:]
-                end = chunk.end - len(prefix.encode(self._decoratee.encoding))
+                end = chunk.byte_offset(last_word_delimiter + 1 - chunk_text_offset)
+                prefix_size = chunk.end - end
                 chunk_text = chunk_text[:last_word_delimiter + 1]
 
             if missing_prefix and first_word_delimiter > 0:
-                start = chunk.start + first_word_delimiter
+                start = chunk.byte_offset(first_word_delimiter)
                 chunk_text = chunk_text[first_word_delimiter:]
 
             if chunk_text and not chunk_text.isspace():
-                yield DecodedChunk(chunk_text, start, end, self._decoratee.encoding)
+                # Whitespace held back from the previous chunks keeps a trusted stream contiguous.
+                start -= encoded_length(skipped_whitespace, self._decoratee.encoding)
+                yield DecodedChunk(skipped_whitespace + chunk_text, start, end, self._decoratee.encoding)
+                skipped_whitespace = ''
+            elif chunk_text and self._trust_stream_boundaries:
+                skipped_whitespace += chunk_text
 
             start = end
 
+        # The last word of a trusted stream is whole, and its trailing whitespace is kept with it.
+        if self._trust_stream_boundaries and (skipped_whitespace or prefix):
+            start -= encoded_length(skipped_whitespace, self._decoratee.encoding)
+            yield DecodedChunk(skipped_whitespace + prefix, start, end + prefix_size, self._decoratee.encoding)
+
+
+class _TokenBuffer:
+    """A first-in, first-out buffer of tokens backed by a list and a read cursor.
+
+    Consumed tokens are only discarded when new tokens are appended, so reading
+    from and pushing back onto the front of the buffer never copies the unread tokens.
+    """
+
+    def __init__(self):
+        self._tokens = []
+        self._cursor = 0
+
+    def __len__(self) -> int:
+        return len(self._tokens) - self._cursor
+
+    def clear(self) -> None:
+        self._tokens = []
+        self._cursor = 0
+
+    def extend(self, tokens: list[int]) -> None:
+        """Append tokens to the back of the buffer."""
+        if self._cursor:
+            del self._tokens[:self._cursor]
+            self._cursor = 0
+        self._tokens.extend(tokens)
+
+    def pop_front(self, n: int) -> list[int]:
+        """Remove and return up to n tokens from the front of the buffer."""
+        tokens = self._tokens[self._cursor:self._cursor + n]
+        self._cursor += len(tokens)
+        return tokens
+
+    def push_front(self, tokens: list[int]) -> None:
+        """Return tokens to the front of the buffer."""
+        n = len(tokens)
+        if n <= self._cursor:
+            self._cursor -= n
+            self._tokens[self._cursor:self._cursor + n] = tokens
+        else:
+            self._tokens[:self._cursor] = tokens
+            self._cursor = 0
+
 
 class DecodedChunkStreamResizerByNumTokens(DecodedChunkStreamTransformer):
     """Resizes a decoded chunk stream to be between a minimum and maximum number of tokens."""
@@ -118,72 +331,124 @@ class DecodedChunkStreamResizerByNumTokens(DecodedChunkStreamTransformer):
         stream: DecodedChunkStreamInterface,
         min_tokens_per_chunk: int = MIN_TOKENS_PER_CHUNK_DEFAULT,
         max_tokens_per_chunk: int = MAX_TOKENS_PER_CHUNK_DEFAULT,
-        tokenizer: tiktoken.Encoding = tokenizer_default,
+        tokenizer: Optional[tiktoken.Encoding] = None,
         preferred_delimiters: Iterable[str] = PREFERRED_CHUNK_DELIMITERS_DEFAULT,
+        emit_trailing_chunk: bool = False,
     ):
         """
         Args:
             stream: The stream to resize.
             min_tokens_per_chunk: The minimum number of tokens per chunk.
             max_tokens_per_chunk: The maximum number of tokens per chunk.
-            tokenizer: The tokenizer to use to count tokens.
+            tokenizer: The tokenizer to use to count tokens. If None, the shared default tokenizer is used.
             preferred_delimiters: The preferred delimiters to split chunks at.
+            emit_trailing_chunk: Whether the tokens left at the end of the stream, fewer than the minimum,
+                are emitted as a final chunk rather than discarded, e.g. when the stream ends at a word boundary.
         """
         super().__init__(stream)
         self._min_tokens_per_chunk = min_tokens_per_chunk
         self._max_tokens_per_chunk = max_tokens_per_chunk
-        self._tokenizer = tokenizer
-        self._preferred_delimiters = preferred_delimiters
-    
+        self._tokenizer = tokenizer or get_tokenizer(TOKEN_ENCODING_DEFAULT)
+        self._preferred_delimiters = tuple(preferred_delimiters)
+        # Tokens decode to UTF-8, so delimiters are searched for in the decoded bytes.
+        self._preferred_delimiter_scanner = DelimiterScanner(self._preferred_delimiters, TOKEN_BYTES_ENCODING)
+        self._emit_trailing_chunk = emit_trailing_chunk
+
     def _transformed_iter(self) -> Iterable[DecodedChunk]:
         """Resize the stream to be between a minimum and maximum number of tokens.
 
         The chunks will be resized to be between the minimum and maximum number of tokens,
         inclusive. If the chunk is too long, it will be split at the last preferred delimiter
         before the maximum number of tokens. If the chunk is too short, it will be appended
-        to the next chunk, if it is contiguous. Otherwise, it will be discarded.
+        to the next chunk, if it is contiguous. Otherwise, it will be discarded, unless it is
+        at the end of the stream and emit_trailing_chunk is set.
         """
 
-        leftover_tokens = []
+        encoding = self._decoratee.encoding
+        is_token_bytes_encoding = codecs.lookup(encoding).name == TOKEN_BYTES_ENCODING
+        leftover_tokens = _TokenBuffer()
+        leftover_size = 0
         start = 0
 
         for original_chunk in self._decoratee:
 
-            if original_chunk.start - len(self._tokenizer.decode(leftover_tokens).encode(self._decoratee.encoding)) != start:
-                leftover_tokens = []
+            if original_chunk.start - leftover_size != start:
+                leftover_tokens.clear()
+                leftover_size = 0
                 start = original_chunk.start
 
-            original_chunk_tokens = self._tokenizer.encode(original_chunk.text, disallowed_special=())
-            tokens = itertools.chain(leftover_tokens, original_chunk_tokens)
-            n_tokens = len(leftover_tokens) + len(original_chunk_tokens)
-
-            if n_tokens < self._min_tokens_per_chunk:
-                leftover_tokens = list(tokens)
-                continue
+            leftover_tokens.extend(self._tokenizer.encode(original_chunk.text, disallowed_special=()))
+            leftover_size += original_chunk.size
 
-            while n_tokens >= self._min_tokens_per_chunk:
-                resized_chunk_tokens = list(itertools.islice(tokens, self._max_tokens_per_chunk))
-                n_tokens -= len(resized_chunk_tokens)
-                resized_chunk_text = self._tokenizer.decode(resized_chunk_tokens)
+            while len(leftover_tokens) >= self._min_tokens_per_chunk:
+                resized_chunk_bytes, n_resized_chunk_tokens = self._pop_resized_chunk_bytes(leftover_tokens)
 
-                preferred_delimiter_index = index_any(resized_chunk_text, self._preferred_delimiters, reverse=True)
+                preferred_delimiter_end = self._preferred_delimiter_scanner.rfind_end(resized_chunk_bytes)
 
-                if preferred_delimiter_index >= 0:
-                    resized_chunk_text_to_delimiter = resized_chunk_text[:preferred_delimiter_index + 1]
-                    resized_chunk_tokens_to_delimiter = self._tokenizer.encode(resized_chunk_text_to_delimiter, disallowed_special=())
+                if preferred_delimiter_end >= 0:
+                    resized_chunk_bytes_to_delimiter = resized_chunk_bytes[:preferred_delimiter_end]
+                    resized_chunk_tokens_to_delimiter = self._tokenizer.encode(
+                        self._decode_token_bytes(resized_chunk_bytes_to_delimiter),
+                        disallowed_special=(),
+                    )
                     if len(resized_chunk_tokens_to_delimiter) >= self._min_tokens_per_chunk:
-                        resized_chunk_text_after_delimiter = resized_chunk_text[preferred_delimiter_index + 1:]
-                        resized_chunk_text = resized_chunk_text_to_delimiter
                         # Re-encode the remainder of the chunk instead of using
                         # a slice of resized_chunk_tokens, since the subset encoding
                         # (used by tokens_to_delimiter) cannot be compared to the
                         # original encoding (used by resized_chunk_tokens).
-                        resized_chunk_tokens_after_delimiter = self._tokenizer.encode(resized_chunk_text_after_delimiter, disallowed_special=())
-                        tokens = itertools.chain(resized_chunk_tokens_after_delimiter, tokens)
-                        n_tokens += len(resized_chunk_tokens_after_delimiter)
-
-                end = start + len(resized_chunk_text.encode(self._decoratee.encoding))
-                yield DecodedChunk(resized_chunk_text, start, end, self._decoratee.encoding)
+                        resized_chunk_tokens_after_delimiter = self._tokenizer.encode(
+                            self._decode_token_bytes(resized_chunk_bytes[preferred_delimiter_end:]),
+                            disallowed_special=(),
+                        )
+                        leftover_tokens.push_front(resized_chunk_tokens_after_delimiter)
+                        resized_chunk_bytes = resized_chunk_bytes_to_delimiter
+                        n_resized_chunk_tokens = len(resized_chunk_tokens_to_delimiter)
+
+                resized_chunk_text = self._decode_token_bytes(resized_chunk_bytes)
+                if is_token_bytes_encoding:
+                    end = start + len(resized_chunk_bytes)
+                else:
+                    end = start + encoded_length(resized_chunk_text, encoding)
+                yield DecodedChunk(resized_chunk_text, start, end, encoding, n_resized_chunk_tokens)
+                leftover_size -= end - start
                 start = end
 
-            leftover_tokens = list(tokens)
+        if self._emit_trailing_chunk and len(leftover_tokens):
+            n_trailing_chunk_tokens = len(leftover_tokens)
+            trailing_chunk_text = self._decode_token_bytes(
+                self._tokenizer.decode_bytes(leftover_tokens.pop_front(n_trailing_chunk_tokens))
+            )
+            end = start + encoded_length(trailing_chunk_text, encoding)
+            yield DecodedChunk(trailing_chunk_text, start, end, encoding, n_trailing_chunk_tokens)
+
+    def _pop_resized_chunk_bytes(self, tokens: _TokenBuffer) -> tuple[bytes, int]:
+        """Pop up to the maximum number of tokens per chunk from the buffer and decode them to bytes.
+
+        Tokens do not always end on a character boundary. If the popped tokens end partway
+        through a character, the tokens of the partial character are returned to the buffer
+        so that the character is not split across chunks.
+
+        Returns:
+            The decoded bytes and the number of tokens they were decoded from.
+        """
+        resized_chunk_tokens = tokens.pop_front(self._max_tokens_per_chunk)
+        resized_chunk_bytes = self._tokenizer.decode_bytes(resized_chunk_tokens)
+
+        n_bytes = len(resized_chunk_bytes)
+        if truncation_point(resized_chunk_bytes) == n_bytes:
+            return resized_chunk_bytes, len(resized_chunk_tokens)
+
+        n_tokens = len(resized_chunk_tokens)
+        while n_tokens > 1:
+            n_tokens -= 1
+            n_bytes -= len(self._tokenizer.decode_single_token_bytes(resized_chunk_tokens[n_tokens]))
+            if truncation_point(resized_chunk_bytes[:n_bytes]) == n_bytes:
+                tokens.push_front(resized_chunk_tokens[n_tokens:])
+                return resized_chunk_bytes[:n_bytes], n_tokens
+
+        return resized_chunk_bytes, len(resized_chunk_tokens)
+
+    @staticmethod
+    def _decode_token_bytes(data: bytes) -> str:
+        # Matches tiktoken.Encoding.decode, which replaces incomplete characters.
+        return data.decode(TOKEN_BYTES_ENCODING, errors='replace')
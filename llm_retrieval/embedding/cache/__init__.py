@@ -0,0 +1,6 @@
+from ._store import EmbeddingCacheStore
+from ._store import LruEmbeddingCacheStore
+from ._store import SqliteEmbeddingCacheStore
+from ._client import CachedEmbeddingClient
+from ._client import embedding_cache_key
+from ._client import normalize_text
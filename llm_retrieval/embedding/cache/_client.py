@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import threading
+from typing import Callable, Optional, Sequence
+
+from llm_retrieval.embedding import Embedding
+from llm_retrieval.embedding.cache._store import EmbeddingCacheStore
+from llm_retrieval.embedding.provider.base import EmbeddingClient
+from llm_retrieval.utils.common.bloom import BloomFilter
+from llm_retrieval.utils.common.concurrency import RequestRecorder
+from llm_retrieval.vector import as_vector_batch
+
+
+BLOOM_FILTER_CAPACITY_DEFAULT = 1_000_000
+
+
+def normalize_text(text: str) -> str:
+    """Normalizes a text as embedding providers see it, so that texts embedded alike share a cache key."""
+    return text.replace('\n', ' ')
+
+
+def embedding_cache_key(model: str, text: str) -> bytes:
+    """The cache key of the embedding of an already normalized text by a model."""
+    return hashlib.sha256(f'{model}\0{text}'.encode('utf-8')).digest()
+
+
+class CachedEmbeddingClient(EmbeddingClient):
+    """Decorates an embedding client with a cache of embeddings keyed by a hash of the model and text.
+
+    Embeddings are looked up in each store in turn, e.g. an LruEmbeddingCacheStore in front of
+    a SqliteEmbeddingCacheStore, and a hit is copied to the stores before the one it was found in.
+    Only the misses are embedded by the decorated client, in one request, and stored in every
+    store. A Bloom filter of the keys stored so far, including those already in the stores,
+    answers most misses without looking them up.
+    """
+
+    def __init__(
+        self,
+        embedding_client: EmbeddingClient,
+        model: str,
+        stores: Sequence[EmbeddingCacheStore],
+        bloom_filter: Optional[BloomFilter] = None,
+        normalize: Callable[[str], str] = normalize_text,
+    ):
+        """
+        Args:
+            embedding_client: The client that embeds the texts missing from the cache.
+            model: The name of the model that the client embeds with, which is part of the cache key.
+            stores: The stores to look up embeddings in, fastest first.
+            bloom_filter: The filter of the keys in the stores. Defaults to an empty filter, which is filled
+                with the keys already in the stores.
+            normalize: The normalization of the texts before they are hashed.
+        """
+        if not stores:
+            raise ValueError('at least one store is required')
+        self._decoratee = embedding_client
+        self._model = model
+        self._stores = list(stores)
+        self._normalize = normalize
+        if bloom_filter is None:
+            bloom_filter = BloomFilter(BLOOM_FILTER_CAPACITY_DEFAULT)
+            for store in self._stores:
+                for key in store.iter_keys():
+                    bloom_filter.add(key)
+        self._bloom_filter = bloom_filter
+        self.EMBED_BATCH_SIZE = embedding_client.EMBED_BATCH_SIZE
+        self.EMBED_BATCH_TOKENS = embedding_client.EMBED_BATCH_TOKENS
+        self._stats_lock = threading.Lock()
+        self._n_texts = 0
+        self._n_hits_by_store = [0] * len(self._stores)
+        self._n_repeated_texts = 0
+        self._n_misses = 0
+        self._n_filtered_misses = 0
+
+    @property
+    def rate_limiter(self):
+        """The decorated client's rate limiter, which only the misses pass through."""
+        return self._decoratee.rate_limiter
+
+    def count_tokens(self, texts: list[str]) -> int:
+        return self._decoratee.count_tokens(texts)
+
+    def connection_stats(self) -> Optional[dict[str, int]]:
+        return self._decoratee.connection_stats()
+
+    async def embed_batch_async(
+        self,
+        texts: list[str],
+        n_tokens_per_text: Optional[list[int]] = None,
+        record_request: Optional[RequestRecorder] = None,
+    ) -> list[Embedding]:
+        return await self._embed_cached_batch_async(texts, n_tokens_per_text, record_request)
+
+    def stats(self) -> dict[str, float]:
+        """Returns the statistics of the cache, e.g. for logging."""
+        with self._stats_lock:
+            n_hits = sum(self._n_hits_by_store) + self._n_repeated_texts
+            return {
+                'n_texts': self._n_texts,
+                'n_hits': n_hits,
+                'n_hits_by_store': {repr(store): n for store, n in zip(self._stores, self._n_hits_by_store)},
+                'n_repeated_texts': self._n_repeated_texts,
+                'n_misses': self._n_misses,
+                'n_filtered_misses': self._n_filtered_misses,
+                'hit_ratio': n_hits / self._n_texts if self._n_texts else 0.0,
+            }
+
+    async def _embed_batch_async(self, texts: list[str]) -> list[Embedding]:
+        return await self._embed_cached_batch_async(texts)
+
+    async def _embed_cached_batch_async(
+        self,
+        texts: list[str],
+        n_tokens_per_text: Optional[list[int]] = None,
+        record_request: Optional[RequestRecorder] = None,
+    ) -> list[Embedding]:
+        keys = [embedding_cache_key(self._model, self._normalize(text)) for text in texts]
+        embedding_by_key: dict[bytes, Embedding] = {}
+
+        # Keys the filter has never seen are certain misses, and are not looked up.
+        unresolved_keys = list(dict.fromkeys(key for key in keys if key in self._bloom_filter))
+        n_filtered_misses = len(set(keys)) - len(unresolved_keys)
+        n_hits_by_store = [0] * len(self._stores)
+        for i, store in enumerate(self._stores):
+            if not unresolved_keys:
+                break
+            embeddings = await self._call_store(store, store.get_many, unresolved_keys)
+            hits = [(key, embedding) for key, embedding in zip(unresolved_keys, embeddings) if embedding is not None]
+            if hits:
+                embedding_by_key.update(hits)
+                n_hits_by_store[i] = len(hits)
+                for faster_store in self._stores[:i]:
+                    await self._call_store(faster_store, faster_store.put_many, hits)
+            unresolved_keys = [key for key in unresolved_keys if key not in embedding_by_key]
+
+        text_by_missing_key = {key: text for key, text in zip(keys, texts) if key not in embedding_by_key}
+        if text_by_missing_key:
+            missing_n_tokens_per_text = None
+            if n_tokens_per_text is not None:
+                n_tokens_by_key = dict(zip(keys, n_tokens_per_text))
+                missing_n_tokens_per_text = [n_tokens_by_key[key] for key in text_by_missing_key]
+            embeddings = await self._decoratee.embed_batch_async(
+                list(text_by_missing_key.values()),
+                n_tokens_per_text=missing_n_tokens_per_text,
+                record_request=record_request,
+            )
+            misses = list(zip(text_by_missing_key, embeddings))
+            embedding_by_key.update(misses)
+            for store in self._stores:
+                await self._call_store(store, store.put_many, misses)
+            for key, _ in misses:
+                self._bloom_filter.add(key)
+
+        with self._stats_lock:
+            self._n_texts += len(texts)
+            self._n_hits_by_store = [n + m for n, m in zip(self._n_hits_by_store, n_hits_by_store)]
+            # Texts repeated within a batch are embedded once, so they count as hits after the first.
+            self._n_repeated_texts += len(texts) - len(set(keys))
+            self._n_misses += len(text_by_missing_key)
+            self._n_filtered_misses += n_filtered_misses
+        return as_vector_batch([embedding_by_key[key] for key in keys])
+
+    @staticmethod
+    async def _call_store(store: EmbeddingCacheStore, method, *args):
+        if store.IS_BLOCKING:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self._decoratee!r}, {self._model!r}, {self._stores!r})'
@@ -0,0 +1,129 @@
+import abc
+import collections
+import sqlite3
+import threading
+from typing import Iterator, Optional
+
+import numpy
+
+from llm_retrieval.embedding import Embedding
+from llm_retrieval.vector import VECTOR_DTYPE
+from llm_retrieval.vector import as_vector
+
+
+LRU_MAX_ENTRIES_DEFAULT = 10_000
+# The most parameters older SQLite versions accept in one statement.
+MAX_SQLITE_VARIABLES = 999
+
+
+class EmbeddingCacheStore(abc.ABC):
+    """A store of embeddings by cache key."""
+
+    # Whether the store's methods block, e.g. on disk, and so must be called off the event loop.
+    IS_BLOCKING: bool = True
+
+    @abc.abstractmethod
+    def get_many(self, keys: list[bytes]) -> list[Optional[Embedding]]:
+        """Returns the embedding of each key, or None for each key not in the store."""
+
+    @abc.abstractmethod
+    def put_many(self, items: list[tuple[bytes, Embedding]]) -> None:
+        """Stores the embeddings of the keys, replacing any already stored."""
+
+    def iter_keys(self) -> Iterator[bytes]:
+        """Iterates the keys already in the store, e.g. to fill a Bloom filter. Defaults to none."""
+        return iter(())
+
+
+class LruEmbeddingCacheStore(EmbeddingCacheStore):
+    """Holds the most recently used embeddings in memory."""
+
+    IS_BLOCKING = False
+
+    def __init__(self, max_entries: int = LRU_MAX_ENTRIES_DEFAULT):
+        if max_entries < 1:
+            raise ValueError('max_entries must be at least one')
+        self._max_entries = max_entries
+        self._embedding_by_key: collections.OrderedDict[bytes, Embedding] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._embedding_by_key)
+
+    def get_many(self, keys: list[bytes]) -> list[Optional[Embedding]]:
+        embeddings = []
+        with self._lock:
+            for key in keys:
+                embedding = self._embedding_by_key.get(key)
+                if embedding is not None:
+                    self._embedding_by_key.move_to_end(key)
+                embeddings.append(embedding)
+        return embeddings
+
+    def put_many(self, items: list[tuple[bytes, Embedding]]) -> None:
+        with self._lock:
+            for key, embedding in items:
+                # A copy, since a row of a batch would otherwise keep the whole batch in memory.
+                self._embedding_by_key[key] = numpy.array(embedding, dtype=VECTOR_DTYPE)
+                self._embedding_by_key.move_to_end(key)
+            while len(self._embedding_by_key) > self._max_entries:
+                self._embedding_by_key.popitem(last=False)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self._max_entries!r})'
+
+
+class SqliteEmbeddingCacheStore(EmbeddingCacheStore):
+    """Persists embeddings in a local SQLite database, e.g. so that they outlive the process."""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: The path of the database file, which is created if it does not exist.
+        """
+        self._path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS embedding (key BLOB PRIMARY KEY, embedding BLOB NOT NULL)'
+            )
+
+    def get_many(self, keys: list[bytes]) -> list[Optional[Embedding]]:
+        rows = []
+        with self._lock:
+            for i in range(0, len(keys), MAX_SQLITE_VARIABLES):
+                key_batch = keys[i:i + MAX_SQLITE_VARIABLES]
+                rows.extend(self._connection.execute(
+                    f'SELECT key, embedding FROM embedding WHERE key IN ({",".join("?" * len(key_batch))})',
+                    key_batch,
+                ))
+        embedding_by_key = {key: self._decode(embedding) for key, embedding in rows}
+        return [embedding_by_key.get(key) for key in keys]
+
+    def put_many(self, items: list[tuple[bytes, Embedding]]) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO embedding (key, embedding) VALUES (?, ?)',
+                [(key, self._encode(embedding)) for key, embedding in items],
+            )
+
+    def iter_keys(self) -> Iterator[bytes]:
+        with self._lock:
+            keys = [key for key, in self._connection.execute('SELECT key FROM embedding')]
+        return iter(keys)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    @staticmethod
+    def _encode(embedding: Embedding) -> bytes:
+        return as_vector(embedding).tobytes()
+
+    @staticmethod
+    def _decode(data: bytes) -> Embedding:
+        return numpy.frombuffer(data, dtype=VECTOR_DTYPE)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self._path!r})'
@@ -1,13 +1,38 @@
-from typing import Callable
+from typing import Callable, Optional
 
 from llm_retrieval.configuration import Configuration
+from llm_retrieval.embedding.cache import CachedEmbeddingClient
+from llm_retrieval.embedding.cache import LruEmbeddingCacheStore
+from llm_retrieval.embedding.cache import SqliteEmbeddingCacheStore
 from llm_retrieval.embedding.provider.base import EmbeddingClient
 from llm_retrieval.embedding.provider.openai import OpenAIEmbeddingModel
 from llm_retrieval.embedding.provider.openai import OpenAIEmbeddingClient
+from llm_retrieval.utils.common.http import AsyncHttpSessionPool
+from llm_retrieval.utils.common.rate_limit import RateLimiter
+
+
+def get_embedding_rate_limiter(configuration: Configuration) -> Optional[RateLimiter]:
+    requests_per_minute = configuration.embedding_requests_per_minute
+    tokens_per_minute = configuration.embedding_tokens_per_minute
+    if requests_per_minute is None and tokens_per_minute is None:
+        return None
+    return RateLimiter(requests_per_minute, tokens_per_minute)
+
+
+def get_embedding_session_pool(configuration: Configuration) -> Optional[AsyncHttpSessionPool]:
+    max_connections = configuration.embedding_max_connections
+    if max_connections is None:
+        return None
+    return AsyncHttpSessionPool(max_connections)
 
 
 EmbeddingClientBuilder = Callable[..., EmbeddingClient]
-openai_embedding_client_builder: EmbeddingClientBuilder = lambda c: OpenAIEmbeddingClient(api_key=c.openai_api_key, engine=c.embedding_model_name)
+openai_embedding_client_builder: EmbeddingClientBuilder = lambda c: OpenAIEmbeddingClient(
+    api_key=c.openai_api_key,
+    engine=c.embedding_model_name,
+    rate_limiter=get_embedding_rate_limiter(c),
+    session_pool=get_embedding_session_pool(c),
+)
 
 
 embedding_client_builder_by_model: dict[str, EmbeddingClientBuilder] = {
@@ -19,4 +44,11 @@ def get_embedding_client(configuration: Configuration) -> EmbeddingClient:
     embedding_client_builder = embedding_client_builder_by_model.get(configuration.embedding_model_name)
     if embedding_client_builder is None:
         raise ValueError(f"Unknown model {configuration.embedding_model_name}")
-    return embedding_client_builder(configuration)
+    embedding_client = embedding_client_builder(configuration)
+    if configuration.embedding_cache_path is None:
+        return embedding_client
+    return CachedEmbeddingClient(
+        embedding_client,
+        configuration.embedding_model_name,
+        [LruEmbeddingCacheStore(), SqliteEmbeddingCacheStore(configuration.embedding_cache_path)],
+    )
@@ -1,16 +1,67 @@
 import abc
+import asyncio
+from typing import Optional
+
+from tenacity import AsyncRetrying, stop_after_attempt
 
 from llm_retrieval.embedding import Embedding
+from llm_retrieval.utils.common.concurrency import RequestRecorder
+from llm_retrieval.utils.common.concurrency import call_and_record
+from llm_retrieval.utils.common.encoding import encoded_length
+from llm_retrieval.utils.common.rate_limit import RateLimiter
 
 
 class EmbeddingClient(abc.ABC):
     EMBED_BATCH_SIZE: int
+    # The maximum number of tokens across the texts of a request, if the provider limits it.
+    EMBED_BATCH_TOKENS: Optional[int] = None
+    rate_limiter: Optional[RateLimiter] = None
+
+    async def embed_batch_async(
+        self,
+        texts: list[str],
+        n_tokens_per_text: Optional[list[int]] = None,
+        record_request: Optional[RequestRecorder] = None,
+    ) -> list[Embedding]:
+        """
+        Takes in a list of texts and returns a list of embeddings, e.g. the rows of a 2-D float32 array.
+
+        If the client has a rate limiter, waits for it before each attempt at the request, so that
+        retries, e.g. after a 429, are rate limited too.
 
-    async def embed_batch_async(self, texts: list[str]) -> list[Embedding]:
+        Args:
+            texts: The texts to embed.
+            n_tokens_per_text: The number of tokens in each text, if known, e.g. from chunking. Otherwise,
+                the texts are counted with count_tokens on a worker thread, so as not to hold up the event loop.
+            record_request: Records the latency and outcome of each attempt at the request to the provider,
+                e.g. ConcurrencyLimit.record. Waiting for the rate limiter and between retries is not counted.
         """
-        Takes in a list of texts and returns a list of embeddings.
+        n_tokens = 0
+        if self.rate_limiter is not None and self.rate_limiter.limits_tokens:
+            if n_tokens_per_text is not None:
+                n_tokens = sum(n_tokens_per_text)
+            else:
+                n_tokens = await asyncio.to_thread(self.count_tokens, texts)
+        async for attempt in self._retrying():
+            with attempt:
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire(n_tokens)
+                return await call_and_record(self._embed_batch_async(texts), record_request)
+
+    def count_tokens(self, texts: list[str]) -> int:
+        """Counts the tokens that the provider will charge for the texts.
+
+        Defaults to the number of UTF-8 bytes, an upper bound for byte-level tokenizers.
         """
-        return await self._embed_batch_async(texts)
+        return sum(encoded_length(text, 'utf-8') for text in texts)
+
+    def connection_stats(self) -> Optional[dict[str, int]]:
+        """Returns the statistics of the client's connections, e.g. for logging, or None if it does not pool them."""
+        return None
+
+    def _retrying(self) -> AsyncRetrying:
+        """Returns the policy that failed requests are retried by. Defaults to no retries."""
+        return AsyncRetrying(stop=stop_after_attempt(1), reraise=True)
 
     @abc.abstractmethod
     async def _embed_batch_async(self, texts: list[str]) -> list[Embedding]:
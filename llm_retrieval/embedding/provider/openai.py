@@ -1,28 +1,79 @@
+import base64
 import enum
+from typing import Optional
 
+import numpy
 import openai
-from tenacity import retry, stop_after_attempt, wait_random_exponential
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 
 from llm_retrieval.embedding import Embedding
+from llm_retrieval.vector import VECTOR_DTYPE
 from llm_retrieval.embedding.provider.base import EmbeddingClient
+from llm_retrieval.tokenizer import get_tokenizer
+from llm_retrieval.utils.common.http import AsyncHttpSessionPool
+from llm_retrieval.utils.common.rate_limit import RateLimiter
 
 
 class OpenAIEmbeddingModel(enum.Enum):
     ADA_002 = "text-embedding-ada-002"
 
 
+tokenizer_name_by_model = {
+    OpenAIEmbeddingModel.ADA_002.value: "cl100k_base",
+}
+
+# The errors of requests that may succeed if sent again. Others, e.g. of a malformed response, would only fail again.
+RETRIED_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+)
+
+
 class OpenAIEmbeddingClient(EmbeddingClient):
     EMBED_BATCH_SIZE = 2048
+    EMBED_BATCH_TOKENS = 300_000
 
     def __init__(
         self,
         api_key: str,
         engine: str,
+        rate_limiter: Optional[RateLimiter] = None,
+        api_base: Optional[str] = None,
+        session_pool: Optional[AsyncHttpSessionPool] = None,
     ):
-        openai.api_key = api_key
+        """
+        Args:
+            api_key: The OpenAI API key, which is sent with this client's requests only.
+            engine: The embedding model.
+            rate_limiter: The rate limiter that requests wait for, if any.
+            api_base: The base URL of the API, e.g. of a local stub. Defaults to OpenAI's.
+            session_pool: The pool of connections that requests are sent over. Defaults to a pool of
+                the client's own, of the default size.
+        """
+        self.api_key = api_key
         self.engine = engine
+        self.rate_limiter = rate_limiter
+        self.api_base = api_base
+        self.session_pool = session_pool if session_pool is not None else AsyncHttpSessionPool()
+
+    def connection_stats(self) -> dict[str, int]:
+        return self.session_pool.stats()
+
+    def count_tokens(self, texts: list[str]) -> int:
+        tokenizer = get_tokenizer(tokenizer_name_by_model[self.engine])
+        return sum(len(tokens) for tokens in tokenizer.encode_ordinary_batch(texts))
+
+    def _retrying(self) -> AsyncRetrying:
+        return AsyncRetrying(
+            retry=retry_if_exception_type(RETRIED_ERRORS),
+            wait=wait_random_exponential(min=1, max=20),
+            stop=stop_after_attempt(6),
+        )
 
-    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
     async def _embed_batch_async(self, texts: list[str]) -> list[Embedding]:
         # The following is taken from openai.embeddings_utils
         # It has been duplicatd here to avoid the heavy dependencies required by openai.embeddings_utils
@@ -31,6 +82,45 @@ class OpenAIEmbeddingClient(EmbeddingClient):
         # replace newlines, which can negatively affect performance.
         texts = [text.replace("\n", " ") for text in texts]
 
-        data = (await openai.Embedding.acreate(input=texts, engine=self.engine)).data
-        data = sorted(data, key=lambda x: x["index"])  # maintain the same order as input.
-        return [d["embedding"] for d in data]
+        # Requesting base64 explicitly makes the library return the encoded embeddings as they are,
+        # rather than decode them to lists of Python floats.
+        # Without a session of its own, the library opens a new session, and so new connections, per request.
+        session_token = openai.aiosession.set(self.session_pool.session())
+        try:
+            data = (await openai.Embedding.acreate(
+                input=texts,
+                engine=self.engine,
+                encoding_format="base64",
+                api_key=self.api_key,
+                api_base=self.api_base,
+            )).data
+        finally:
+            openai.aiosession.reset(session_token)
+        return decode_base64_embeddings(data, len(texts))
+
+
+def decode_base64_embeddings(data: list[dict], n_embeddings: int) -> numpy.ndarray:
+    """Decodes the base64 encoded float32 embeddings of a response into the rows of a matrix, in input order.
+
+    Args:
+        data: The embeddings of the response, each with the index of its input.
+        n_embeddings: The number of inputs.
+
+    Returns:
+        The matrix whose i-th row is the embedding of the i-th input.
+    """
+    if len(data) != n_embeddings:
+        raise ValueError(f"Expected {n_embeddings} embeddings, got {len(data)}.")
+    embeddings = None
+    is_decoded = numpy.zeros(n_embeddings, dtype=bool)
+    for d in data:
+        embedding = numpy.frombuffer(base64.b64decode(d["embedding"]), dtype=VECTOR_DTYPE)
+        if embeddings is None:
+            # The dimension is only known from the first embedding.
+            embeddings = numpy.empty((n_embeddings, len(embedding)), dtype=VECTOR_DTYPE)
+        # Each embedding is written straight into the row of its input, so no sort is needed.
+        embeddings[d["index"]] = embedding
+        is_decoded[d["index"]] = True
+    if not is_decoded.all():
+        raise ValueError("Expected an embedding of each input.")
+    return embeddings if embeddings is not None else numpy.empty((0, 0), dtype=VECTOR_DTYPE)
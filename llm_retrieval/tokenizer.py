@@ -0,0 +1,87 @@
+import contextlib
+import os
+import threading
+import time
+from typing import Iterator
+from typing import Optional
+
+import tiktoken
+
+
+TOKEN_ENCODING_DEFAULT = 'cl100k_base'
+BPE_DIRECTORY_ENV_VAR = 'TOKENIZER_BPE_DIRECTORY'
+# Populated by scripts/bundle-tokenizer-bpe.sh, so that the BPE files ship with the Lambda layer.
+BUNDLED_BPE_DIRECTORY = os.path.join(os.path.dirname(__file__), 'tokenizer_bpe')
+TIKTOKEN_CACHE_DIRECTORY_ENV_VAR = 'TIKTOKEN_CACHE_DIR'
+
+
+class TokenizerRegistry:
+    """Loads tokenizers on first use and shares them within the process.
+
+    Loading a tokenizer reads its BPE ranks, which may require a network fetch if they
+    are not cached. Deferring the load keeps it out of module imports, and sharing the
+    loaded tokenizer means each process pays for it at most once.
+    """
+
+    def __init__(self, bpe_directory: Optional[str] = None):
+        """
+        Args:
+            bpe_directory: A directory of bundled BPE files, laid out as a tiktoken cache directory.
+                If None, tiktoken's own cache directory is used.
+        """
+        self._bpe_directory = bpe_directory
+        self._tokenizer_by_name: dict[str, tiktoken.Encoding] = {}
+        self._load_seconds_by_name: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def load_seconds_by_name(self) -> dict[str, float]:
+        """The time taken to load each tokenizer loaded so far."""
+        return dict(self._load_seconds_by_name)
+
+    def get(self, name: str = TOKEN_ENCODING_DEFAULT) -> tiktoken.Encoding:
+        """Returns the named tokenizer, loading it if it has not been loaded yet."""
+        tokenizer = self._tokenizer_by_name.get(name)
+        if tokenizer is not None:
+            return tokenizer
+        with self._lock:
+            tokenizer = self._tokenizer_by_name.get(name)
+            if tokenizer is None:
+                started_at = time.perf_counter()
+                with self._tiktoken_cache_directory():
+                    tokenizer = tiktoken.get_encoding(name)
+                self._load_seconds_by_name[name] = time.perf_counter() - started_at
+                self._tokenizer_by_name[name] = tokenizer
+        return tokenizer
+
+    @contextlib.contextmanager
+    def _tiktoken_cache_directory(self) -> Iterator[None]:
+        """Points tiktoken at the bundled BPE files while loading."""
+        if self._bpe_directory is None:
+            yield
+            return
+        previous = os.environ.get(TIKTOKEN_CACHE_DIRECTORY_ENV_VAR)
+        os.environ[TIKTOKEN_CACHE_DIRECTORY_ENV_VAR] = self._bpe_directory
+        try:
+            yield
+        finally:
+            if previous is None:
+                del os.environ[TIKTOKEN_CACHE_DIRECTORY_ENV_VAR]
+            else:
+                os.environ[TIKTOKEN_CACHE_DIRECTORY_ENV_VAR] = previous
+
+
+def get_bpe_directory_default() -> Optional[str]:
+    """Returns the configured BPE directory, falling back to the bundled one if it exists."""
+    bpe_directory = os.environ.get(BPE_DIRECTORY_ENV_VAR)
+    if bpe_directory is None and os.path.isdir(BUNDLED_BPE_DIRECTORY):
+        bpe_directory = BUNDLED_BPE_DIRECTORY
+    return bpe_directory
+
+
+tokenizer_registry = TokenizerRegistry(get_bpe_directory_default())
+
+
+def get_tokenizer(name: str = TOKEN_ENCODING_DEFAULT) -> tiktoken.Encoding:
+    """Returns the named tokenizer from the process-wide registry."""
+    return tokenizer_registry.get(name)
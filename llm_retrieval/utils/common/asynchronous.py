@@ -1,7 +1,10 @@
 import asyncio
+import atexit
 import threading
+import weakref
 import concurrent.futures
 from types import CoroutineType
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Optional, TypeVar
 
 from .invariant import invariant
 
@@ -16,8 +19,13 @@ def background_event_loop_invariant_assertions(l: 'BackgroundEventLoop') -> None
 @invariant(background_event_loop_invariant_assertions)
 class BackgroundEventLoop:
 
-    def __init__(self):
+    def __init__(self, daemon: bool = False):
+        """
+        Args:
+            daemon: Whether the loop's thread is a daemon thread, which does not keep the process alive.
+        """
         self._loop = asyncio.new_event_loop()
+        self._daemon = daemon
         self._thread = None
         self._closed = False
         self._running = False
@@ -36,6 +44,7 @@ class BackgroundEventLoop:
 
         self._thread = threading.Thread(
             target=run_within_background_thread,
+            daemon=self._daemon,
         )
         self._thread.start()
         is_loop_running.wait()
@@ -71,3 +80,163 @@ class BackgroundEventLoop:
     def __del__(self) -> None:
         if not self._closed:
             self.close()
+
+
+SHUTDOWN_TIMEOUT_SECONDS_DEFAULT = 5.0
+MAX_BUFFERED_ITEMS_DEFAULT = 8
+
+_T = TypeVar('_T')
+
+
+# Only touched from the thread of each loop, so that no lock is needed.
+_closes_at_shutdown_by_loop = weakref.WeakKeyDictionary()
+
+
+def register_close_at_shutdown(close: Callable[[], Awaitable[None]]) -> None:
+    """Registers a coroutine function to await when the running loop is shut down by SharedEventLoop.
+
+    Whatever is bound to a shared loop, e.g. the HTTP session of an AsyncHttpSessionPool, can then be
+    closed on it before it closes. Loops that are not shut down by SharedEventLoop, e.g. of asyncio.run,
+    never await it, so whatever is bound to them must still be closed before they stop. A coroutine
+    function that is already registered is not registered again.
+    """
+    closes = _closes_at_shutdown_by_loop.setdefault(asyncio.get_running_loop(), [])
+    if close not in closes:
+        closes.append(close)
+
+
+async def _cancel_pending_tasks() -> None:
+    current_task = asyncio.current_task()
+    tasks = [task for task in asyncio.all_tasks() if task is not current_task]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # Closed once the tasks using them have been cancelled, but while the loop can still run their closes.
+    closes = _closes_at_shutdown_by_loop.pop(asyncio.get_running_loop(), [])
+    await asyncio.gather(*(close() for close in closes), return_exceptions=True)
+    await asyncio.get_running_loop().shutdown_asyncgens()
+
+
+class SharedEventLoop:
+    """Keeps one background event loop running for the lifetime of the process.
+
+    Starting a loop per call means that anything bound to the loop, such as the connection
+    pools of asynchronous HTTP clients, is thrown away with it. Sharing one loop lets those
+    survive between calls, and between the invocations of a warm Lambda execution environment.
+    The loop is shut down when the process exits, after awaiting the closes registered on it
+    (see register_close_at_shutdown).
+    """
+
+    def __init__(self, shutdown_timeout: float = SHUTDOWN_TIMEOUT_SECONDS_DEFAULT):
+        """
+        Args:
+            shutdown_timeout: The number of seconds to wait for pending tasks to be cancelled at shutdown.
+        """
+        self._shutdown_timeout = shutdown_timeout
+        self._loop: Optional[BackgroundEventLoop] = None
+        self._lock = threading.Lock()
+        self._n_starts = 0
+
+    @property
+    def n_starts(self) -> int:
+        """The number of times a loop has been started, e.g. to tell warm calls from cold ones."""
+        return self._n_starts
+
+    def get(self) -> BackgroundEventLoop:
+        """Returns the running loop, starting it if it has not been started or has been shut down."""
+        loop = self._loop
+        if loop is not None:
+            return loop
+        with self._lock:
+            if self._loop is None:
+                # A daemon thread, since non-daemon threads are joined before atexit handlers run.
+                loop = BackgroundEventLoop(daemon=True)
+                loop.start()
+                self._loop = loop
+                self._n_starts += 1
+            return self._loop
+
+    def run(self, coro: CoroutineType, timeout: Optional[float] = None):
+        """Runs a coroutine on the loop and waits for its result.
+
+        Must not be called from the loop's own thread, which would wait on itself.
+        """
+        loop = self.get()
+        assert threading.current_thread() is not loop._thread
+        return loop.create_task(coro).result(timeout)
+
+    def shutdown(self) -> None:
+        """Cancels the pending tasks, awaits the registered closes and closes the loop. The next get() starts a new one."""
+        with self._lock:
+            loop, self._loop = self._loop, None
+            if loop is None:
+                return
+            try:
+                loop.create_task(_cancel_pending_tasks()).result(self._shutdown_timeout)
+            except concurrent.futures.TimeoutError:
+                pass
+            loop.close()
+
+
+shared_event_loop = SharedEventLoop()
+atexit.register(shared_event_loop.shutdown)
+
+
+def get_shared_event_loop() -> BackgroundEventLoop:
+    """Returns the process-wide background event loop."""
+    return shared_event_loop.get()
+
+
+async def iterate_in_thread(iterable: Iterable[_T], max_buffered: int = MAX_BUFFERED_ITEMS_DEFAULT) -> AsyncIterator[_T]:
+    """Iterates a synchronous iterable on a worker thread, yielding its items on the running loop.
+
+    Blocking iteration (e.g. reading a file or tokenizing) then overlaps with the loop's other
+    coroutines. The items pass through a bounded queue, so the iterable is advanced no further
+    than max_buffered items ahead of the consumer. Closing the iterator stops the worker thread.
+
+    Args:
+        iterable: The iterable to iterate.
+        max_buffered: The maximum number of items iterated but not yet consumed.
+    """
+    if max_buffered < 1:
+        raise ValueError('max_buffered must be at least one')
+    loop = asyncio.get_running_loop()
+    buffer = asyncio.Queue(max_buffered)
+    stopped = threading.Event()
+    done = loop.create_future()
+    end = object()
+
+    def put(item, exception: Optional[BaseException] = None) -> None:
+        # Blocks the worker thread while the buffer is full.
+        asyncio.run_coroutine_threadsafe(buffer.put((item, exception)), loop).result()
+
+    def iterate() -> None:
+        try:
+            for item in iterable:
+                if stopped.is_set():
+                    return
+                put(item)
+                if stopped.is_set():
+                    return
+            put(end)
+        except BaseException as e:
+            if not stopped.is_set():
+                put(end, e)
+        finally:
+            loop.call_soon_threadsafe(lambda: done.done() or done.set_result(None))
+
+    threading.Thread(target=iterate, daemon=True).start()
+    try:
+        while True:
+            item, exception = await buffer.get()
+            if exception is not None:
+                raise exception
+            if item is end:
+                return
+            yield item
+    finally:
+        stopped.set()
+        # Unblocks a worker waiting to put, which then sees that it has been stopped.
+        while not buffer.empty():
+            buffer.get_nowait()
+        await asyncio.shield(done)
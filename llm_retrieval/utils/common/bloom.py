@@ -0,0 +1,53 @@
+import hashlib
+import math
+import threading
+
+
+FALSE_POSITIVE_RATE_DEFAULT = 0.01
+
+
+class BloomFilter:
+    """A set of byte strings that may report false positives, but never false negatives.
+
+    A filter in front of a slower store answers most lookups of absent keys without the store.
+    The false positive rate holds up to capacity keys, and grows beyond it.
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float = FALSE_POSITIVE_RATE_DEFAULT):
+        """
+        Args:
+            capacity: The number of keys the filter is sized for.
+            false_positive_rate: The rate of false positives when the filter holds capacity keys.
+        """
+        if capacity < 1:
+            raise ValueError('capacity must be at least one')
+        if not 0 < false_positive_rate < 1:
+            raise ValueError('false_positive_rate must be between zero and one')
+        self._n_bits = math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+        self._n_hashes = max(1, round(self._n_bits / capacity * math.log(2)))
+        self._bits = bytearray((self._n_bits + 7) // 8)
+        self._lock = threading.Lock()
+        self._n_keys = 0
+
+    def __len__(self) -> int:
+        """The number of keys added, counting any added more than once."""
+        return self._n_keys
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self._bits[i >> 3] & (1 << (i & 7)) for i in self._bit_indices(key))
+
+    def add(self, key: bytes) -> None:
+        with self._lock:
+            for i in self._bit_indices(key):
+                self._bits[i >> 3] |= 1 << (i & 7)
+            self._n_keys += 1
+
+    def _bit_indices(self, key: bytes) -> list[int]:
+        # Double hashing derives every index from two independent halves of a single digest.
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self._n_bits for i in range(self._n_hashes)]
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(n_bits={self._n_bits!r}, n_hashes={self._n_hashes!r}, n_keys={self._n_keys!r})'
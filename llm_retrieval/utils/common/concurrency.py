@@ -0,0 +1,253 @@
+import abc
+import asyncio
+import math
+import threading
+import time
+from typing import Awaitable, Callable, Optional, TypeVar, Union
+
+
+OVERLOAD_HTTP_STATUSES = frozenset({429})
+MIN_OVERLOAD_SERVER_ERROR_STATUS = 500
+
+T = TypeVar('T')
+# Records the latency and the exception, if any, of a request, e.g. ConcurrencyLimit.record.
+RequestRecorder = Callable[[float, Optional[BaseException]], None]
+
+
+def is_overload_error(exception: BaseException) -> bool:
+    """Whether an exception means that the service is overloaded, i.e. a 429, a 5xx or a timeout.
+
+    Exceptions wrapping the final attempt of a retry (e.g. tenacity.RetryError) are unwrapped.
+    """
+    last_attempt = getattr(exception, 'last_attempt', None)
+    if last_attempt is not None and last_attempt.failed:
+        return is_overload_error(last_attempt.exception())
+    if isinstance(exception, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    for attribute in ('http_status', 'status', 'status_code'):
+        status = getattr(exception, attribute, None)
+        if isinstance(status, int):
+            return status in OVERLOAD_HTTP_STATUSES or status >= MIN_OVERLOAD_SERVER_ERROR_STATUS
+    return False
+
+
+class ConcurrencyLimit(abc.ABC):
+    """The number of tasks allowed to run at once, which may change as tasks complete."""
+
+    @property
+    @abc.abstractmethod
+    def limit(self) -> int:
+        """The current number of tasks allowed to run at once."""
+
+    @property
+    @abc.abstractmethod
+    def max_limit(self) -> int:
+        """The most tasks that will ever be allowed to run at once."""
+
+    def record(self, latency: float, exception: Optional[BaseException] = None) -> None:
+        """Records the outcome of a task, which may adjust the limit.
+
+        Args:
+            latency: The number of seconds the task took.
+            exception: The exception raised by the task, if any.
+        """
+
+
+class FixedConcurrencyLimit(ConcurrencyLimit):
+    """A concurrency limit that never changes."""
+
+    def __init__(self, limit: int):
+        if limit < 1:
+            raise ValueError('limit must be at least one')
+        self._limit = limit
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def max_limit(self) -> int:
+        return self._limit
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self._limit!r})'
+
+
+class AimdConcurrencyLimit(ConcurrencyLimit):
+    """A concurrency limit that adapts by additive increase, multiplicative decrease (AIMD).
+
+    The limit grows by about one for each limit's worth of healthy tasks, i.e. by one per round
+    of tasks, and is cut by a factor when a task fails with an overload error or takes much longer
+    than the typical latency. At most one cut is made per typical latency, so that the tasks
+    already in flight when the service became overloaded do not cut the limit repeatedly.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int = 1,
+        max_limit: int = 1000,
+        decrease_factor: float = 0.5,
+        latency_tolerance: float = 2.0,
+        latency_smoothing: float = 0.1,
+        is_overload: Callable[[BaseException], bool] = is_overload_error,
+    ):
+        """
+        Args:
+            initial_limit: The limit to start from.
+            min_limit: The lowest the limit may be cut to.
+            max_limit: The highest the limit may grow to.
+            decrease_factor: The factor the limit is multiplied by when it is cut.
+            latency_tolerance: How many times the typical latency a task may take before it counts as overload.
+            latency_smoothing: The weight of each successful task's latency in the typical latency.
+            is_overload: Whether an exception raised by a task means that the service is overloaded.
+        """
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError('limits must satisfy 1 <= min_limit <= initial_limit <= max_limit')
+        if not 0 < decrease_factor < 1:
+            raise ValueError('decrease_factor must be between zero and one')
+        if latency_tolerance <= 1:
+            raise ValueError('latency_tolerance must be greater than one')
+        self._limit = float(initial_limit)
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._decrease_factor = decrease_factor
+        self._latency_tolerance = latency_tolerance
+        self._latency_smoothing = latency_smoothing
+        self._is_overload = is_overload
+        self._typical_latency = None
+        self._decreased_at = -math.inf
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def max_limit(self) -> int:
+        return self._max_limit
+
+    @property
+    def typical_latency(self) -> Optional[float]:
+        """The smoothed latency of successful tasks, or None before any task has completed."""
+        return self._typical_latency
+
+    def record(self, latency: float, exception: Optional[BaseException] = None) -> None:
+        with self._lock:
+            if exception is not None:
+                if self._is_overload(exception):
+                    self._decrease(latency)
+                # Other failures say nothing about the load on the service.
+                return
+            is_spike = self._typical_latency is not None and latency > self._typical_latency * self._latency_tolerance
+            if is_spike:
+                self._decrease(latency)
+            # Spikes are smoothed in too, so that a lasting rise in latency becomes the new typical latency
+            # rather than cutting the limit down to the minimum, one cooldown at a time.
+            if self._typical_latency is None:
+                self._typical_latency = latency
+            else:
+                self._typical_latency += (latency - self._typical_latency) * self._latency_smoothing
+            if not is_spike:
+                self._limit = min(self._max_limit, self._limit + 1 / self._limit)
+
+    def _decrease(self, latency: float) -> None:
+        now = time.monotonic()
+        # Before any task has succeeded, the failed task's latency stands in for the typical one.
+        cooldown = self._typical_latency if self._typical_latency is not None else latency
+        if now - self._decreased_at < cooldown:
+            return
+        self._decreased_at = now
+        self._limit = max(self._min_limit, math.floor(self._limit * self._decrease_factor))
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(limit={self.limit!r}, max_limit={self._max_limit!r})'
+
+
+async def call_and_record(awaitable: Awaitable[T], record: Optional[RequestRecorder]) -> T:
+    """Awaits a request, recording its latency and outcome, if there is a recorder."""
+    if record is None:
+        return await awaitable
+    started_at = time.monotonic()
+    try:
+        result = await awaitable
+    except Exception as e:
+        record(time.monotonic() - started_at, e)
+        raise
+    record(time.monotonic() - started_at, None)
+    return result
+
+
+def as_concurrency_limit(limit: Union[int, ConcurrencyLimit]) -> ConcurrencyLimit:
+    """Wraps a fixed number of tasks as a concurrency limit."""
+    if isinstance(limit, ConcurrencyLimit):
+        return limit
+    return FixedConcurrencyLimit(limit)
+
+
+class ConcurrencyGate:
+    """Admits threads while fewer than the current limit of tasks are running.
+
+    The gate only counts tasks; their outcomes are recorded with the limit by the caller.
+    """
+
+    def __init__(self, limit: ConcurrencyLimit):
+        self._limit = limit
+        self._active = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            self._condition.wait_for(lambda: self._active < self._limit.limit)
+            self._active += 1
+
+    def try_acquire(self) -> bool:
+        """Acquires a slot if one is free, without waiting."""
+        with self._condition:
+            if self._active >= self._limit.limit:
+                return False
+            self._active += 1
+            return True
+
+    def release(self) -> None:
+        with self._condition:
+            self._active -= 1
+            # The limit may have grown by more than one slot.
+            self._condition.notify_all()
+
+    def wait_until_idle(self) -> None:
+        """Waits until every acquired slot has been released."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._active == 0)
+
+
+class AsyncConcurrencyGate:
+    """Admits coroutines while fewer than the current limit of tasks are running.
+
+    The gate only counts tasks; their outcomes are recorded with the limit by the caller.
+    Must only be used from the event loop that first acquires it.
+    """
+
+    def __init__(self, limit: ConcurrencyLimit):
+        self._limit = limit
+        self._active = 0
+        self._waiters: list[asyncio.Future] = []
+
+    async def acquire(self) -> None:
+        while self._active >= self._limit.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self._active += 1
+
+    def release(self) -> None:
+        self._active -= 1
+        # Waiters re-check the limit, which may have grown by more than one slot.
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
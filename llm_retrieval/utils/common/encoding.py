@@ -0,0 +1,197 @@
+import codecs
+import functools
+from typing import Optional
+
+from llm_retrieval.utils.common.utf8 import leading_continuation_bytes
+
+
+ASCII_CHARS = ''.join(map(chr, range(128)))
+
+
+@functools.lru_cache(maxsize=None)
+def is_ascii_compatible(encoding: str) -> bool:
+    """Check if an encoding encodes every ASCII character as the same single byte as ASCII."""
+    try:
+        return ASCII_CHARS.encode(encoding) == ASCII_CHARS.encode('ascii')
+    except (LookupError, UnicodeEncodeError):
+        return False
+
+
+def has_one_byte_per_char(text: str, encoding: str) -> bool:
+    """Check if a text encodes to exactly one byte per character, without encoding it."""
+    return text.isascii() and is_ascii_compatible(encoding)
+
+
+def encoded_length(text: str, encoding: str) -> int:
+    """Find the number of bytes in the encoded text, avoiding the encoding where possible."""
+    if has_one_byte_per_char(text, encoding):
+        return len(text)
+    return len(text.encode(encoding))
+
+
+BOM_BY_ENCODING = {
+    'utf-8': codecs.BOM_UTF8,
+    'utf-16-le': codecs.BOM_UTF16_LE,
+    'utf-16-be': codecs.BOM_UTF16_BE,
+    'utf-32-le': codecs.BOM_UTF32_LE,
+    'utf-32-be': codecs.BOM_UTF32_BE,
+}
+
+# Ordered so that the UTF-32-LE mark is matched before the UTF-16-LE mark it starts with.
+ENCODING_WITHOUT_BOM_BY_BOM_BY_ENCODING = {
+    'utf-8-sig': {
+        codecs.BOM_UTF8: 'utf-8',
+    },
+    'utf-16': {
+        codecs.BOM_UTF16_LE: 'utf-16-le',
+        codecs.BOM_UTF16_BE: 'utf-16-be',
+    },
+    'utf-32': {
+        codecs.BOM_UTF32_LE: 'utf-32-le',
+        codecs.BOM_UTF32_BE: 'utf-32-be',
+    },
+}
+
+MAX_BOM_SIZE = max(len(bom) for bom in BOM_BY_ENCODING.values())
+
+DEFAULT_ENCODING_WITHOUT_BOM_BY_ENCODING = {
+    'utf-8-sig': 'utf-8',
+    'utf-16': 'utf-16-le',
+    'utf-32': 'utf-32-le',
+}
+
+CODE_UNIT_SIZE_BY_ENCODING = {
+    'utf-16-le': 2,
+    'utf-16-be': 2,
+    'utf-32-le': 4,
+    'utf-32-be': 4,
+}
+
+UTF16_LOW_SURROGATE_MASK_AND_VALUE = (0b11111100, 0b11011100)
+
+
+def may_start_with_bom(encoding: str) -> bool:
+    """Check if bytes in an encoding may start with a byte order mark."""
+    name = codecs.lookup(encoding).name
+    return name in BOM_BY_ENCODING or name in ENCODING_WITHOUT_BOM_BY_BOM_BY_ENCODING
+
+
+def resolve_bom(data: bytes, encoding: str) -> tuple[str, int]:
+    """Resolve an encoding that may start with a byte order mark to an equivalent encoding without one.
+
+    A byte order mark matching the byte order of the encoding (e.g., EF BB BF for utf-8) is
+    also found for encodings that do not expect one.
+
+    Args:
+        data: The bytes at the start of the original bytes.
+        encoding: The encoding of the bytes.
+
+    Returns:
+        The encoding without a byte order mark and the number of bytes in the byte order mark
+        found at the start of the data, which is zero if there is none.
+    """
+    name = codecs.lookup(encoding).name
+    if name in BOM_BY_ENCODING:
+        bom = BOM_BY_ENCODING[name]
+        return encoding, len(bom) if data[:len(bom)] == bom else 0
+    for bom, encoding_without_bom in ENCODING_WITHOUT_BOM_BY_BOM_BY_ENCODING.get(name, {}).items():
+        if data[:len(bom)] == bom:
+            return encoding_without_bom, len(bom)
+    return DEFAULT_ENCODING_WITHOUT_BOM_BY_ENCODING.get(name, encoding), 0
+
+
+# The most bytes that leading_partial_character_size needs to see to find the partial character
+# at the start of the original bytes: three UTF-8 continuation bytes and the byte after them.
+LEADING_PARTIAL_CHARACTER_PROBE_SIZE = 4
+
+
+def leading_partial_character_size(data: bytes, start: int, encoding: str) -> int:
+    """Find the number of bytes at the start of the data that belong to a character starting before it.
+
+    Data shorter than LEADING_PARTIAL_CHARACTER_PROBE_SIZE may end before the partial character does.
+
+    Only UTF encodings are self-synchronizing. For any other encoding, the data is assumed
+    to start on a character boundary.
+
+    Args:
+        data: The bytes, which may start partway through a character.
+        start: The start index of the data in the original bytes.
+        encoding: The encoding of the bytes.
+    """
+    name = codecs.lookup(encoding).name
+    if name == 'utf-8':
+        return leading_continuation_bytes(data)
+    code_unit_size = CODE_UNIT_SIZE_BY_ENCODING.get(name)
+    if code_unit_size is None:
+        return 0
+    n = -start % code_unit_size
+    if code_unit_size == 2 and len(data) >= n + 2:
+        high_byte = data[n + 1] if name == 'utf-16-le' else data[n]
+        mask, value = UTF16_LOW_SURROGATE_MASK_AND_VALUE
+        if high_byte & mask == value:
+            n += 2
+    return n
+
+
+DETECTION_SAMPLE_SIZE_DEFAULT = 8192
+# Checked in order, since the UTF-32-LE mark starts with the UTF-16-LE mark.
+DETECTABLE_BOM_ENCODINGS = ('utf-32-le', 'utf-32-be', 'utf-8', 'utf-16-le', 'utf-16-be')
+# The minimum share of code units with a null byte in a given position for
+# the sample to be taken as UTF-16 or UTF-32 without a byte order mark.
+MIN_NULL_BYTE_FREQUENCY = 0.3
+# Bytes that are unassigned in cp1252, but are control characters in latin-1.
+CP1252_UNDEFINED_BYTES = b'\x81\x8d\x8f\x90\x9d'
+
+
+def detect_encoding(sample: bytes) -> str:
+    """Detect the encoding of bytes from a sample of their start.
+
+    The sample is checked for a byte order mark, then for the null bytes of UTF-32 and
+    UTF-16 text, then for UTF-8 validity, and finally falls back to a single-byte encoding.
+    A character truncated at the end of the sample is ignored.
+
+    Returns:
+        The detected encoding. Encodings with a byte order (e.g., utf-16-le) are
+        returned instead of those that expect a byte order mark (e.g., utf-16).
+    """
+    for encoding in DETECTABLE_BOM_ENCODINGS:
+        if sample.startswith(BOM_BY_ENCODING[encoding]):
+            return encoding
+
+    encoding = _detect_encoding_by_null_bytes(sample)
+    if encoding is not None:
+        return encoding
+
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+
+    if any(byte in CP1252_UNDEFINED_BYTES for byte in sample):
+        return 'latin-1'
+    return 'cp1252'
+
+
+def _null_byte_frequencies(sample: bytes, code_unit_size: int) -> list[float]:
+    """Find the share of code units with a null byte in each byte position."""
+    n_code_units = len(sample) // code_unit_size
+    if n_code_units == 0:
+        return [0.0] * code_unit_size
+    sample = sample[:n_code_units * code_unit_size]
+    return [sample[i::code_unit_size].count(0) / n_code_units for i in range(code_unit_size)]
+
+
+def _detect_encoding_by_null_bytes(sample: bytes) -> Optional[str]:
+    # Text that is mostly below U+0100 has null bytes in all but the lowest byte of each code unit.
+    first, second, third, fourth = (f >= MIN_NULL_BYTE_FREQUENCY for f in _null_byte_frequencies(sample, 4))
+    if second and third and fourth and not first:
+        return 'utf-32-le'
+    if first and second and third and not fourth:
+        return 'utf-32-be'
+    first, second = (f >= MIN_NULL_BYTE_FREQUENCY for f in _null_byte_frequencies(sample, 2))
+    if second and not first:
+        return 'utf-16-le'
+    if first and not second:
+        return 'utf-16-be'
+    return None
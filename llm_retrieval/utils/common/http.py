@@ -0,0 +1,140 @@
+import asyncio
+import concurrent.futures
+import threading
+from typing import Optional
+
+import aiohttp
+
+from llm_retrieval.utils.common.asynchronous import register_close_at_shutdown
+
+
+MAX_CONNECTIONS_DEFAULT = 100
+# Long enough for a warm Lambda worker to reuse its connections across invocations.
+KEEPALIVE_SECONDS_DEFAULT = 30.0
+
+
+class AsyncHttpSessionPool:
+    """Owns an HTTP session whose connections are kept alive and reused across requests.
+
+    A session is bound to the event loop that it was created on, so the session is created on first
+    use from a loop, e.g. a long-lived shared loop, and replaced, after being closed on its own loop,
+    if it is used from another loop. The session of a shared loop is closed when the loop is shut down
+    (see SharedEventLoop), but a pool used from loops that stop, e.g. of asyncio.run, must be closed
+    before each loop stops.
+    The number of connections opened and reused is counted, e.g. to confirm that requests reuse
+    the connections of earlier requests rather than each opening its own, as are the requests that
+    await a response. All are counted by the session's trace callbacks rather than read from the
+    connector, so that the statistics can be read from any thread.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = MAX_CONNECTIONS_DEFAULT,
+        keepalive_seconds: float = KEEPALIVE_SECONDS_DEFAULT,
+    ):
+        """
+        Args:
+            max_connections: The maximum number of open connections, beyond which requests wait for one.
+            keepalive_seconds: How long an idle connection is kept open for reuse.
+        """
+        if max_connections < 1:
+            raise ValueError('max_connections must be at least one')
+        self._max_connections = max_connections
+        self._keepalive_seconds = keepalive_seconds
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._other_loop_closing: Optional[concurrent.futures.Future] = None
+        self._stats_lock = threading.Lock()
+        self._n_sessions = 0
+        self._n_connections_created = 0
+        self._n_connections_reused = 0
+        self._n_requests_in_flight = 0
+
+    def session(self) -> aiohttp.ClientSession:
+        """Returns the session of the running loop, creating it if needed.
+
+        The session of another loop is closed on that loop first, which must still be running.
+
+        Raises:
+            RuntimeError: If the session belongs to another loop that is no longer running,
+                i.e. the pool was not closed on that loop before it stopped.
+        """
+        loop = asyncio.get_running_loop()
+        if self._session is not None and not self._session.closed and self._session_loop is not loop:
+            self._close_session_of_other_loop()
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+            self._session_loop = loop
+            register_close_at_shutdown(self.close)
+        return self._session
+
+    async def close(self) -> None:
+        """Closes the session and its connections, on the loop that the session belongs to.
+
+        Raises:
+            RuntimeError: If the session belongs to another loop that is no longer running.
+        """
+        if self._session is not None and not self._session.closed:
+            if self._session_loop is asyncio.get_running_loop():
+                await self._session.close()
+            else:
+                self._close_session_of_other_loop()
+        # Waits for the session of another loop too, e.g. one replaced by session().
+        if self._other_loop_closing is not None:
+            await asyncio.wrap_future(self._other_loop_closing)
+            self._other_loop_closing = None
+        self._session = None
+        self._session_loop = None
+
+    def stats(self) -> dict[str, int]:
+        """Returns the statistics of the connections, e.g. for logging."""
+        with self._stats_lock:
+            return {
+                'max_connections': self._max_connections,
+                'n_sessions': self._n_sessions,
+                'n_connections_created': self._n_connections_created,
+                'n_connections_reused': self._n_connections_reused,
+                'n_requests_in_flight': self._n_requests_in_flight,
+            }
+
+    def _close_session_of_other_loop(self) -> None:
+        # A session can only be closed on its own loop, and its connections would be left open if it were dropped.
+        if not self._session_loop.is_running():
+            raise RuntimeError(
+                f'the session of {self!r} belongs to an event loop that is no longer running, '
+                'and should have been closed on that loop'
+            )
+        self._other_loop_closing = asyncio.run_coroutine_threadsafe(self._session.close(), self._session_loop)
+        self._session = None
+        self._session_loop = None
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_created)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reused)
+        trace_config.on_request_start.append(self._on_request_started)
+        trace_config.on_request_end.append(self._on_request_finished)
+        trace_config.on_request_exception.append(self._on_request_finished)
+        connector = aiohttp.TCPConnector(limit=self._max_connections, keepalive_timeout=self._keepalive_seconds)
+        with self._stats_lock:
+            self._n_sessions += 1
+        return aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+
+    async def _on_connection_created(self, session, context, params) -> None:
+        with self._stats_lock:
+            self._n_connections_created += 1
+
+    async def _on_connection_reused(self, session, context, params) -> None:
+        with self._stats_lock:
+            self._n_connections_reused += 1
+
+    async def _on_request_started(self, session, context, params) -> None:
+        with self._stats_lock:
+            self._n_requests_in_flight += 1
+
+    async def _on_request_finished(self, session, context, params) -> None:
+        with self._stats_lock:
+            self._n_requests_in_flight -= 1
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self._max_connections!r}, {self._keepalive_seconds!r})'
@@ -1,10 +1,15 @@
+import contextlib
 import itertools
-import threading
+import queue
+import time
 import concurrent.futures
-from typing import Iterable, Generic, TypeVar
-from types import CoroutineType
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Generator, Iterable, Iterator, Generic, Optional, TypeVar, Union
 
 from .asynchronous import BackgroundEventLoop
+from .asynchronous import get_shared_event_loop
+from .concurrency import ConcurrencyGate
+from .concurrency import ConcurrencyLimit
+from .concurrency import as_concurrency_limit
 
 
 def batched(iterable: Iterable, n: int):
@@ -17,46 +22,313 @@ def batched(iterable: Iterable, n: int):
 
 
 _T = TypeVar('_T')
+_R = TypeVar('_R')
 
 
-class ConcurrentAsyncMapper(Generic[_T]):
+def batched_with_budget(iterable: Iterable[_T], n: int, budget: int, cost: Callable[[_T], int]):
+    """Batch data into tuples of at most n items whose total cost is at most budget.
+
+    An item whose cost alone exceeds the budget is batched by itself.
+    """
+    if n < 1:
+        raise ValueError('n must be at least one')
+    batch = []
+    batch_cost = 0
+    for item in iterable:
+        item_cost = cost(item)
+        if batch and (len(batch) == n or batch_cost + item_cost > budget):
+            yield tuple(batch)
+            batch = []
+            batch_cost = 0
+        batch.append(item)
+        batch_cost += item_cost
+    if batch:
+        yield tuple(batch)
+
+
+async def abatched_with_budget(
+    aiterable: AsyncIterable[_T],
+    n: int,
+    budget: int,
+    cost: Callable[[_T], int],
+) -> AsyncIterator[tuple[_T, ...]]:
+    """Batch the items of an async iterable like batched_with_budget."""
+    if n < 1:
+        raise ValueError('n must be at least one')
+    batch = []
+    batch_cost = 0
+    async for item in aiterable:
+        item_cost = cost(item)
+        if batch and (len(batch) == n or batch_cost + item_cost > budget):
+            yield tuple(batch)
+            batch = []
+            batch_cost = 0
+        batch.append(item)
+        batch_cost += item_cost
+    if batch:
+        yield tuple(batch)
+
+
+class MapOutcome(Generic[_T, _R]):
+    """The outcome of mapping a coroutine function over one item.
+
+    Attributes:
+        index: The position of the item in the mapped iterable.
+        item: The item.
+        result: The result of the coroutine, if it succeeded.
+        exception: The exception raised by the coroutine, if it failed.
+        cancelled: Whether the coroutine was cancelled before it finished.
+    """
+
+    __slots__ = ('index', 'item', 'result', 'exception', 'cancelled')
+
+    def __init__(
+        self,
+        index: int,
+        item: _T,
+        result: Optional[_R] = None,
+        exception: Optional[BaseException] = None,
+        cancelled: bool = False,
+    ):
+        self.index = index
+        self.item = item
+        self.result = result
+        self.exception = exception
+        self.cancelled = cancelled
+
+    @property
+    def succeeded(self) -> bool:
+        return self.exception is None and not self.cancelled
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}({self.index!r}, {self.item!r}, result={self.result!r}, '
+            f'exception={self.exception!r}, cancelled={self.cancelled!r})'
+        )
+
+
+class MapReport(Generic[_T, _R]):
+    """The outcomes of mapping a coroutine function over the items of an iterable.
+
+    Attributes:
+        outcomes: The outcome of each item that was started, in the order of the iterable.
+        exhausted: Whether every item of the iterable was started, i.e. the map did not fail fast.
+    """
+
+    def __init__(self, outcomes: list[MapOutcome[_T, _R]], exhausted: bool):
+        self.outcomes = outcomes
+        self.exhausted = exhausted
+
+    @property
+    def succeeded(self) -> list[MapOutcome[_T, _R]]:
+        return [o for o in self.outcomes if o.succeeded]
+
+    @property
+    def failed(self) -> list[MapOutcome[_T, _R]]:
+        """The outcomes of the items that raised, excluding those that were cancelled."""
+        return [o for o in self.outcomes if o.exception is not None]
+
+    @property
+    def cancelled(self) -> list[MapOutcome[_T, _R]]:
+        return [o for o in self.outcomes if o.cancelled]
+
+    @property
+    def ok(self) -> bool:
+        return self.exhausted and all(o.succeeded for o in self.outcomes)
+
+    def unfinished_items(self) -> list[_T]:
+        """The items that failed or were cancelled, e.g. to retry them."""
+        return [o.item for o in self.outcomes if not o.succeeded]
+
+    def raise_first_exception(self) -> None:
+        """Raises the exception of the first failed item, if any."""
+        for outcome in self.outcomes:
+            if outcome.exception is not None:
+                raise outcome.exception
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__}(n_succeeded={len(self.succeeded)}, n_failed={len(self.failed)}, '
+            f'n_cancelled={len(self.cancelled)}, exhausted={self.exhausted!r})'
+        )
+
+
+class ConcurrentAsyncMapper(Generic[_T, _R]):
+    """Maps a coroutine function over the items of an iterable, with limited concurrency.
+
+    The coroutines run on a background event loop, while the iterable is consumed in the
+    calling thread, only as fast as the concurrency limit allows.
+    """
 
     def __init__(
         self,
-        callable: CoroutineType,
-        max_concurrent_tasks: int,
+        callable: Callable[[_T], Awaitable[_R]],
+        max_concurrent_tasks: Union[int, ConcurrencyLimit],
+        loop: Optional[BackgroundEventLoop] = None,
     ):
+        """
+        Args:
+            callable: The coroutine function to map over the items.
+            max_concurrent_tasks: The maximum number of concurrent tasks, or a concurrency limit
+                (e.g. AimdConcurrencyLimit) that adapts to the outcomes of the tasks.
+            loop: A running loop to run the coroutines on. Defaults to the process-wide shared loop,
+                so that anything the coroutines bind to the loop (e.g. connection pools) outlives the call.
+        """
         self._callable = callable
-        self._max_concurrent_tasks = max_concurrent_tasks
-        self._loop = BackgroundEventLoop()
+        self._concurrency_limit = as_concurrency_limit(max_concurrent_tasks)
+        self._loop = loop
+
+    @property
+    def concurrency_limit(self) -> ConcurrencyLimit:
+        return self._concurrency_limit
 
     def __call__(
         self,
         iterable: Iterable[_T],
-    ) -> None:
+    ) -> MapReport[_T, _R]:
+        """Maps over every item, whatever the outcomes, and reports the outcome of each."""
+        return self.map_report(iterable)
+
+    def map(self, iterable: Iterable[_T], fail_fast: bool = True) -> Iterator[_R]:
+        """Yields the results in the order of the iterable.
+
+        Args:
+            fail_fast: Whether to cancel the running tasks and start no more once one fails.
+                Either way, the first failure is raised once it is reached in order.
+        """
+        outcomes = self._iter_outcomes(iterable, ordered=True, fail_fast=fail_fast)
+        with contextlib.closing(outcomes):
+            for outcome in outcomes:
+                if not outcome.succeeded:
+                    raise _first_exception(outcome, outcomes)
+                yield outcome.result
+
+    def map_unordered(self, iterable: Iterable[_T], fail_fast: bool = True) -> Iterator[_R]:
+        """Yields the results as they complete.
+
+        Args:
+            fail_fast: Whether to cancel the running tasks and start no more once one fails.
+                Either way, the first failure is raised once it completes.
+        """
+        outcomes = self._iter_outcomes(iterable, ordered=False, fail_fast=fail_fast)
+        with contextlib.closing(outcomes):
+            for outcome in outcomes:
+                if not outcome.succeeded:
+                    raise _first_exception(outcome, outcomes)
+                yield outcome.result
+
+    def map_report(self, iterable: Iterable[_T], fail_fast: bool = False) -> MapReport[_T, _R]:
+        """Maps over the items and reports the outcome of each, rather than raising.
+
+        Args:
+            fail_fast: Whether to cancel the running tasks and start no more once one fails.
+        """
+        outcomes = _OutcomeIterator(self, iterable, ordered=True, fail_fast=fail_fast)
+        return MapReport(list(outcomes), outcomes.exhausted)
+
+    def _iter_outcomes(self, iterable: Iterable[_T], ordered: bool, fail_fast: bool) -> Generator[MapOutcome[_T, _R], None, None]:
+        return iter(_OutcomeIterator(self, iterable, ordered, fail_fast))
+
+    def _get_loop(self) -> BackgroundEventLoop:
+        return self._loop if self._loop is not None else get_shared_event_loop()
+
+    async def _call_and_release(self, item: _T, gate: ConcurrencyGate) -> _R:
+        started_at = time.monotonic()
+        try:
+            result = await self._callable(item)
+        except Exception as e:
+            self._concurrency_limit.record(time.monotonic() - started_at, e)
+            raise
+        else:
+            self._concurrency_limit.record(time.monotonic() - started_at)
+            return result
+        finally:
+            gate.release()
+
+
+def _first_exception(outcome: MapOutcome, outcomes: Iterator[MapOutcome]) -> BaseException:
+    """Finds the exception that failed the map, which may come after the outcomes it cancelled."""
+    if outcome.exception is not None:
+        return outcome.exception
+    for outcome in outcomes:
+        if outcome.exception is not None:
+            return outcome.exception
+    return concurrent.futures.CancelledError()
+
 
-        active_tasks = set()
-        active_tasks_write_lock = threading.Lock()
-        active_task_count_semaphore = threading.Semaphore(self._max_concurrent_tasks)
-        continue_discarding_tasks = threading.Event()
-        continue_discarding_tasks.set()
+class _OutcomeIterator(Generic[_T, _R]):
+    """Runs a mapper over an iterable, yielding the outcome of each item."""
 
-        def cleanup_task(task: concurrent.futures.Future) -> None:
-            if continue_discarding_tasks.is_set():
-                with active_tasks_write_lock:
-                    if continue_discarding_tasks.is_set():
-                        active_tasks.discard(task)
-            active_task_count_semaphore.release()
+    def __init__(self, mapper: ConcurrentAsyncMapper[_T, _R], iterable: Iterable[_T], ordered: bool, fail_fast: bool):
+        self._mapper = mapper
+        self._iterable = iterable
+        self._ordered = ordered
+        self._fail_fast = fail_fast
+        self.exhausted = False
 
-        with self._loop:
+    def __iter__(self) -> Iterator[MapOutcome[_T, _R]]:
+        mapper = self._mapper
+        limit = mapper.concurrency_limit
+        gate = ConcurrencyGate(limit)
+        items = enumerate(self._iterable)
+        completed = queue.SimpleQueue()
+        running: dict[int, concurrent.futures.Future] = {}
+        # Outcomes completed out of order, waiting for their turn when ordered.
+        buffered: dict[int, MapOutcome[_T, _R]] = {}
+        n_started = 0
+        n_yielded = 0
+        stopping = False
+        loop = mapper._get_loop()
 
-            for item in iterable:
-                active_task_count_semaphore.acquire()
-                task = self._loop.create_task(self._callable(item))
-                with active_tasks_write_lock:
-                    active_tasks.add(task)
-                task.add_done_callback(cleanup_task)
+        def start_next() -> bool:
+            nonlocal n_started
+            if self._ordered and n_started - n_yielded >= limit.max_limit:
+                # Bound the outcomes buffered behind a slow item.
+                return False
+            if not gate.try_acquire():
+                return False
+            try:
+                index, item = next(items)
+            except StopIteration:
+                gate.release()
+                self.exhausted = True
+                return False
+            task = loop.create_task(mapper._call_and_release(item, gate))
+            task.add_done_callback(lambda t, index=index, item=item: completed.put((index, item, t)))
+            running[index] = task
+            n_started += 1
+            return True
 
-            continue_discarding_tasks.clear()
+        def to_outcome(index: int, item: _T, task: concurrent.futures.Future) -> MapOutcome[_T, _R]:
+            if task.cancelled():
+                return MapOutcome(index, item, cancelled=True)
+            if task.exception() is not None:
+                return MapOutcome(index, item, exception=task.exception())
+            return MapOutcome(index, item, result=task.result())
 
-            concurrent.futures.wait(active_tasks)
+        try:
+            while True:
+                while not stopping and not self.exhausted and start_next():
+                    pass
+                if not running:
+                    break
+                index, item, task = completed.get()
+                del running[index]
+                outcome = to_outcome(index, item, task)
+                if outcome.exception is not None and self._fail_fast and not stopping:
+                    stopping = True
+                    for running_task in running.values():
+                        running_task.cancel()
+                if not self._ordered:
+                    n_yielded += 1
+                    yield outcome
+                    continue
+                buffered[index] = outcome
+                while n_yielded in buffered:
+                    n_yielded += 1
+                    yield buffered.pop(n_yielded - 1)
+        finally:
+            # The caller may have stopped early, so cancel the rest and wait for their coroutines to finish.
+            for running_task in running.values():
+                running_task.cancel()
+            gate.wait_until_idle()
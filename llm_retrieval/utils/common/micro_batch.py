@@ -0,0 +1,122 @@
+import asyncio
+import math
+import threading
+from typing import Awaitable, Callable, Generic, Iterable, Optional, TypeVar
+
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+class AsyncMicroBatcher(Generic[T, R]):
+    """Pools the items submitted by any number of coroutines into batches for a batch call.
+
+    A batch is flushed as soon as it is full, by size or by cost, or once its first item has
+    waited max_wait_seconds, so that a lone submitter is not held up waiting for others. The
+    results of each batch are routed back to the submitters of its items, in order, and a failed
+    batch fails every submitter with an item in it. Flushes run concurrently; the batch call
+    is responsible for limiting its own concurrency.
+
+    Must only be used from one event loop.
+    """
+
+    def __init__(
+        self,
+        batch_call: Callable[[list[T]], Awaitable[list[R]]],
+        max_batch_size: int,
+        max_wait_seconds: float,
+        max_batch_cost: float = math.inf,
+        cost: Optional[Callable[[T], float]] = None,
+    ):
+        """
+        Args:
+            batch_call: The call made with each batch, returning a result per item.
+            max_batch_size: The maximum number of items per batch.
+            max_wait_seconds: The longest an item waits for its batch to fill before it is flushed.
+            max_batch_cost: The maximum total cost of the items in a batch. A single item costing more is batched alone.
+            cost: The cost of an item, e.g. its number of tokens. Defaults to zero.
+        """
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be at least one')
+        if max_wait_seconds < 0:
+            raise ValueError('max_wait_seconds must not be negative')
+        self._batch_call = batch_call
+        self._max_batch_size = max_batch_size
+        self._max_wait_seconds = max_wait_seconds
+        self._max_batch_cost = max_batch_cost
+        self._cost = cost or (lambda _: 0)
+        self._pending: list[tuple[T, asyncio.Future]] = []
+        self._pending_cost = 0
+        self._deadline: Optional[asyncio.TimerHandle] = None
+        self._flush_tasks: set[asyncio.Future] = set()
+        self._stats_lock = threading.Lock()
+        self._n_items = 0
+        self._n_batches = 0
+        self._n_full_batches = 0
+
+    async def submit(self, items: Iterable[T]) -> list[R]:
+        """Adds items to the pending batch, and waits for their results.
+
+        The items may be split across batches, and their results are returned in order.
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for item in items:
+            cost = self._cost(item)
+            if self._pending and self._pending_cost + cost > self._max_batch_cost:
+                self._flush(is_full=True)
+            future = loop.create_future()
+            self._pending.append((item, future))
+            self._pending_cost += cost
+            futures.append(future)
+            if len(self._pending) >= self._max_batch_size or self._pending_cost >= self._max_batch_cost:
+                self._flush(is_full=True)
+            elif self._deadline is None:
+                self._deadline = loop.call_later(self._max_wait_seconds, self._flush)
+        return list(await asyncio.gather(*futures))
+
+    def stats(self) -> dict[str, float]:
+        """Returns the statistics of the batcher, e.g. for logging."""
+        with self._stats_lock:
+            return {
+                'n_items': self._n_items,
+                'n_batches': self._n_batches,
+                'n_full_batches': self._n_full_batches,
+                'mean_batch_size': self._n_items / self._n_batches if self._n_batches else 0.0,
+            }
+
+    def _flush(self, is_full: bool = False) -> None:
+        if self._deadline is not None:
+            self._deadline.cancel()
+            self._deadline = None
+        # Items whose submitters have given up, e.g. by being cancelled, are dropped.
+        batch = [(item, future) for item, future in self._pending if not future.done()]
+        self._pending = []
+        self._pending_cost = 0
+        if not batch:
+            return
+        with self._stats_lock:
+            self._n_items += len(batch)
+            self._n_batches += 1
+            self._n_full_batches += is_full
+        flush_task = asyncio.ensure_future(self._call(batch))
+        self._flush_tasks.add(flush_task)
+        flush_task.add_done_callback(self._flush_tasks.discard)
+
+    async def _call(self, batch: list[tuple[T, asyncio.Future]]) -> None:
+        try:
+            results = await self._batch_call([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f'expected {len(batch)} results, got {len(results)}')
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
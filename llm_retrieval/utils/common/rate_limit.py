@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+
+SECONDS_PER_MINUTE = 60
+# Providers enforce per-minute quotas over shorter windows, so bursts are kept to about a second of quota.
+BURST_SECONDS_DEFAULT = 1.0
+
+
+class TokenBucket:
+    """A token bucket that hands out reservations rather than refusals.
+
+    A reservation larger than the tokens available still succeeds, leaving the bucket in
+    debt, and the caller is told how long to wait for the debt to be refilled. Callers are
+    therefore served in the order they reserve, without polling.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Args:
+            rate: The number of tokens added per second.
+            capacity: The maximum number of tokens held, i.e. the largest burst.
+        """
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        if capacity <= 0:
+            raise ValueError('capacity must be positive')
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """Takes amount tokens from the bucket and returns the seconds to wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+            self._updated_at = now
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self._rate)
+
+
+class RateLimiter:
+    """Limits the rate of requests and of the tokens sent in them.
+
+    A limiter may be shared by any number of callers, threads and event loops.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        burst_seconds: float = BURST_SECONDS_DEFAULT,
+    ):
+        """
+        Args:
+            requests_per_minute: The maximum number of requests per minute, or None for no limit.
+            tokens_per_minute: The maximum number of tokens per minute, or None for no limit.
+            burst_seconds: The number of seconds of quota that may be used at once.
+        """
+        self._request_bucket = self._bucket_per_minute(requests_per_minute, burst_seconds)
+        self._token_bucket = self._bucket_per_minute(tokens_per_minute, burst_seconds)
+        self._stats_lock = threading.Lock()
+        self._n_acquired = 0
+        self._n_waited = 0
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+
+    @property
+    def limits_tokens(self) -> bool:
+        return self._token_bucket is not None
+
+    def reserve(self, tokens: int = 0) -> float:
+        """Reserves a request of the given number of tokens and returns the seconds to wait before sending it."""
+        wait_seconds = 0.0
+        if self._request_bucket is not None:
+            wait_seconds = self._request_bucket.reserve(1)
+        if self._token_bucket is not None and tokens:
+            wait_seconds = max(wait_seconds, self._token_bucket.reserve(tokens))
+        with self._stats_lock:
+            self._n_acquired += 1
+            if wait_seconds > 0:
+                self._n_waited += 1
+                self._wait_seconds_total += wait_seconds
+                self._wait_seconds_max = max(self._wait_seconds_max, wait_seconds)
+        return wait_seconds
+
+    async def acquire(self, tokens: int = 0) -> float:
+        """Waits until a request of the given number of tokens may be sent.
+
+        Returns:
+            The number of seconds waited.
+        """
+        wait_seconds = self.reserve(tokens)
+        if wait_seconds > 0:
+            await asyncio.sleep(wait_seconds)
+        return wait_seconds
+
+    def stats(self) -> dict[str, float]:
+        """Returns the statistics of the limiter, e.g. for logging."""
+        with self._stats_lock:
+            return {
+                'n_acquired': self._n_acquired,
+                'n_waited': self._n_waited,
+                'wait_seconds_total': self._wait_seconds_total,
+                'wait_seconds_max': self._wait_seconds_max,
+            }
+
+    @staticmethod
+    def _bucket_per_minute(per_minute: Optional[float], burst_seconds: float) -> Optional[TokenBucket]:
+        if per_minute is None:
+            return None
+        rate = per_minute / SECONDS_PER_MINUTE
+        # At least one request's worth, so that a low quota still admits requests.
+        return TokenBucket(rate, max(1.0, rate * burst_seconds))
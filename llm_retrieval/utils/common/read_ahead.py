@@ -0,0 +1,135 @@
+import itertools
+import queue
+import threading
+import time
+from typing import BinaryIO, Iterator, Union
+
+
+READ_AHEAD_CHUNKS_DEFAULT = 2
+
+
+class ReadAheadReader:
+    """Reads a binary file-like object in chunks on a worker thread, ahead of the consumer.
+
+    Reading (e.g. from a socket) then overlaps with the consumer's processing of the chunks
+    read so far (e.g. tokenizing). At most read_ahead chunks are held in the buffer, so a slow
+    consumer holds back the reads.
+
+    If the readable supports readinto, chunks are read into a ring of reused buffers, and the
+    data of each chunk is a view that is only valid until the next chunk is requested.
+    """
+
+    def __init__(self, readable: BinaryIO, chunk_size: int, read_ahead: int = READ_AHEAD_CHUNKS_DEFAULT):
+        """
+        Args:
+            readable: The binary file-like object to read.
+            chunk_size: The maximum number of bytes in each chunk.
+            read_ahead: The maximum number of chunks read but not yet requested. If zero,
+                the chunks are read on the consumer's thread as they are requested.
+        """
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be at least one')
+        if read_ahead < 0:
+            raise ValueError('read_ahead must not be negative')
+        self._readable = readable
+        self._chunk_size = chunk_size
+        self._read_ahead = read_ahead
+        self._stats_lock = threading.Lock()
+        self._n_chunks = 0
+        self._n_bytes = 0
+        self._read_seconds = 0.0
+        self._producer_blocked_seconds = 0.0
+        self._consumer_blocked_seconds = 0.0
+
+    def __iter__(self) -> Iterator[Union[bytes, memoryview]]:
+        if self._read_ahead == 0:
+            return self._read_chunks(self._buffers(1))
+        return self._read_chunks_ahead()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self._readable!r}, {self._chunk_size!r}, read_ahead={self._read_ahead!r})'
+
+    def stats(self) -> dict[str, float]:
+        """Returns the statistics of the reader, e.g. for logging.
+
+        Time the producer spends blocked means that the consumer is the bottleneck, and time
+        the consumer spends blocked means that reading is; a buffer large enough to absorb
+        variations in both keeps the two low together.
+        """
+        with self._stats_lock:
+            return {
+                'n_chunks': self._n_chunks,
+                'n_bytes': self._n_bytes,
+                'read_seconds': self._read_seconds,
+                'producer_blocked_seconds': self._producer_blocked_seconds,
+                'consumer_blocked_seconds': self._consumer_blocked_seconds,
+            }
+
+    def _buffers(self, n: int) -> Iterator[memoryview]:
+        if getattr(self._readable, 'readinto', None) is None:
+            return iter(())
+        return itertools.cycle([memoryview(bytearray(self._chunk_size)) for _ in range(n)])
+
+    def _read_chunks(self, buffers: Iterator[memoryview]) -> Iterator[Union[bytes, memoryview]]:
+        readinto = getattr(self._readable, 'readinto', None)
+        while True:
+            started_at = time.perf_counter()
+            if readinto is None:
+                chunk = self._readable.read(self._chunk_size)
+            else:
+                buffer = next(buffers)
+                chunk = buffer[:readinto(buffer)]
+            read_seconds = time.perf_counter() - started_at
+            if not chunk:
+                return
+            with self._stats_lock:
+                self._n_chunks += 1
+                self._n_bytes += len(chunk)
+                self._read_seconds += read_seconds
+            yield chunk
+
+    def _read_chunks_ahead(self) -> Iterator[Union[bytes, memoryview]]:
+        # One buffer per buffered chunk, plus the one being read and the one held by the consumer.
+        chunks = self._read_chunks(self._buffers(self._read_ahead + 2))
+        buffer = queue.Queue(self._read_ahead)
+        stopped = threading.Event()
+        end = object()
+
+        def put(item) -> None:
+            started_at = time.perf_counter()
+            buffer.put(item)
+            with self._stats_lock:
+                self._producer_blocked_seconds += time.perf_counter() - started_at
+
+        def read() -> None:
+            try:
+                for chunk in chunks:
+                    if stopped.is_set():
+                        return
+                    put((chunk, None))
+                    if stopped.is_set():
+                        return
+                put((end, None))
+            except BaseException as e:
+                if not stopped.is_set():
+                    put((end, e))
+
+        thread = threading.Thread(target=read, daemon=True)
+        thread.start()
+        try:
+            while True:
+                started_at = time.perf_counter()
+                chunk, exception = buffer.get()
+                with self._stats_lock:
+                    self._consumer_blocked_seconds += time.perf_counter() - started_at
+                if exception is not None:
+                    raise exception
+                if chunk is end:
+                    return
+                yield chunk
+        finally:
+            stopped.set()
+            # Unblocks the worker if it is waiting to put, after which it sees that it has been stopped.
+            while not buffer.empty():
+                buffer.get_nowait()
+            thread.join()
@@ -1,4 +1,6 @@
-from collections.abc import Sequence, Collection
+import re
+from collections.abc import Sequence, Collection, Iterable
+from typing import Optional, Union
 
 
 def index_any(seq: Sequence, items: Collection, start: int = None, end: int = None, reverse: bool = False):
@@ -21,3 +23,70 @@ def index_any(seq: Sequence, items: Collection, start: int = None, end: int = No
             return end - i - 1 if reverse else start + i
 
     return -1
+
+
+class DelimiterScanner:
+    """Finds any of a set of delimiters in text or in encoded text.
+
+    The delimiters are compiled into regular expressions once, so that each search runs in C
+    and is bounded by positions rather than by slicing (copying) the searched sequence.
+    """
+
+    def __init__(self, delimiters: Iterable[str], encoding: str = 'utf-8'):
+        """
+        Args:
+            delimiters: The delimiters to find. A delimiter may be longer than one character.
+            encoding: The encoding of the bytes-like objects that will be searched.
+        """
+        # Longest first so that a delimiter is never shadowed by one of its prefixes.
+        self._delimiters = sorted(set(delimiters), key=len, reverse=True)
+        self._encoding = encoding
+        self._patterns = self._compile_str(self._delimiters)
+        self._encoded_patterns = self._compile_bytes([d.encode(encoding) for d in self._delimiters])
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self._delimiters!r}, encoding={self._encoding!r})'
+
+    def find(self, seq: Union[str, bytes, bytearray, memoryview], start: int = None, end: int = None) -> int:
+        """Returns the index of the first delimiter within seq[start:end], or -1 if there is none."""
+        match = self._search(seq, start, end, reverse=False)
+        return match.start(1) if match else -1
+
+    def rfind(self, seq: Union[str, bytes, bytearray, memoryview], start: int = None, end: int = None) -> int:
+        """Returns the index of the last delimiter within seq[start:end], or -1 if there is none."""
+        match = self._search(seq, start, end, reverse=True)
+        return match.start(1) if match else -1
+
+    def rfind_end(self, seq: Union[str, bytes, bytearray, memoryview], start: int = None, end: int = None) -> int:
+        """Returns the index just past the last delimiter within seq[start:end], or -1 if there is none."""
+        match = self._search(seq, start, end, reverse=True)
+        return match.end(1) if match else -1
+
+    def _search(self, seq, start: Optional[int], end: Optional[int], reverse: bool) -> Optional[re.Match]:
+        patterns = self._patterns if isinstance(seq, str) else self._encoded_patterns
+        if patterns is None:
+            return None
+        start, end, _ = slice(start, end).indices(len(seq))
+        forward, backward = patterns
+        if reverse:
+            # the greedy prefix consumes up to end and backtracks, so the last delimiter is matched
+            return backward.match(seq, start, end)
+        return forward.search(seq, start, end)
+
+    @staticmethod
+    def _compile_str(delimiters: list[str]) -> Optional[tuple[re.Pattern, re.Pattern]]:
+        if not delimiters:
+            return None
+        if all(len(d) == 1 for d in delimiters):
+            # a character class is matched faster than an alternation
+            group = '([' + ''.join(re.escape(d) for d in delimiters) + '])'
+        else:
+            group = '(' + '|'.join(re.escape(d) for d in delimiters) + ')'
+        return re.compile(group), re.compile('(?s:.*)' + group)
+
+    @staticmethod
+    def _compile_bytes(delimiters: list[bytes]) -> Optional[tuple[re.Pattern, re.Pattern]]:
+        if not delimiters:
+            return None
+        group = b'(' + b'|'.join(re.escape(d) for d in delimiters) + b')'
+        return re.compile(group), re.compile(b'(?s:.*)' + group)
@@ -1 +1,6 @@
-from ._vector import Vector
\ No newline at end of file
+from ._vector import Vector
+from ._vector import VectorLike
+from ._vector import VECTOR_DTYPE
+from ._vector import as_vector
+from ._vector import as_vector_batch
+from ._vector import vector_to_list
@@ -1 +1,51 @@
-Vector = list[float]
\ No newline at end of file
+from typing import Iterable, Union
+
+import numpy
+
+
+# Embedding providers compute vectors at single precision, so storing more would only cost memory.
+VECTOR_DTYPE = numpy.float32
+
+
+class Vector(numpy.ndarray):
+    """A vector as a contiguous 1-D float32 array, e.g. a row of a batch of embeddings.
+
+    As a pydantic field type, lists of floats and arrays of other precisions are converted,
+    and contiguous float32 arrays are taken as they are, without validating each element.
+    """
+
+    @classmethod
+    def __get_validators__(cls):
+        yield as_vector
+
+    @classmethod
+    def __modify_schema__(cls, field_schema: dict) -> None:
+        field_schema.update(type='array', items={'type': 'number'})
+
+
+VectorLike = Union[Vector, numpy.ndarray, list[float]]
+
+
+def as_vector(values: VectorLike) -> numpy.ndarray:
+    """Returns the values as a contiguous 1-D float32 array, without copying them if they already are one."""
+    vector = numpy.ascontiguousarray(values, dtype=VECTOR_DTYPE)
+    if vector.ndim != 1:
+        raise ValueError(f'expected a 1-D vector, got {vector.ndim} dimensions')
+    return vector
+
+
+def as_vector_batch(vectors: Union[numpy.ndarray, Iterable[VectorLike]]) -> numpy.ndarray:
+    """Returns the vectors as the rows of a contiguous 2-D float32 array, without copying them if they already are."""
+    if not isinstance(vectors, numpy.ndarray):
+        vectors = list(vectors)
+        if not vectors:
+            return numpy.empty((0, 0), dtype=VECTOR_DTYPE)
+    batch = numpy.ascontiguousarray(vectors, dtype=VECTOR_DTYPE)
+    if batch.ndim != 2:
+        raise ValueError(f'expected a 2-D batch of vectors, got {batch.ndim} dimensions')
+    return batch
+
+
+def vector_to_list(vector: VectorLike) -> list[float]:
+    """Converts a vector to a list of floats, e.g. to serialize it in a request."""
+    return vector.tolist() if isinstance(vector, numpy.ndarray) else list(vector)
@@ -1,6 +1,8 @@
+import numpy
 import pydantic
 
 from llm_retrieval.vector import Vector
+from llm_retrieval.vector import vector_to_list
 
 
 class StoredVectorMetadata(pydantic.BaseModel):
@@ -11,3 +13,16 @@ class StoredVector(pydantic.BaseModel):
     id: str
     vector: Vector
     metadata: StoredVectorMetadata
+
+    class Config:
+        json_encoders = {numpy.ndarray: vector_to_list}
+
+    def __eq__(self, other) -> bool:
+        # Arrays compare element-wise, so the vectors are compared apart from the other fields.
+        if not isinstance(other, StoredVector):
+            return NotImplemented
+        return (
+            self.id == other.id
+            and self.metadata == other.metadata
+            and numpy.array_equal(self.vector, other.vector)
+        )
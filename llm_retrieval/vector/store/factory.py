@@ -1,8 +1,16 @@
-from typing import Callable
+from typing import Callable, Optional
 
 from llm_retrieval.configuration import Configuration
 from llm_retrieval.vector.store.provider.base import VectorStoreClient
 from llm_retrieval.vector.store.provider.pinecone import PineconeVectorStoreClient
+from llm_retrieval.utils.common.rate_limit import RateLimiter
+
+
+def get_vector_store_rate_limiter(configuration: Configuration) -> Optional[RateLimiter]:
+    requests_per_minute = configuration.vector_store_requests_per_minute
+    if requests_per_minute is None:
+        return None
+    return RateLimiter(requests_per_minute)
 
 
 VectorStoreClientBuilder = Callable[..., VectorStoreClient]
@@ -12,6 +20,7 @@ pinecone_vector_store_client_builder: VectorStoreClientBuilder = lambda c: Pinec
     dimension=c.pinecone_dimension,
     index_name=c.pinecone_index_name,
     metadata_type=c.pinecone_metadata_type,
+    rate_limiter=get_vector_store_rate_limiter(c),
 )
 
 
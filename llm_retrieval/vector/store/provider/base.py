@@ -1,14 +1,47 @@
 import abc
+from typing import Optional
+
+from tenacity import AsyncRetrying, stop_after_attempt
 
 from llm_retrieval.vector.store import StoredVector
+from llm_retrieval.utils.common.concurrency import RequestRecorder
+from llm_retrieval.utils.common.concurrency import call_and_record
+from llm_retrieval.utils.common.rate_limit import RateLimiter
 
 
 class VectorStoreClient(abc.ABC):
     UPSERT_BATCH_SIZE: int
+    # The maximum size of an upsert request, if the store limits it.
+    UPSERT_PAYLOAD_BYTES: Optional[int] = None
+    rate_limiter: Optional[RateLimiter] = None
+
+    def estimate_upsert_payload_bytes(self, vector: StoredVector) -> int:
+        """Estimates the number of bytes that a vector adds to an upsert request."""
+        return len(vector.json())
+
+    async def upsert_batch_async(
+        self,
+        vectors: list[StoredVector],
+        record_request: Optional[RequestRecorder] = None,
+    ) -> None:
+        """Takes in a list of vectors and updates/inserts them into the database.
+
+        If the client has a rate limiter, waits for it before each attempt at the request, retries included.
+
+        Args:
+            vectors: The vectors to upsert.
+            record_request: Records the latency and outcome of each attempt at the request to the store,
+                e.g. ConcurrencyLimit.record. Waiting for the rate limiter and between retries is not counted.
+        """
+        async for attempt in self._retrying():
+            with attempt:
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire()
+                await call_and_record(self._upsert_batch_async(vectors), record_request)
 
-    async def upsert_batch_async(self, vectors: list[StoredVector]) -> None:
-        """Takes in a list of vectors and updates/inserts them into the database."""
-        await self._upsert_batch_async(vectors)
+    def _retrying(self) -> AsyncRetrying:
+        """Returns the policy that failed requests are retried by. Defaults to no retries."""
+        return AsyncRetrying(stop=stop_after_attempt(1), reraise=True)
 
     @abc.abstractmethod
     async def _upsert_batch_async(self, vectors: list[StoredVector]) -> None:
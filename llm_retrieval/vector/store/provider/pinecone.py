@@ -1,13 +1,22 @@
+from typing import Optional
+
 import pinecone
-from tenacity import retry, stop_after_attempt, wait_random_exponential
+from tenacity import AsyncRetrying, retry, stop_after_attempt, wait_random_exponential
 
+from llm_retrieval.vector import vector_to_list
 from llm_retrieval.vector.store import StoredVector
 from llm_retrieval.vector.store import StoredVectorMetadata
 from llm_retrieval.vector.store.provider.base import VectorStoreClient
+from llm_retrieval.utils.common.rate_limit import RateLimiter
+
+
+# Upper bound on the size of a float value serialized in an upsert request.
+SERIALIZED_VALUE_BYTES_ESTIMATE = 24
 
 
 class PineconeVectorStoreClient(VectorStoreClient):
     UPSERT_BATCH_SIZE = 100
+    UPSERT_PAYLOAD_BYTES = 2 * 1024 * 1024
     REQUIRED_METADATA_FIELDS = set()
 
     def __init__(
@@ -17,7 +26,9 @@ class PineconeVectorStoreClient(VectorStoreClient):
         dimension: int,
         index_name: str,
         metadata_type: type[StoredVectorMetadata],
+        rate_limiter: Optional[RateLimiter] = None,
     ):
+        self.rate_limiter = rate_limiter
         self.metadata_type = metadata_type
         self._verify_metadata_shape()
         self.dimension = dimension
@@ -29,6 +40,10 @@ class PineconeVectorStoreClient(VectorStoreClient):
         metadata_fields = set(self.metadata_type.__fields__.keys())
         assert self.REQUIRED_METADATA_FIELDS.issubset(metadata_fields), f"Metadata must contain the following fields: {self.REQUIRED_METADATA_FIELDS}."
 
+    def estimate_upsert_payload_bytes(self, vector: StoredVector) -> int:
+        # Serializing every vector to measure it would cost more than the upsert itself.
+        return len(vector.id) + len(vector.vector) * SERIALIZED_VALUE_BYTES_ESTIMATE + len(vector.metadata.json())
+
     @retry(wait=wait_random_exponential(min=10, max=120), stop=stop_after_attempt(6))
     def _create_or_get_index(self, name: str):
         if name not in pinecone.list_indexes():
@@ -47,8 +62,11 @@ class PineconeVectorStoreClient(VectorStoreClient):
         index.describe_index_stats()
         return index
 
-    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(3))
+    def _retrying(self) -> AsyncRetrying:
+        return AsyncRetrying(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(3))
+
     async def _upsert_batch_async(self, vectors: list[StoredVector]) -> None:
         assert len(vectors) <= self.UPSERT_BATCH_SIZE, f"Batch size should not be larger than {self.UPSERT_BATCH_SIZE}."
-        payload = [(v.id, v.vector, v.metadata.dict()) for v in vectors]
+        # The vectors are only converted to lists of floats here, to be serialized.
+        payload = [(v.id, vector_to_list(v.vector), v.metadata.dict()) for v in vectors]
         self.index.upsert(payload)
@@ -0,0 +1,8 @@
+#!/usr/bin/env bash
+
+# Bundles the tokenizer BPE files with the llm_retrieval package (and so the llm-retrieval layer),
+# so that Lambda cold starts load them from disk rather than fetching them.
+set -euo pipefail
+
+cd "$(dirname "$0")/.."
+TIKTOKEN_CACHE_DIR=llm_retrieval/tokenizer_bpe python -c "import tiktoken; tiktoken.get_encoding('cl100k_base')"
@@ -0,0 +1,42 @@
+import importlib.util
+import pathlib
+
+import pytest
+
+import llm_retrieval.utils
+
+
+ROOT_PATH = pathlib.Path(__file__).parents[4]
+LAMBDAS_PATH = ROOT_PATH / 'functions' / 'aws' / 'lambdas'
+# The handlers import the AWS utilities from their own layer, merged as in tests/llm_retrieval/utils/aws.
+AWS_UTILS_PATH = ROOT_PATH / 'functions' / 'aws' / 'layers' / 'llm-retrieval-aws-utils' / 'llm_retrieval' / 'utils'
+if str(AWS_UTILS_PATH) not in llm_retrieval.utils.__path__:
+    llm_retrieval.utils.__path__.append(str(AWS_UTILS_PATH))
+
+
+class LambdaContext:
+    function_name = 'test-function'
+    memory_limit_in_mb = 128
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:000000000000:function:test-function'
+    aws_request_id = 'test-request'
+
+
+@pytest.fixture
+def load_lambda(monkeypatch):
+    """Returns a function that imports a Lambda's index module afresh, with the given environment."""
+
+    def load(name: str, environ: dict):
+        monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+        for key, value in environ.items():
+            monkeypatch.setenv(key, value)
+        spec = importlib.util.spec_from_file_location(name.replace('-', '_'), LAMBDAS_PATH / name / 'index.py')
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    return load
+
+
+@pytest.fixture
+def lambda_context():
+    return LambdaContext()
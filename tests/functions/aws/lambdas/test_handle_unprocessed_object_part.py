@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from llm_retrieval.document.chunk.stream import EncodedChunkStream
+from llm_retrieval.utils.aws.s3 import S3ObjectId
+from llm_retrieval.utils.aws.s3 import S3ObjectPartId
+
+
+class _FakePipeline:
+    """Collects the text of every stream run through it, by vector prefix."""
+
+    def __init__(self):
+        self.text_by_prefix = {}
+
+    async def run(self, decoded_chunk_stream, vector_prefixes, metadata):
+        text = ''.join([decoded_chunk.text for decoded_chunk in decoded_chunk_stream])
+        self.text_by_prefix[vector_prefixes] = self.text_by_prefix.get(vector_prefixes, '') + text
+
+
+def _object_part_record(message_id: str, key: str, data: bytes) -> dict:
+    object_part_id = S3ObjectPartId(object_id=S3ObjectId(bucket='bucket', key=key), start=0, end=len(data))
+    return {'messageId': message_id, 'body': object_part_id.json(by_alias=True)}
+
+
+@pytest.fixture
+def index(load_lambda):
+    return load_lambda('handle-unprocessed-object-part', {
+        'CHUNK_SIZE': '16',
+        'MAX_CONCURRENT_BATCHES': '2',
+        'OPENAI_API_KEY_SECRET_ARN': 'openai',
+        'PINECONE_API_KEY_SECRET_ARN': 'pinecone',
+    })
+
+
+def test_process_sqs_records_given_failing_record_reports_only_it(index, monkeypatch):
+    data_by_key = {
+        'one': b'The first object has a few words in it. ',
+        'two': b'The second object has a few more words in it. ',
+    }
+
+    def read_object_part(object_part_id):
+        if object_part_id.object_id.key not in data_by_key:
+            raise RuntimeError(f'failed to read {object_part_id.object_id.key}')
+        data = data_by_key[object_part_id.object_id.key]
+        return EncodedChunkStream(object_part_id.encoding).append_wrapped([data[:10], data[10:]]), None
+
+    pipeline = _FakePipeline()
+    monkeypatch.setattr(index, 'read_object_part', read_object_part)
+    monkeypatch.setattr(index, 'get_pipeline', lambda: pipeline)
+    sqs_records = [
+        _object_part_record('1', 'one', data_by_key['one']),
+        _object_part_record('2', 'missing', b'0123456789'),
+        _object_part_record('3', 'two', data_by_key['two']),
+    ]
+    batch_item_failures = asyncio.run(index.process_sqs_records(sqs_records))
+    assert batch_item_failures == [{'itemIdentifier': '2'}]
+    assert pipeline.text_by_prefix == {
+        'bucket/one': data_by_key['one'].decode(),
+        'bucket/two': data_by_key['two'].decode(),
+    }
+
+
+def test_process_sqs_records_given_invalid_bytes_past_detection_sample_replaces_them(index, monkeypatch):
+    # The encoding is detected from the head of the object, so bytes invalid in it may come later.
+    data = b'valid words ' * 1000 + b'then \xff\xfe invalid bytes '
+
+    def read_object_part(object_part_id):
+        return EncodedChunkStream(object_part_id.encoding).append_wrapped([data]), None
+
+    pipeline = _FakePipeline()
+    monkeypatch.setattr(index, 'read_object_part', read_object_part)
+    monkeypatch.setattr(index, 'get_pipeline', lambda: pipeline)
+    batch_item_failures = asyncio.run(index.process_sqs_records([_object_part_record('1', 'key', data)]))
+    assert batch_item_failures == []
+    assert pipeline.text_by_prefix == {'bucket/key': data.decode('utf-8', errors='replace')}
@@ -0,0 +1,67 @@
+import json
+import threading
+
+import pytest
+
+from llm_retrieval.utils.aws.s3 import parse_object_part_ids
+from llm_retrieval.utils.aws.sqs import SqsMessageSender
+
+
+class _FakeS3ObjectReader:
+    """Reads the heads of objects, failing for the keys given."""
+
+    def __init__(self, failing_keys: set):
+        self._failing_keys = failing_keys
+
+    def read_head(self, object_id, size):
+        if object_id.key in self._failing_keys:
+            raise RuntimeError(f'failed to read {object_id.key}')
+        return b'hello world'[:size]
+
+
+class _FakeSqsClient:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.messages = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        with self._lock:
+            self.messages.extend(entry['MessageBody'] for entry in Entries)
+        return {'Successful': []}
+
+
+def _upload_notification(message_id: str, key: str, size: int) -> dict:
+    body = {'Records': [{'s3': {'object': {'key': key, 'size': size}}}]}
+    return {'messageId': message_id, 'body': json.dumps(body)}
+
+
+@pytest.fixture
+def index(load_lambda):
+    return load_lambda('handle-upload-notification', {
+        'UPLOAD_BUCKET_NAME': 'bucket',
+        'UNPROCESSED_OBJECT_PART_QUEUE_URL': 'queue',
+        'MIN_PART_SIZE': '4',
+        'MAX_PART_SIZE': '8',
+    })
+
+
+def test_handler_given_failing_record_reports_only_it(index, lambda_context, monkeypatch):
+    sqs_client = _FakeSqsClient()
+    monkeypatch.setattr(index, 's3_object_reader', _FakeS3ObjectReader({'bad'}))
+    monkeypatch.setattr(index, 'sqs_message_sender', SqsMessageSender(sqs_client))
+    event = {'Records': [
+        _upload_notification('1', 'large', 16),
+        _upload_notification('2', 'bad', 16),
+        _upload_notification('3', 'small', 2),
+    ]}
+    result = index.handler(event, lambda_context)
+    assert result == {'batchItemFailures': [{'itemIdentifier': '2'}]}
+    part_ids = [part_id for message in sqs_client.messages for part_id in parse_object_part_ids(message)]
+    assert sorted((p.object_id.key, p.start, p.end) for p in part_ids) == [
+        ('large', 0, 4),
+        ('large', 4, 8),
+        ('large', 8, 12),
+        ('large', 12, 16),
+        ('small', 0, 2),
+    ]
@@ -43,12 +43,15 @@ def utf8_split(request):
 @pytest.fixture
 def mock_embedding_client_factory():
 
-    async def embed_batch_async(texts):
+    async def embed_batch_async(texts, n_tokens_per_text=None, record_request=None):
+        if record_request is not None:
+            record_request(0.0, None)
         return [[1.0]] * len(texts)
 
     def factory():
         m = create_autospec(EmbeddingClient)
         m.EMBED_BATCH_SIZE = 21344
+        m.EMBED_BATCH_TOKENS = None
         m.embed_batch_async.side_effect = embed_batch_async
         return m
     
@@ -58,10 +61,15 @@ def mock_embedding_client_factory():
 @pytest.fixture
 def mock_vector_store_client_factory():
 
+    async def upsert_batch_async(vectors, record_request=None):
+        if record_request is not None:
+            record_request(0.0, None)
+
     def factory():
         m = create_autospec(VectorStoreClient)
         m.UPSERT_BATCH_SIZE = 16234
-        m.upsert_batch_async.return_value = None
+        m.UPSERT_PAYLOAD_BYTES = None
+        m.upsert_batch_async.side_effect = upsert_batch_async
         return m
     
     return factory
@@ -1,19 +1,30 @@
+import io
+import asyncio
+import codecs
 import pickle
 import itertools
 
 import pytest
+from unittest.mock import ANY
 from unittest.mock import call
 
 from llm_retrieval.document.chunk import EncodedChunk
 from llm_retrieval.document.chunk import DecodedChunk
 from llm_retrieval.document.chunk.stream import EncodedChunkStream
 from llm_retrieval.document.chunk.stream import DecodedChunkStream
+from llm_retrieval.document.chunk.stream.transformation import DecodedChunkStreamBoundaryTrimmer
 from llm_retrieval.document.chunk.stream.transformation import DecodedChunkStreamResizerByNumTokens
 from llm_retrieval.document.chunk.stream.transformation import DecodedChunkStreamSplitWordHealer
 from llm_retrieval.document.chunk.stream.conversion import EncodedToDecodedChunkStreamConverterWithSplitCharacterHealing
+from llm_retrieval.document.chunk.stream.conversion import EncodedToDecodedChunkStreamConverterWithIncrementalDecoding
 from llm_retrieval.document.chunk.stream.processing import embed_and_upsert_decoded_chunk_stream
+from llm_retrieval.document.chunk.stream.processing import embed_and_upsert_decoded_chunk_stream_async
+from llm_retrieval.document.chunk.stream.processing import EmbedAndUpsertPipeline
+from llm_retrieval.document.chunk.stream.processing import MAX_BATCH_ATTEMPTS_DEFAULT
 from llm_retrieval.vector.store import StoredVectorMetadata
 from llm_retrieval.vector.store import StoredVector
+from llm_retrieval.tokenizer import get_tokenizer
+from llm_retrieval.utils.common.concurrency import AimdConcurrencyLimit
 
 
 def test_wrap_raw_encoded_chunk_stream_given_no_chunks():
@@ -69,6 +80,83 @@ def test_wrap_raw_encoded_chunk_stream_given_start_byte_iterable():
     assert actual == expected
 
 
+@pytest.mark.parametrize('text', ['Hello, world!', 'Hello, wörld! 日本語 😀', '😀😀😀 Hello'])
+@pytest.mark.parametrize('encoding', ['utf-8', 'utf-16-le'])
+def test_decoded_chunk_byte_offset(text, encoding):
+    start = 37
+    encoded = text.encode(encoding)
+    chunk = DecodedChunk(text, start, start + len(encoded), encoding)
+    for index in range(len(text) + 1):
+        assert chunk.byte_offset(index) == start + len(text[:index].encode(encoding))
+
+
+@pytest.mark.parametrize('text', ['Hello, world!', 'Hello, wörld! 日本語 😀', '😀😀😀 Hello'])
+@pytest.mark.parametrize('encoding', ['utf-8', 'utf-16-le'])
+def test_decoded_chunk_char_index(text, encoding):
+    start = 37
+    encoded = text.encode(encoding)
+    chunk = DecodedChunk(text, start, start + len(encoded), encoding)
+    for index in range(len(text) + 1):
+        assert chunk.char_index(chunk.byte_offset(index)) == index
+    for byte_offset in range(start - 2, start + len(encoded) + 2):
+        index = chunk.char_index(byte_offset)
+        assert chunk.byte_offset(index) >= min(max(byte_offset, start), chunk.end)
+        assert index == 0 or chunk.byte_offset(index - 1) < byte_offset
+
+
+@pytest.mark.parametrize('readable_type', [io.BytesIO, io.BufferedReader])
+def test_read_encoded_chunk_stream(readable_type):
+    start = 74
+    chunk_size = 5
+    data = b'Hello, world! Foo bar! Baz qux! 123'
+    encoding = 'utf-8'
+    readable = readable_type(io.BytesIO(data)) if readable_type is io.BufferedReader else readable_type(data)
+    expected = [
+        (data[i:i + chunk_size], start + i, start + min(i + chunk_size, len(data)))
+        for i in range(0, len(data), chunk_size)
+    ]
+    actual = [
+        (bytes(chunk.data), chunk.start, chunk.end)
+        for chunk in EncodedChunkStream(encoding).append_read(readable, chunk_size, start)
+    ]
+    assert actual == expected
+
+
+def test_read_encoded_chunk_stream_given_readable_without_readinto():
+
+    class Readable:
+
+        def __init__(self, data):
+            self._stream = io.BytesIO(data)
+
+        def read(self, n):
+            return self._stream.read(n)
+
+    chunk_size = 4
+    data = b'Hello, world!'
+    encoding = 'utf-8'
+    expected = list(EncodedChunkStream(encoding).append_wrapped(
+        data[i:i + chunk_size] for i in range(0, len(data), chunk_size)
+    ))
+    actual = list(EncodedChunkStream(encoding).append_read(Readable(data), chunk_size))
+    assert actual == expected
+
+
+def test_read_encoded_chunk_stream_async_given_reused_read_buffer():
+    chunk_size = 5
+    data = b'Hello, world! Foo bar! Baz qux! 123'
+    encoding = 'utf-8'
+    expected = list(EncodedChunkStream(encoding).append_wrapped(
+        data[i:i + chunk_size] for i in range(0, len(data), chunk_size)
+    ))
+
+    async def read():
+        stream = EncodedChunkStream(encoding).append_read(io.BytesIO(data), chunk_size)
+        return [chunk async for chunk in stream.aiter(max_buffered=3)]
+
+    assert asyncio.run(read()) == expected
+
+
 def test_wrap_raw_decoded_chunk_stream_given_no_chunks():
     raw_decoded_chunk_stream = []
     encoding = 'utf-8'
@@ -261,6 +349,125 @@ def test_encoded_to_decoded_chunk_stream_with_truncation_healing_given_contiguou
     assert actual == expected
 
 
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 7])
+def test_encoded_to_decoded_chunk_stream_with_truncation_healing_given_reused_read_buffer(chunk_size):
+    encoding = 'utf-8'
+    start = 12
+    original = 'Hello, wörld! 日本語 😀 foo — bar\n'
+    encoded = io.BytesIO(original.encode(encoding))
+    encoded_chunk_stream = EncodedChunkStream(encoding).append_read(encoded, chunk_size, start)
+    actual = list(EncodedToDecodedChunkStreamConverterWithSplitCharacterHealing().decode(encoded_chunk_stream))
+    assert ''.join(a.text for a in actual) == original
+    assert [a.start for a in actual] == [start] + [a.end for a in actual[:-1]]
+    assert all(a.end - a.start == len(a.text.encode(encoding)) for a in actual)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 1024])
+@pytest.mark.parametrize('encoding, expected_encoding, bom', [
+    ('utf-8', 'utf-8', b''),
+    ('utf-8', 'utf-8', codecs.BOM_UTF8),
+    ('utf-8-sig', 'utf-8', codecs.BOM_UTF8),
+    ('utf-8-sig', 'utf-8', b''),
+    ('utf-16', 'utf-16-le', codecs.BOM_UTF16_LE),
+    ('utf-16', 'utf-16-be', codecs.BOM_UTF16_BE),
+    ('utf-16-be', 'utf-16-be', b''),
+    ('utf-32', 'utf-32-be', codecs.BOM_UTF32_BE),
+    ('cp1252', 'cp1252', b''),
+    ('latin-1', 'latin-1', b''),
+])
+def test_encoded_to_decoded_chunk_stream_with_incremental_decoding(encoding, expected_encoding, bom, chunk_size):
+    original = 'Hello, wörld! Ça va? Foo bar\n' if 'utf' not in encoding else 'Hello, wörld! 日本語 😀 foo — bar\n'
+    encoded = io.BytesIO(bom + original.encode(expected_encoding))
+    encoded_chunk_stream = EncodedChunkStream(encoding).append_read(encoded, chunk_size)
+    decoded_chunk_stream = EncodedToDecodedChunkStreamConverterWithIncrementalDecoding().decode(encoded_chunk_stream)
+    actual = list(decoded_chunk_stream)
+    assert decoded_chunk_stream.encoding == expected_encoding
+    assert ''.join(a.text for a in actual) == original
+    assert [a.start for a in actual] == [len(bom)] + [a.end for a in actual[:-1]]
+    assert all(a.end - a.start == len(a.text.encode(expected_encoding)) for a in actual)
+    assert all(a.encoding == expected_encoding for a in actual)
+
+
+def test_encoded_to_decoded_chunk_stream_with_incremental_decoding_given_contiguous_and_noncontiguous_chunks(utf8_split):
+    first, second = utf8_split
+    encoding = 'utf-8'
+    raw_encoded_chunk_stream = [
+        first,
+        second,
+        b'Hello' + first,
+        second + b'world!',
+        b'Foo bar!',
+        first,
+    ]
+    encoded_starts = [
+        32,
+        32 + len(first),
+        8,
+        90,
+        0,
+        16,
+    ]
+    encoded_chunk_stream = EncodedChunkStream(encoding).append_wrapped(raw_encoded_chunk_stream, encoded_starts)
+    raw_decoded_chunk_stream = [
+        (first + second).decode(encoding),
+        'Hello',
+        'world!',
+        'Foo bar!',
+    ]
+    decoded_starts = [
+        32,
+        8,
+        90 + len(second),
+        0,
+    ]
+    expected = list(DecodedChunkStream(encoding).append_wrapped(raw_decoded_chunk_stream, decoded_starts))
+    actual = list(EncodedToDecodedChunkStreamConverterWithIncrementalDecoding().decode(encoded_chunk_stream))
+    assert actual == expected
+
+
+@pytest.mark.parametrize('encoding', ['utf-16-le', 'utf-16-be'])
+def test_encoded_to_decoded_chunk_stream_with_incremental_decoding_given_noncontiguous_utf16_chunks(encoding):
+    encoded = 'Hi 😀 there'.encode(encoding)
+    # starts partway through the surrogate pair of the emoji, one byte after a code unit boundary
+    start = 9
+    encoded_chunk_stream = EncodedChunkStream(encoding).append_wrapped([encoded[start:]], start)
+    expected = [DecodedChunk(' there', 10, len(encoded), encoding)]
+    actual = list(EncodedToDecodedChunkStreamConverterWithIncrementalDecoding().decode(encoded_chunk_stream))
+    assert actual == expected
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3])
+@pytest.mark.parametrize('encoding, original, start, expected_text', [
+    ('utf-8', 'aé 😀 bc', 5, ' bc'),
+    ('utf-8', 'aé 😀 bc', 6, ' bc'),
+    ('utf-8', 'aé 😀 bc', 2, ' 😀 bc'),
+    ('utf-16-le', 'Hi 😀 there', 9, ' there'),
+    ('utf-16-be', 'Hi 😀 there', 8, ' there'),
+])
+def test_encoded_to_decoded_chunk_stream_with_incremental_decoding_given_short_chunks_within_leading_character(
+    chunk_size,
+    encoding,
+    original,
+    start,
+    expected_text,
+):
+    encoded = original.encode(encoding)
+    encoded_chunk_stream = EncodedChunkStream(encoding).append_read(io.BytesIO(encoded[start:]), chunk_size, start)
+    actual = list(EncodedToDecodedChunkStreamConverterWithIncrementalDecoding().decode(encoded_chunk_stream))
+    assert ''.join(a.text for a in actual) == expected_text
+    assert actual[0].start == len(encoded) - len(expected_text.encode(encoding))
+    assert [a.start for a in actual[1:]] == [a.end for a in actual[:-1]]
+    assert actual[-1].end == len(encoded)
+
+
+def test_encoded_to_decoded_chunk_stream_with_incremental_decoding_given_invalid_utf8():
+    encoding = 'utf-8'
+    raw_encoded_chunk_stream = [b'Hello, world!\xc3', b'\x28 Foo bar!']
+    encoded_chunk_stream = EncodedChunkStream(encoding).append_wrapped(raw_encoded_chunk_stream)
+    with pytest.raises(UnicodeDecodeError):
+        list(EncodedToDecodedChunkStreamConverterWithIncrementalDecoding().decode(encoded_chunk_stream))
+
+
 def test_resize_decoded_chunks_in_stream_by_num_tokens_given_no_chunks():
     actual = list(DecodedChunkStreamResizerByNumTokens(DecodedChunkStream('utf-8')))
     assert actual == []
@@ -326,6 +533,50 @@ def test_resize_decoded_chunks_in_stream_by_num_tokens_given_contiguous_and_nonc
     assert actual == expected
 
 
+def test_resize_decoded_chunks_in_stream_by_num_tokens_given_single_large_chunk():
+    encoding = 'utf-8'
+    min_tokens = 15
+    max_tokens = 25
+    start = 17
+    original_text = ' '.join(f'Sentence number {i} is here, and it is fine.' for i in range(500))
+    original_text_stream = DecodedChunkStream(encoding).append_wrapped([original_text], start)
+    actual = list(DecodedChunkStreamResizerByNumTokens(original_text_stream, min_tokens, max_tokens))
+    assert original_text.startswith(''.join(a.text for a in actual))
+    assert [a.start for a in actual] == [start] + [a.end for a in actual[:-1]]
+    assert all(a.end - a.start == len(a.text.encode(encoding)) for a in actual)
+
+
+def test_resize_decoded_chunks_in_stream_by_num_tokens_given_characters_split_across_tokens():
+    # each parrot emoji is encoded as three tokens, so the maximum of eight tokens
+    # would split the third parrot if the resizer did not respect character boundaries
+    encoding = 'utf-8'
+    min_tokens = 1
+    max_tokens = 8
+    original_text = ['🦜' * 30]
+    original_text_stream = DecodedChunkStream(encoding).append_wrapped(original_text)
+    resized_text = ['🦜🦜'] * 15
+    expected = list(DecodedChunkStream(encoding).append_wrapped(resized_text))
+    actual = list(DecodedChunkStreamResizerByNumTokens(original_text_stream, min_tokens, max_tokens))
+    assert actual == expected
+
+
+def test_resize_decoded_chunks_in_stream_by_num_tokens_given_large_chunk_counts_tokens():
+    encoding = 'utf-8'
+    min_tokens = 15
+    max_tokens = 25
+    original_text = ' '.join(f'Sentence number {i} is here, and it is fine.' for i in range(50))
+    original_text_stream = DecodedChunkStream(encoding).append_wrapped([original_text])
+    actual = list(DecodedChunkStreamResizerByNumTokens(original_text_stream, min_tokens, max_tokens))
+    assert all(min_tokens <= a.n_tokens <= max_tokens for a in actual)
+    assert all(a.n_tokens == len(get_tokenizer().encode(a.text)) for a in actual)
+
+
+def test_resize_decoded_chunks_in_stream_by_num_tokens_given_characters_split_across_tokens_counts_tokens():
+    original_text_stream = DecodedChunkStream('utf-8').append_wrapped(['🦜' * 30])
+    actual = list(DecodedChunkStreamResizerByNumTokens(original_text_stream, 1, 8))
+    assert [a.n_tokens for a in actual] == [6] * 15
+
+
 def test_split_word_healing_in_decoded_chunk_stream_given_multiple_inner_splits():
     encoding = 'utf-8'
     original_text = [
@@ -376,6 +627,34 @@ def test_split_word_healing_in_decoded_chunk_stream_given_multiple_inner_splits_
     assert actual == expected
 
 
+def test_split_word_healing_in_decoded_chunk_stream_given_non_ascii_splits_and_noncontiguous_chunks():
+    encoding = 'utf-8'
+    original_text = [
+        "grüße an alle und",
+        " hällo wö",
+        "rld! Thïs i",
+    ]
+    original_starts = [
+        153,
+        32,
+        32 + len(original_text[1].encode(encoding)),
+    ]
+    original_text_stream = DecodedChunkStream(encoding).append_wrapped(original_text, original_starts)
+    expected_text = [
+        " an alle ",
+        " hällo ",
+        "wörld! Thïs ",
+    ]
+    expected_starts = [
+        153 + len("grüße".encode(encoding)),
+        32,
+        32 + len(expected_text[1].encode(encoding)),
+    ]
+    expected = list(DecodedChunkStream(encoding).append_wrapped(expected_text, expected_starts))
+    actual = list(DecodedChunkStreamSplitWordHealer(original_text_stream))
+    assert actual == expected
+
+
 def test_split_word_healing_in_decoded_chunk_stream_given_no_word_delimiters():
     encoding = 'utf-8'
     original_text = [
@@ -454,6 +733,111 @@ def test_split_word_healing_in_decoded_chunk_stream_given_single_word_delimiter(
     assert actual == expected
 
 
+def test_split_word_healing_in_decoded_chunk_stream_given_trusted_stream_boundaries():
+    encoding = 'utf-8'
+    original_text = [
+        "hello wor",
+        "ld!",
+        " ",
+        "  This is",
+    ]
+    original_text_stream = DecodedChunkStream(encoding).append_wrapped(original_text, 10)
+    expected_text = [
+        "hello ",
+        "world!",
+        "   This ",
+        "is",
+    ]
+    expected = list(DecodedChunkStream(encoding).append_wrapped(expected_text, 10))
+    actual = list(DecodedChunkStreamSplitWordHealer(original_text_stream, trust_stream_boundaries=True))
+    assert actual == expected
+
+
+def test_resize_decoded_chunks_in_stream_by_num_tokens_given_trailing_chunk():
+    encoding = 'utf-8'
+    original_text = [
+        'Hello, world!  This is     me',  # 9 tokens
+        ' Bar baz!',  # 3 tokens
+    ]
+    original_text_stream = DecodedChunkStream(encoding).append_wrapped(original_text)
+    expected_text = [
+        'Hello, world!  This is     me Bar baz!',
+    ]
+    expected = list(DecodedChunkStream(encoding).append_wrapped(expected_text))
+    actual = list(DecodedChunkStreamResizerByNumTokens(original_text_stream, 15, 25))
+    assert actual == []
+    original_text_stream = DecodedChunkStream(encoding).append_wrapped(original_text)
+    actual = list(DecodedChunkStreamResizerByNumTokens(original_text_stream, 15, 25, emit_trailing_chunk=True))
+    assert [(a.text, a.start, a.end) for a in actual] == [(e.text, e.start, e.end) for e in expected]
+    assert actual[0].n_tokens == 12
+
+
+@pytest.mark.parametrize('start, end, expected_text', [
+    (0, 9, 'hello wörld'),
+    (9, 20, ', foo bar'),
+    (20, 40, ' baz'),
+    (23, 40, ''),
+])
+def test_trim_decoded_chunk_stream_to_part_given_word_boundaries(start, end, expected_text):
+    encoding = 'utf-8'
+    text = 'hello wörld, foo bar baz'
+    encoded = text.encode(encoding)
+    part = encoded[start:end + DecodedChunkStreamBoundaryTrimmer.read_overhang(8)]
+    stream = DecodedChunkStream(encoding).append_wrapped([part.decode(encoding)], start)
+    actual = list(DecodedChunkStreamBoundaryTrimmer(stream, start, end, max_overhang=8))
+    assert ''.join(a.text for a in actual) == expected_text
+
+
+def test_trim_decoded_chunk_stream_to_part_given_no_word_boundary_within_overhang():
+    encoding = 'utf-8'
+    text = 'x' * 30 + ' end'
+    stream = DecodedChunkStream(encoding).append_wrapped([text[10:30]], 10)
+    actual = list(DecodedChunkStreamBoundaryTrimmer(stream, 10, 20, max_overhang=4))
+    assert actual == list(DecodedChunkStream(encoding).append_wrapped([text[10:20]], 10))
+
+
+@pytest.mark.parametrize('encoding', ['utf-8', 'utf-16-le'])
+@pytest.mark.parametrize('part_size, max_overhang, chunk_size', [(7, 3, 4), (16, 5, 6), (33, 1, 8), (50, 30, 16)])
+def test_trim_decoded_chunk_stream_to_parts_covers_original_text(encoding, part_size, max_overhang, chunk_size):
+    text = 'Hello, wörld! 日本語 😀 ' * 3 + 'x' * 40 + ' bye.\n'
+    encoded = text.encode(encoding)
+    actual = []
+    for start in range(0, len(encoded), part_size):
+        end = min(start + part_size, len(encoded))
+        part = encoded[start:end + DecodedChunkStreamBoundaryTrimmer.read_overhang(max_overhang)]
+        encoded_stream = EncodedChunkStream(encoding).append_wrapped(
+            [part[i:i + chunk_size] for i in range(0, len(part), chunk_size)],
+            start,
+        )
+        decoded = EncodedToDecodedChunkStreamConverterWithIncrementalDecoding().decode(encoded_stream)
+        actual.extend(DecodedChunkStreamBoundaryTrimmer(decoded, start, end, max_overhang))
+    assert ''.join(a.text for a in actual) == text
+    assert all(a.end == b.start for a, b in zip(actual, actual[1:]))
+
+
+@pytest.mark.parametrize('encoding', ['utf-8', 'utf-16-le'])
+@pytest.mark.parametrize('part_size, max_overhang, chunk_size', [(7, 3, 4), (16, 5, 1), (20, 8, 6), (45, 30, 16)])
+def test_trimmed_healed_and_resized_parts_join_to_original_bytes(encoding, part_size, max_overhang, chunk_size):
+    text = ' Hello,   wörld!\n\n 日本語  😀 \t' * 3 + 'x' * 40 + ' bye.  \n  '
+    encoded = text.encode(encoding)
+    actual = []
+    for start in range(0, len(encoded), part_size):
+        end = min(start + part_size, len(encoded))
+        part = encoded[start:end + DecodedChunkStreamBoundaryTrimmer.read_overhang(max_overhang)]
+        encoded_stream = EncodedChunkStream(encoding).append_wrapped(
+            [part[i:i + chunk_size] for i in range(0, len(part), chunk_size)],
+            start,
+        )
+        decoded = EncodedToDecodedChunkStreamConverterWithIncrementalDecoding().decode(encoded_stream)
+        decoded = DecodedChunkStreamBoundaryTrimmer(decoded, start, end, max_overhang)
+        decoded = DecodedChunkStreamSplitWordHealer(decoded, trust_stream_boundaries=True)
+        actual.extend(DecodedChunkStreamResizerByNumTokens(decoded, 3, 5, emit_trailing_chunk=True))
+    assert b''.join(a.text.encode(encoding) for a in actual) == encoded
+    assert actual[0].start == 0
+    assert all(a.end == b.start for a, b in zip(actual, actual[1:]))
+    assert actual[-1].end == len(encoded)
+
+
 def test_decoded_chunk_stream_complete_transformation_pipeline_given_average_file_input(inputsdir):
     encoding = 'utf-8'
     chunk_size = 500
@@ -496,8 +880,8 @@ def test_decoded_chunk_stream_embed_and_upsert_async_given_mocked_clients(
         batch_size,
     )
     embedding_client.embed_batch_async.assert_has_calls([
-        call(["hello ", "world! This "]),
-        call(["is a test."]),
+        call(["hello ", "world! This "], n_tokens_per_text=None, record_request=ANY),
+        call(["is a test."], n_tokens_per_text=None, record_request=ANY),
     ])
     starts = list(itertools.accumulate(itertools.chain([0], (len(t) for t in original_text))))
     vector_store_client.upsert_batch_async.assert_has_calls([
@@ -510,11 +894,358 @@ def test_decoded_chunk_stream_embed_and_upsert_async_given_mocked_clients(
                 id=f'{vector_prefix}:{starts[1]}-{starts[2]}',
                 vector=[1.0],
                 metadata=metadata),
-        ]),
+        ], record_request=ANY),
         call([
             StoredVector(
                 id=f'{vector_prefix}:{starts[2]}-{starts[3]}',
                 vector=[1.0],
                 metadata=metadata),
-        ]),
+        ], record_request=ANY),
     ])
+
+
+def test_decoded_chunk_stream_embed_and_upsert_async_given_separate_batch_sizes(
+    mock_embedding_client_factory,
+    mock_vector_store_client_factory,
+):
+    encoding = 'utf-8'
+    original_text = [f'chunk {i} ' for i in range(7)]
+    original_text_stream = DecodedChunkStream(encoding).append_wrapped(original_text)
+    metadata = StoredVectorMetadata()
+    embedding_client = mock_embedding_client_factory()
+    vector_store_client = mock_vector_store_client_factory()
+    embed_and_upsert_decoded_chunk_stream(
+        original_text_stream,
+        'vector-',
+        metadata,
+        embedding_client,
+        vector_store_client,
+        max_concurrent_batches=2,
+        batch_size=4,
+        upsert_batch_size=3,
+        max_concurrent_upsert_batches=1,
+        max_queued_upsert_batches=1,
+    )
+    embedding_client.embed_batch_async.assert_has_calls([
+        call(original_text[:4], n_tokens_per_text=None, record_request=ANY),
+        call(original_text[4:], n_tokens_per_text=None, record_request=ANY),
+    ])
+    upsert_batch_sizes = sorted(len(c.args[0]) for c in vector_store_client.upsert_batch_async.call_args_list)
+    assert upsert_batch_sizes == [1, 3, 3]
+    upserted_ids = {v.id for c in vector_store_client.upsert_batch_async.call_args_list for v in c.args[0]}
+    assert len(upserted_ids) == len(original_text)
+
+
+def test_decoded_chunk_stream_embed_and_upsert_async_given_upsert_payload_limit(
+    mock_embedding_client_factory,
+    mock_vector_store_client_factory,
+):
+    encoding = 'utf-8'
+    original_text = [f'chunk {i} ' for i in range(5)]
+    original_text_stream = DecodedChunkStream(encoding).append_wrapped(original_text)
+    embedding_client = mock_embedding_client_factory()
+    vector_store_client = mock_vector_store_client_factory()
+    vector_store_client.UPSERT_PAYLOAD_BYTES = 20
+    vector_store_client.estimate_upsert_payload_bytes.side_effect = lambda v: 10
+    embed_and_upsert_decoded_chunk_stream(
+        original_text_stream,
+        'vector-',
+        StoredVectorMetadata(),
+        embedding_client,
+        vector_store_client,
+        max_concurrent_batches=1,
+    )
+    embedding_client.embed_batch_async.assert_called_once_with(original_text, n_tokens_per_text=None, record_request=ANY)
+    upsert_batch_sizes = [len(c.args[0]) for c in vector_store_client.upsert_batch_async.call_args_list]
+    assert upsert_batch_sizes == [2, 2, 1]
+
+
+def test_decoded_chunk_stream_embed_and_upsert_async_given_failing_upsert(
+    mock_embedding_client_factory,
+    mock_vector_store_client_factory,
+):
+    encoding = 'utf-8'
+    original_text = [f'chunk {i} ' for i in range(20)]
+    original_text_stream = DecodedChunkStream(encoding).append_wrapped(original_text)
+    embedding_client = mock_embedding_client_factory()
+    vector_store_client = mock_vector_store_client_factory()
+    vector_store_client.upsert_batch_async.side_effect = RuntimeError('upsert failed')
+    with pytest.raises(RuntimeError, match='upsert failed'):
+        embed_and_upsert_decoded_chunk_stream(
+            original_text_stream,
+            'vector-',
+            StoredVectorMetadata(),
+            embedding_client,
+            vector_store_client,
+            max_concurrent_batches=2,
+            batch_size=2,
+            upsert_batch_size=1,
+            max_concurrent_upsert_batches=1,
+            max_queued_upsert_batches=1,
+        )
+    assert vector_store_client.upsert_batch_async.call_count == len(original_text) * MAX_BATCH_ATTEMPTS_DEFAULT
+
+
+def test_decoded_chunk_stream_embed_and_upsert_async_given_failing_embed(
+    mock_embedding_client_factory,
+    mock_vector_store_client_factory,
+):
+    encoding = 'utf-8'
+    original_text = [f'chunk {i} ' for i in range(4)]
+    original_text_stream = DecodedChunkStream(encoding).append_wrapped(original_text)
+    embedding_client = mock_embedding_client_factory()
+    embedding_client.embed_batch_async.side_effect = RuntimeError('embed failed')
+    vector_store_client = mock_vector_store_client_factory()
+    with pytest.raises(RuntimeError, match='embed failed'):
+        embed_and_upsert_decoded_chunk_stream(
+            original_text_stream,
+            'vector-',
+            StoredVectorMetadata(),
+            embedding_client,
+            vector_store_client,
+            max_concurrent_batches=1,
+            batch_size=1,
+        )
+    vector_store_client.upsert_batch_async.assert_not_called()
+
+
+def test_embed_and_upsert_pipeline_given_failed_batches_runs_only_them_again(
+    mock_embedding_client_factory,
+    mock_vector_store_client_factory,
+):
+    encoding = 'utf-8'
+    original_text = [f'chunk {i} ' for i in range(6)]
+    original_text_stream = DecodedChunkStream(encoding).append_wrapped(original_text)
+    failed_once = set()
+
+    async def embed_batch_async(texts, n_tokens_per_text=None, record_request=None):
+        if texts == ['chunk 1 '] and 'embed' not in failed_once:
+            failed_once.add('embed')
+            raise RuntimeError('embed failed')
+        return [[1.0]] * len(texts)
+
+    async def upsert_batch_async(vectors, record_request=None):
+        if vectors[0].id.endswith(':32-40') and 'upsert' not in failed_once:
+            failed_once.add('upsert')
+            raise RuntimeError('upsert failed')
+
+    embedding_client = mock_embedding_client_factory()
+    embedding_client.embed_batch_async.side_effect = embed_batch_async
+    vector_store_client = mock_vector_store_client_factory()
+    vector_store_client.upsert_batch_async.side_effect = upsert_batch_async
+    pipeline = EmbedAndUpsertPipeline(
+        embedding_client,
+        vector_store_client,
+        max_concurrent_batches=2,
+        batch_size=1,
+        max_batch_attempts=2,
+    )
+    asyncio.run(pipeline.run(original_text_stream, 'vector', StoredVectorMetadata()))
+    embedded_texts = [c.args[0][0] for c in embedding_client.embed_batch_async.call_args_list]
+    assert sorted(embedded_texts) == sorted(original_text + ['chunk 1 '])
+    assert embedded_texts[-1] == 'chunk 1 '
+    upserted_ids = [v.id for c in vector_store_client.upsert_batch_async.call_args_list for v in c.args[0]]
+    assert len(upserted_ids) == len(original_text) + 1
+    assert upserted_ids.count('vector:32-40') == 2
+    assert set(upserted_ids) == {f'vector:{8 * i}-{8 * (i + 1)}' for i in range(len(original_text))}
+
+
+def test_embed_and_upsert_pipeline_given_batch_failing_every_attempt_raises(
+    mock_embedding_client_factory,
+    mock_vector_store_client_factory,
+):
+    encoding = 'utf-8'
+    original_text = [f'chunk {i} ' for i in range(4)]
+    original_text_stream = DecodedChunkStream(encoding).append_wrapped(original_text)
+
+    async def embed_batch_async(texts, n_tokens_per_text=None, record_request=None):
+        if texts == ['chunk 2 ']:
+            raise RuntimeError('embed failed')
+        return [[1.0]] * len(texts)
+
+    embedding_client = mock_embedding_client_factory()
+    embedding_client.embed_batch_async.side_effect = embed_batch_async
+    vector_store_client = mock_vector_store_client_factory()
+    pipeline = EmbedAndUpsertPipeline(
+        embedding_client,
+        vector_store_client,
+        max_concurrent_batches=1,
+        batch_size=1,
+        max_batch_attempts=3,
+    )
+    with pytest.raises(RuntimeError, match='embed failed'):
+        asyncio.run(pipeline.run(original_text_stream, 'vector', StoredVectorMetadata()))
+    embedded_texts = [c.args[0][0] for c in embedding_client.embed_batch_async.call_args_list]
+    assert embedded_texts == original_text + ['chunk 2 '] * 2
+    assert vector_store_client.upsert_batch_async.call_count == len(original_text) - 1
+
+
+def test_decoded_chunk_stream_embed_and_upsert_async_given_batch_tokens(
+    mock_embedding_client_factory,
+    mock_vector_store_client_factory,
+):
+    encoding = 'utf-8'
+    original_chunks = [
+        DecodedChunk('a', 0, 1, encoding, n_tokens=4),
+        DecodedChunk('b', 1, 2, encoding, n_tokens=4),
+        DecodedChunk('c', 2, 3, encoding, n_tokens=3),
+        DecodedChunk('dd', 3, 5, encoding),
+        DecodedChunk('e', 5, 6, encoding, n_tokens=12),
+    ]
+    embedding_client = mock_embedding_client_factory()
+    vector_store_client = mock_vector_store_client_factory()
+    embed_and_upsert_decoded_chunk_stream(
+        original_chunks,
+        'vector-',
+        StoredVectorMetadata(),
+        embedding_client,
+        vector_store_client,
+        max_concurrent_batches=1,
+        batch_tokens=10,
+    )
+    embedding_client.embed_batch_async.assert_has_calls([
+        call(['a', 'b'], n_tokens_per_text=[4, 4], record_request=ANY),
+        call(['c', 'dd'], n_tokens_per_text=None, record_request=ANY),
+        call(['e'], n_tokens_per_text=[12], record_request=ANY),
+    ])
+
+
+def test_decoded_chunk_stream_embed_and_upsert_async_given_adaptive_concurrency(
+    mock_embedding_client_factory,
+    mock_vector_store_client_factory,
+):
+    encoding = 'utf-8'
+    original_text = [f'chunk {i} ' for i in range(40)]
+    original_text_stream = DecodedChunkStream(encoding).append_wrapped(original_text)
+    embedding_client = mock_embedding_client_factory()
+    vector_store_client = mock_vector_store_client_factory()
+    embed_concurrency = AimdConcurrencyLimit(1, max_limit=4)
+    upsert_concurrency = AimdConcurrencyLimit(1, max_limit=2)
+    embed_and_upsert_decoded_chunk_stream(
+        original_text_stream,
+        'vector-',
+        StoredVectorMetadata(),
+        embedding_client,
+        vector_store_client,
+        max_concurrent_batches=embed_concurrency,
+        batch_size=1,
+        max_concurrent_upsert_batches=upsert_concurrency,
+    )
+    assert embedding_client.embed_batch_async.call_count == len(original_text)
+    assert vector_store_client.upsert_batch_async.call_count == len(original_text)
+    assert embed_concurrency.limit > 1
+    assert upsert_concurrency.limit > 1
+
+
+def test_decoded_chunk_stream_embed_and_upsert_async_given_read_stream(
+    mock_embedding_client_factory,
+    mock_vector_store_client_factory,
+):
+    encoding = 'utf-8'
+    original = 'Hello, wörld! 日本語 😀 foo — bar\n' * 20
+
+    def read_decoded_chunk_stream():
+        encoded = io.BytesIO(original.encode(encoding))
+        encoded_chunk_stream = EncodedChunkStream(encoding).append_read(encoded, 7)
+        return DecodedChunkStreamSplitWordHealer(
+            EncodedToDecodedChunkStreamConverterWithSplitCharacterHealing().decode(encoded_chunk_stream)
+        )
+
+    expected = [chunk.text for chunk in read_decoded_chunk_stream()]
+    decoded_chunk_stream = read_decoded_chunk_stream()
+    embedding_client = mock_embedding_client_factory()
+    vector_store_client = mock_vector_store_client_factory()
+    asyncio.run(embed_and_upsert_decoded_chunk_stream_async(
+        decoded_chunk_stream,
+        'vector-',
+        StoredVectorMetadata(),
+        embedding_client,
+        vector_store_client,
+        max_concurrent_batches=2,
+        batch_size=3,
+        max_queued_embed_batches=1,
+        max_queued_upsert_batches=1,
+    ))
+    actual = [t for c in embedding_client.embed_batch_async.call_args_list for t in c.args[0]]
+    assert actual == expected
+    assert vector_store_client.upsert_batch_async.call_count == len(embedding_client.embed_batch_async.call_args_list)
+
+
+def test_embed_and_upsert_pipeline_given_concurrent_streams_and_failing_stream(
+    mock_embedding_client_factory,
+    mock_vector_store_client_factory,
+):
+    encoding = 'utf-8'
+    n_active = 0
+    max_active = 0
+
+    async def embed_batch_async(texts, n_tokens_per_text=None, record_request=None):
+        nonlocal n_active, max_active
+        if texts[0].startswith('fail'):
+            raise RuntimeError('embed failed')
+        n_active += 1
+        max_active = max(max_active, n_active)
+        await asyncio.sleep(0.001)
+        n_active -= 1
+        return [[1.0]] * len(texts)
+
+    embedding_client = mock_embedding_client_factory()
+    embedding_client.embed_batch_async.side_effect = embed_batch_async
+    vector_store_client = mock_vector_store_client_factory()
+    pipeline = EmbedAndUpsertPipeline(embedding_client, vector_store_client, max_concurrent_batches=2, batch_size=1)
+
+    async def run_all():
+        streams = [
+            DecodedChunkStream(encoding).append_wrapped([f'{prefix} {i} ' for i in range(5)])
+            for prefix in ('one', 'two', 'fail', 'three')
+        ]
+        return await asyncio.gather(
+            *(pipeline.run(stream, f'vector-{i}', StoredVectorMetadata()) for i, stream in enumerate(streams)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run_all())
+    assert [type(r) for r in results] == [type(None), type(None), RuntimeError, type(None)]
+    assert max_active == 2
+    upserted_ids = {v.id for c in vector_store_client.upsert_batch_async.call_args_list for v in c.args[0]}
+    assert {i.split(':')[0] for i in upserted_ids} == {'vector-0', 'vector-1', 'vector-3'}
+    assert len(upserted_ids) == 15
+
+
+class _SourceMetadata(StoredVectorMetadata):
+    source: str
+
+
+def test_embed_and_upsert_pipeline_given_pooled_batches_of_short_streams(
+    mock_embedding_client_factory,
+    mock_vector_store_client_factory,
+):
+    encoding = 'utf-8'
+    embedding_client = mock_embedding_client_factory()
+    vector_store_client = mock_vector_store_client_factory()
+    pipeline = EmbedAndUpsertPipeline(
+        embedding_client,
+        vector_store_client,
+        max_concurrent_batches=1,
+        batch_size=8,
+        max_batch_wait_seconds=0.01,
+    )
+
+    async def run_all():
+        streams = [
+            DecodedChunkStream(encoding).append_wrapped([f'doc {i} chunk {j} ' for j in range(3)])
+            for i in range(4)
+        ]
+        await asyncio.gather(*(
+            pipeline.run(stream, f'vector-{i}', _SourceMetadata(source=f'doc-{i}'))
+            for i, stream in enumerate(streams)
+        ))
+
+    asyncio.run(run_all())
+    assert embedding_client.embed_batch_async.call_count == 2
+    assert pipeline.stats()['n_items'] == 12
+    stored_vectors = [v for c in vector_store_client.upsert_batch_async.call_args_list for v in c.args[0]]
+    assert len(stored_vectors) == 12
+    for stored_vector in stored_vectors:
+        i = stored_vector.id.split(':')[0].split('-')[1]
+        assert stored_vector.metadata == _SourceMetadata(source=f'doc-{i}')
@@ -1,11 +1,26 @@
 import os
 import asyncio
+import base64
+import http.server
+import json
+import threading
 
+import numpy
 import pytest
+from unittest.mock import call, create_autospec, patch
+from tenacity import AsyncRetrying, stop_after_attempt
 
 from llm_retrieval.configuration import Configuration
+from llm_retrieval.embedding.cache import CachedEmbeddingClient
+from llm_retrieval.embedding.cache import LruEmbeddingCacheStore
+from llm_retrieval.embedding.cache import SqliteEmbeddingCacheStore
 from llm_retrieval.embedding.factory import get_embedding_client
+from llm_retrieval.embedding.provider.base import EmbeddingClient
 from llm_retrieval.embedding.provider.openai import OpenAIEmbeddingClient
+from llm_retrieval.embedding.provider.openai import decode_base64_embeddings
+from llm_retrieval.tokenizer import get_tokenizer
+from llm_retrieval.utils.common.rate_limit import RateLimiter
+from llm_retrieval.vector import VECTOR_DTYPE
 
 
 @pytest.fixture
@@ -36,6 +51,313 @@ def test_openai_embed_batch_async(real_openai_api_key):
     model = "text-embedding-ada-002"
     client = OpenAIEmbeddingClient(real_openai_api_key, model)
     texts = ["Hello world", "Goodbye world"]
-    actual = asyncio.run(client.embed_batch_async(texts))
+    actual = asyncio.run(_embed_and_close(client, texts))
     assert len(actual) == len(texts)
     assert all(len(a) == 1536 for a in actual)
+
+
+def test_get_embedding_client_given_no_rate_limits(fake_openai_api_key):
+    configuration = Configuration(
+        embedding_model_name="text-embedding-ada-002",
+    )
+    configuration.set_openai_api_key_callback(lambda: fake_openai_api_key)
+    actual = get_embedding_client(configuration)
+    assert actual.rate_limiter is None
+
+
+def test_get_embedding_client_given_rate_limits(fake_openai_api_key):
+    configuration = Configuration(
+        embedding_model_name="text-embedding-ada-002",
+        embedding_requests_per_minute=3000,
+        embedding_tokens_per_minute=1000000,
+    )
+    configuration.set_openai_api_key_callback(lambda: fake_openai_api_key)
+    actual = get_embedding_client(configuration)
+    assert isinstance(actual.rate_limiter, RateLimiter)
+    assert actual.rate_limiter.limits_tokens
+
+
+def test_openai_count_tokens(fake_openai_api_key):
+    client = OpenAIEmbeddingClient(fake_openai_api_key, "text-embedding-ada-002")
+    texts = ["Hello world", "Goodbye world, and 🦜"]
+    expected = sum(len(get_tokenizer("cl100k_base").encode(text)) for text in texts)
+    assert client.count_tokens(texts) == expected
+
+
+def test_embed_batch_async_given_rate_limiter_acquires_tokens(fake_openai_api_key):
+    rate_limiter = create_autospec(RateLimiter, instance=True)
+    rate_limiter.limits_tokens = True
+    client = OpenAIEmbeddingClient(fake_openai_api_key, "text-embedding-ada-002", rate_limiter=rate_limiter)
+    texts = ["Hello world", "Goodbye world"]
+    with patch.object(OpenAIEmbeddingClient, "_embed_batch_async", return_value=[[1.0], [1.0]]):
+        actual = asyncio.run(client.embed_batch_async(texts))
+    assert actual == [[1.0], [1.0]]
+    rate_limiter.acquire.assert_called_once_with(client.count_tokens(texts))
+
+
+def test_embed_batch_async_given_n_tokens_per_text_does_not_count_tokens(fake_openai_api_key):
+    rate_limiter = create_autospec(RateLimiter, instance=True)
+    rate_limiter.limits_tokens = True
+    client = OpenAIEmbeddingClient(fake_openai_api_key, "text-embedding-ada-002", rate_limiter=rate_limiter)
+    texts = ["Hello world", "Goodbye world"]
+    with patch.object(OpenAIEmbeddingClient, "_embed_batch_async", return_value=[[1.0], [1.0]]), \
+            patch.object(OpenAIEmbeddingClient, "count_tokens") as count_tokens:
+        asyncio.run(client.embed_batch_async(texts, n_tokens_per_text=[3, 4]))
+    count_tokens.assert_not_called()
+    rate_limiter.acquire.assert_called_once_with(7)
+
+
+def _mock_embedding_client(embedding_by_text: dict):
+    client = create_autospec(OpenAIEmbeddingClient, instance=True)
+    client.EMBED_BATCH_SIZE = OpenAIEmbeddingClient.EMBED_BATCH_SIZE
+    client.EMBED_BATCH_TOKENS = OpenAIEmbeddingClient.EMBED_BATCH_TOKENS
+    client.rate_limiter = None
+
+    async def embed_batch_async(texts, n_tokens_per_text=None, record_request=None):
+        return [embedding_by_text[text] for text in texts]
+
+    client.embed_batch_async.side_effect = embed_batch_async
+    return client
+
+
+def test_cached_embedding_client_given_hits_and_misses():
+    embedding_by_text = {"a": [1.0], "b": [2.0], "c": [3.0]}
+    client = _mock_embedding_client(embedding_by_text)
+    cached_client = CachedEmbeddingClient(client, "model", [LruEmbeddingCacheStore()])
+    assert asyncio.run(cached_client.embed_batch_async(["a", "b"])).tolist() == [[1.0], [2.0]]
+    assert asyncio.run(cached_client.embed_batch_async(["c", "b", "a", "c"])).tolist() == [[3.0], [2.0], [1.0], [3.0]]
+    # Only the misses are embedded, and each once.
+    assert [c.args[0] for c in client.embed_batch_async.call_args_list] == [["a", "b"], ["c"]]
+    stats = cached_client.stats()
+    assert stats["n_texts"] == 6
+    assert stats["n_misses"] == 3
+    assert stats["n_hits"] == 3
+    assert stats["n_repeated_texts"] == 1
+    assert stats["hit_ratio"] == 0.5
+
+
+def test_cached_embedding_client_given_n_tokens_per_text_passes_those_of_misses():
+    client = _mock_embedding_client({"a": [1.0], "b": [2.0], "c": [3.0]})
+    cached_client = CachedEmbeddingClient(client, "model", [LruEmbeddingCacheStore()])
+    asyncio.run(cached_client.embed_batch_async(["a"], n_tokens_per_text=[1]))
+    asyncio.run(cached_client.embed_batch_async(["b", "a", "c"], n_tokens_per_text=[2, 1, 3]))
+    assert [c.kwargs["n_tokens_per_text"] for c in client.embed_batch_async.call_args_list] == [[1], [2, 3]]
+
+
+def test_cached_embedding_client_given_normalized_texts_share_key():
+    client = _mock_embedding_client({"a\nb": [1.0]})
+    cached_client = CachedEmbeddingClient(client, "model", [LruEmbeddingCacheStore()])
+    asyncio.run(cached_client.embed_batch_async(["a\nb"]))
+    assert asyncio.run(cached_client.embed_batch_async(["a b"])).tolist() == [[1.0]]
+    assert client.embed_batch_async.call_count == 1
+
+
+def test_cached_embedding_client_given_persisted_store(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    store = SqliteEmbeddingCacheStore(path)
+    asyncio.run(CachedEmbeddingClient(_mock_embedding_client({"a": [0.5, -1.0]}), "model", [store]).embed_batch_async(["a"]))
+    store.close()
+
+    client = _mock_embedding_client({})
+    lru_store = LruEmbeddingCacheStore()
+    cached_client = CachedEmbeddingClient(client, "model", [lru_store, SqliteEmbeddingCacheStore(path)])
+    assert asyncio.run(cached_client.embed_batch_async(["a"])).tolist() == [[0.5, -1.0]]
+    client.embed_batch_async.assert_not_called()
+    # The hit is promoted to the faster store.
+    assert len(lru_store) == 1
+    assert cached_client.stats()["n_hits_by_store"] == {repr(lru_store): 0, f"SqliteEmbeddingCacheStore({path!r})": 1}
+
+
+def test_cached_embedding_client_given_other_model():
+    store = LruEmbeddingCacheStore()
+    asyncio.run(CachedEmbeddingClient(_mock_embedding_client({"a": [1.0]}), "model", [store]).embed_batch_async(["a"]))
+    client = _mock_embedding_client({"a": [2.0]})
+    assert asyncio.run(CachedEmbeddingClient(client, "other-model", [store]).embed_batch_async(["a"])).tolist() == [[2.0]]
+
+
+def test_cached_embedding_client_given_bloom_filter_skips_lookup_of_unseen_keys():
+    store = create_autospec(LruEmbeddingCacheStore, instance=True)
+    store.IS_BLOCKING = False
+    store.iter_keys.return_value = iter(())
+    cached_client = CachedEmbeddingClient(_mock_embedding_client({"a": [1.0]}), "model", [store])
+    assert asyncio.run(cached_client.embed_batch_async(["a"])).tolist() == [[1.0]]
+    store.get_many.assert_not_called()
+    assert cached_client.stats()["n_filtered_misses"] == 1
+
+
+def test_sqlite_embedding_cache_store_given_many_keys(tmp_path):
+    store = SqliteEmbeddingCacheStore(str(tmp_path / "embeddings.sqlite"))
+    items = [(i.to_bytes(4, "little"), [float(i)]) for i in range(2000)]
+    store.put_many(items)
+    keys = [key for key, _ in items] + [b"absent"]
+    embeddings = store.get_many(keys)
+    assert [embedding.tolist() for embedding in embeddings[:-1]] == [embedding for _, embedding in items]
+    assert embeddings[-1] is None
+    assert sorted(store.iter_keys()) == sorted(key for key, _ in items)
+
+
+def test_lru_embedding_cache_store_given_max_entries():
+    store = LruEmbeddingCacheStore(max_entries=2)
+    store.put_many([(b"a", [1.0]), (b"b", [2.0])])
+    store.get_many([b"a"])
+    store.put_many([(b"c", [3.0])])
+    a, b, c = store.get_many([b"a", b"b", b"c"])
+    assert (a.tolist(), b, c.tolist()) == ([1.0], None, [3.0])
+
+
+def test_get_embedding_client_given_cache_path(fake_openai_api_key, tmp_path):
+    configuration = Configuration(
+        embedding_model_name="text-embedding-ada-002",
+        embedding_cache_path=str(tmp_path / "embeddings.sqlite"),
+    )
+    configuration.set_openai_api_key_callback(lambda: fake_openai_api_key)
+    actual = get_embedding_client(configuration)
+    assert isinstance(actual, CachedEmbeddingClient)
+    assert actual.rate_limiter is None
+
+
+class _OpenAIStubHandler(http.server.BaseHTTPRequestHandler):
+    """Answers embedding requests with base64 encoded embeddings, in reverse order."""
+
+    # Keeps connections open between requests, so that clients can reuse them.
+    protocol_version = "HTTP/1.1"
+    requests = []
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.requests.append((self.path, request, self.headers["Authorization"]))
+        embeddings = [numpy.full(3, i + 0.5, dtype=VECTOR_DTYPE) for i in range(len(request["input"]))]
+        data = [
+            {"object": "embedding", "index": i, "embedding": base64.b64encode(embedding.tobytes()).decode()}
+            for i, embedding in reversed(list(enumerate(embeddings)))
+        ]
+        body = json.dumps({"object": "list", "data": data, "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def openai_stub_api_base():
+    _OpenAIStubHandler.requests = []
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _OpenAIStubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+async def _embed_and_close(client, *batches):
+    try:
+        embeddings = [await client.embed_batch_async(texts) for texts in batches]
+    finally:
+        await client.session_pool.close()
+    return embeddings[0] if len(embeddings) == 1 else embeddings
+
+
+def test_openai_embed_batch_async_given_base64_response(fake_openai_api_key, openai_stub_api_base):
+    client = OpenAIEmbeddingClient(fake_openai_api_key, "text-embedding-ada-002", api_base=openai_stub_api_base)
+    actual = asyncio.run(_embed_and_close(client, ["a", "b\nc", "d"]))
+    assert actual.dtype == VECTOR_DTYPE
+    assert actual.flags.c_contiguous
+    assert actual.tolist() == [[0.5] * 3, [1.5] * 3, [2.5] * 3]
+    [(path, request, _)] = _OpenAIStubHandler.requests
+    assert path == "/v1/engines/text-embedding-ada-002/embeddings"
+    assert request["encoding_format"] == "base64"
+    assert request["input"] == ["a", "b c", "d"]
+
+
+def test_decode_base64_embeddings_given_missing_index():
+    embedding = base64.b64encode(numpy.zeros(2, dtype=VECTOR_DTYPE).tobytes()).decode()
+    with pytest.raises(ValueError):
+        decode_base64_embeddings([{"index": 0, "embedding": embedding}, {"index": 0, "embedding": embedding}], 2)
+
+
+def test_openai_embed_batch_async_given_malformed_response_does_not_retry(fake_openai_api_key, openai_stub_api_base):
+    client = OpenAIEmbeddingClient(fake_openai_api_key, "text-embedding-ada-002", api_base=openai_stub_api_base)
+    with patch("llm_retrieval.embedding.provider.openai.decode_base64_embeddings", side_effect=ValueError):
+        with pytest.raises(ValueError):
+            asyncio.run(_embed_and_close(client, ["a"]))
+    assert len(_OpenAIStubHandler.requests) == 1
+
+
+def test_openai_embed_batch_async_given_consecutive_batches_reuses_connection(fake_openai_api_key, openai_stub_api_base):
+    client = OpenAIEmbeddingClient(fake_openai_api_key, "text-embedding-ada-002", api_base=openai_stub_api_base)
+    asyncio.run(_embed_and_close(client, ["a"], ["b"], ["c"]))
+    stats = client.connection_stats()
+    assert stats["n_connections_created"] == 1
+    assert stats["n_connections_reused"] == 2
+
+
+def test_openai_embed_batch_async_given_clients_with_own_api_keys(openai_stub_api_base):
+    first_client = OpenAIEmbeddingClient("first-key", "text-embedding-ada-002", api_base=openai_stub_api_base)
+    second_client = OpenAIEmbeddingClient("second-key", "text-embedding-ada-002", api_base=openai_stub_api_base)
+
+    async def embed_concurrently():
+        await asyncio.gather(_embed_and_close(first_client, ["a"]), _embed_and_close(second_client, ["b"]))
+
+    asyncio.run(embed_concurrently())
+    authorization_by_input = {request["input"][0]: authorization for _, request, authorization in _OpenAIStubHandler.requests}
+    assert authorization_by_input == {"a": "Bearer first-key", "b": "Bearer second-key"}
+
+
+def test_get_embedding_client_given_max_connections(fake_openai_api_key):
+    configuration = Configuration(
+        embedding_model_name="text-embedding-ada-002",
+        embedding_max_connections=8,
+    )
+    configuration.set_openai_api_key_callback(lambda: fake_openai_api_key)
+    actual = get_embedding_client(configuration)
+    assert actual.connection_stats()["max_connections"] == 8
+
+
+class _FlakyEmbeddingClient(EmbeddingClient):
+    """Fails the first request, and retries it without waiting."""
+
+    EMBED_BATCH_SIZE = 10
+
+    def __init__(self, rate_limiter):
+        self.rate_limiter = rate_limiter
+        self.n_requests = 0
+
+    def _retrying(self):
+        return AsyncRetrying(stop=stop_after_attempt(2), reraise=True)
+
+    async def _embed_batch_async(self, texts):
+        self.n_requests += 1
+        if self.n_requests == 1:
+            raise RuntimeError("rate limited")
+        return [[1.0] for _ in texts]
+
+
+def test_embed_batch_async_given_retry_acquires_rate_limiter_again():
+    rate_limiter = create_autospec(RateLimiter, instance=True)
+    rate_limiter.limits_tokens = True
+    client = _FlakyEmbeddingClient(rate_limiter)
+    texts = ["Hello world", "Goodbye world"]
+    actual = asyncio.run(client.embed_batch_async(texts))
+    assert actual == [[1.0], [1.0]]
+    assert client.n_requests == 2
+    assert rate_limiter.acquire.call_args_list == [call(client.count_tokens(texts))] * 2
+
+
+def test_embed_batch_async_given_record_request_records_each_attempt_without_waits():
+    rate_limiter = create_autospec(RateLimiter, instance=True)
+    rate_limiter.limits_tokens = False
+
+    async def acquire(n_tokens=0):
+        await asyncio.sleep(0.2)
+
+    rate_limiter.acquire.side_effect = acquire
+    client = _FlakyEmbeddingClient(rate_limiter)
+    records = []
+    asyncio.run(client.embed_batch_async(["Hello world"], record_request=lambda *record: records.append(record)))
+    assert [type(exception) for _, exception in records] == [RuntimeError, type(None)]
+    # The waits for the rate limiter are not part of the latency of the requests.
+    assert all(latency < 0.1 for latency, _ in records)
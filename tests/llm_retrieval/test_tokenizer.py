@@ -0,0 +1,39 @@
+import os
+import pathlib
+
+import pytest
+import tiktoken
+
+from llm_retrieval.tokenizer import TokenizerRegistry
+from llm_retrieval.tokenizer import TOKEN_ENCODING_DEFAULT
+from llm_retrieval.tokenizer import TIKTOKEN_CACHE_DIRECTORY_ENV_VAR
+
+
+def test_tokenizer_registry_given_no_gets_loads_nothing():
+    registry = TokenizerRegistry()
+    assert registry.load_seconds_by_name == {}
+
+
+def test_tokenizer_registry_given_repeated_gets_shares_tokenizer():
+    registry = TokenizerRegistry()
+    first = registry.get(TOKEN_ENCODING_DEFAULT)
+    second = registry.get(TOKEN_ENCODING_DEFAULT)
+    assert isinstance(first, tiktoken.Encoding)
+    assert first is second
+    assert list(registry.load_seconds_by_name) == [TOKEN_ENCODING_DEFAULT]
+    assert registry.load_seconds_by_name[TOKEN_ENCODING_DEFAULT] >= 0
+
+
+def test_tokenizer_registry_given_bpe_directory_restores_environment(tmp_path: pathlib.Path, monkeypatch):
+    monkeypatch.delenv(TIKTOKEN_CACHE_DIRECTORY_ENV_VAR, raising=False)
+    registry = TokenizerRegistry(str(tmp_path))
+    with registry._tiktoken_cache_directory():
+        assert os.environ[TIKTOKEN_CACHE_DIRECTORY_ENV_VAR] == str(tmp_path)
+    assert TIKTOKEN_CACHE_DIRECTORY_ENV_VAR not in os.environ
+
+
+def test_tokenizer_registry_given_unknown_name():
+    registry = TokenizerRegistry()
+    with pytest.raises(ValueError):
+        registry.get('unknown')
+    assert registry.load_seconds_by_name == {}
@@ -0,0 +1,9 @@
+import pathlib
+
+import llm_retrieval.utils
+
+
+# The AWS utilities are deployed as a layer of their own, whose llm_retrieval package the Lambda
+# runtime merges with that of the llm-retrieval layer, so they are merged here the same way.
+AWS_UTILS_LAYER_PATH = pathlib.Path(__file__).parents[4] / 'functions' / 'aws' / 'layers' / 'llm-retrieval-aws-utils'
+llm_retrieval.utils.__path__.append(str(AWS_UTILS_LAYER_PATH / 'llm_retrieval' / 'utils'))
@@ -0,0 +1,158 @@
+import io
+import json
+import re
+
+import pytest
+from botocore.exceptions import ClientError
+
+from llm_retrieval.utils.aws.s3 import S3ObjectId
+from llm_retrieval.utils.aws.s3 import S3ObjectPartGroup
+from llm_retrieval.utils.aws.s3 import S3ObjectPartId
+from llm_retrieval.utils.aws.s3 import S3ObjectPartitioner
+from llm_retrieval.utils.aws.s3 import S3ObjectPartRange
+from llm_retrieval.utils.aws.s3 import S3ObjectPartRangeReader
+from llm_retrieval.utils.aws.s3 import S3ObjectPartSizePolicy
+from llm_retrieval.utils.aws.s3 import pack_object_part_ids
+from llm_retrieval.utils.aws.s3 import parse_object_part_ids
+
+
+class _FakeS3ObjectReader:
+    """Gets objects, or ranges of them, from a dict of their contents, failing as S3 does."""
+
+    def __init__(self, data_by_key: dict):
+        self._data_by_key = data_by_key
+        self.ranges = []
+
+    def get(self, object_id, metadata_only=False, Range=None):
+        if object_id.key not in self._data_by_key:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        data = self._data_by_key[object_id.key]
+        if metadata_only:
+            return {'ContentLength': len(data)}
+        if Range is None:
+            return {'Body': io.BytesIO(data)}
+        start, end = map(int, re.fullmatch(r'bytes=(\d+)-(\d+)', Range).groups())
+        self.ranges.append((start, end + 1))
+        if start >= len(data):
+            raise ClientError({'Error': {'Code': 'InvalidRange'}}, 'GetObject')
+        # S3 cuts a range that ends past the end of the object short.
+        return {'Body': io.BytesIO(data[start:end + 1])}
+
+
+def test_s3_object_part_range_parts_given_last_part_cut_short():
+    object_id = S3ObjectId(bucket='bucket', key='key')
+    part_range = S3ObjectPartRange(object_id=object_id, start=8, stride=4, count=3, end=18)
+    assert [(part.start, part.end) for part in part_range.parts] == [(8, 12), (12, 16), (16, 18)]
+    assert all(part.object_id == object_id for part in part_range.parts)
+
+
+def test_s3_object_partitioner_iter_part_ranges_given_last_part_cut_short():
+    object_id = S3ObjectId(bucket='bucket', key='key')
+    partitioner = S3ObjectPartitioner(_FakeS3ObjectReader({'key': b'x' * 25}))
+    part_ranges = list(partitioner.iter_part_ranges(object_id, part_size=4, parts_per_range=3, encoding='utf-16'))
+    assert [(r.start, r.count, r.end) for r in part_ranges] == [(0, 3, 12), (12, 3, 24), (24, 1, 25)]
+    parts = [part for part_range in part_ranges for part in part_range.parts]
+    # The ranges hold the same parts as the object split part by part.
+    assert parts == list(partitioner.iter_part_ids(object_id, part_size=4, encoding='utf-16'))
+    assert parts[-1] == S3ObjectPartId(object_id=object_id, start=24, end=25, encoding='utf-16')
+
+
+@pytest.mark.parametrize('object_size, expected', [
+    (0, 10),
+    (500, 10),
+    (1000, 10),
+    (2500, 25),
+    (5000, 50),
+    (100_000, 50),
+])
+def test_s3_object_part_size_policy_given_object_size_clamps_part_size(object_size, expected):
+    policy = S3ObjectPartSizePolicy(min_part_size=10, max_part_size=50, target_parts_per_object=100)
+    assert policy.part_size(object_size) == expected
+
+
+@pytest.mark.parametrize('min_part_size, max_part_size, target_parts_per_object', [
+    (0, 10, 1),
+    (20, 10, 1),
+    (1, 10, 0),
+])
+def test_s3_object_part_size_policy_given_invalid_arguments(min_part_size, max_part_size, target_parts_per_object):
+    with pytest.raises(ValueError):
+        S3ObjectPartSizePolicy(min_part_size, max_part_size, target_parts_per_object)
+
+
+def _part(key: str, start: int, end: int) -> S3ObjectPartId:
+    return S3ObjectPartId(object_id=S3ObjectId(bucket='bucket', key=key), start=start, end=end)
+
+
+def test_pack_object_part_ids_given_small_and_large_parts():
+    parts = [
+        _part('a', 0, 3),
+        _part('b', 0, 4),
+        _part('c', 0, 12),
+        _part('d', 0, 2),
+        _part('e', 0, 10),
+        _part('f', 0, 5),
+        _part('g', 0, 1),
+    ]
+    groups = list(pack_object_part_ids(parts, min_group_size=10))
+    # Large parts are grouped on their own as they come, while small ones are packed until the minimum.
+    assert [[part.object_id.key for part in group.parts] for group in groups] == [['c'], ['e'], ['a', 'b', 'd', 'f'], ['g']]
+    # Only the last group may be smaller than the minimum.
+    assert [group.size for group in groups] == [12, 10, 14, 1]
+
+
+def test_pack_object_part_ids_given_no_parts():
+    assert list(pack_object_part_ids([], min_group_size=10)) == []
+
+
+def test_parse_object_part_ids_given_part_group_and_range():
+    object_id = S3ObjectId(bucket='bucket', key='key')
+    part = S3ObjectPartId(object_id=object_id, start=0, end=4, encoding='latin-1')
+    group = S3ObjectPartGroup(parts=[part, _part('other', 2, 3)])
+    part_range = S3ObjectPartRange(object_id=object_id, start=0, stride=4, count=2, end=6)
+    assert parse_object_part_ids(part.json(by_alias=True)) == [part]
+    assert parse_object_part_ids(group.json(by_alias=True)) == group.parts
+    assert parse_object_part_ids(part_range.json(by_alias=True)) == part_range.parts
+
+
+def test_parse_object_part_ids_given_part_encoded_twice():
+    part = _part('key', 4, 8)
+    assert parse_object_part_ids(json.dumps(part.json(by_alias=True))) == [part]
+
+
+@pytest.mark.parametrize('max_concurrent_ranges', [1, 3])
+def test_s3_object_part_range_reader_given_part_within_object(max_concurrent_ranges):
+    data = bytes(range(100))
+    fake_reader = _FakeS3ObjectReader({'key': data})
+    range_reader = S3ObjectPartRangeReader(fake_reader, range_size=8, max_concurrent_ranges=max_concurrent_ranges)
+    actual = list(range_reader.read(_part('key', 10, 30)))
+    assert b''.join(actual) == data[10:30]
+    assert fake_reader.ranges == [(10, 18), (18, 26), (26, 30)]
+
+
+@pytest.mark.parametrize('max_concurrent_ranges, expected_ranges', [
+    (1, [(4, 12), (12, 20)]),
+    (2, [(4, 12), (12, 20), (20, 28)]),
+])
+def test_s3_object_part_range_reader_given_overhang_past_object_end(max_concurrent_ranges, expected_ranges):
+    data = bytes(range(18))
+    fake_reader = _FakeS3ObjectReader({'key': data})
+    range_reader = S3ObjectPartRangeReader(fake_reader, range_size=8, max_concurrent_ranges=max_concurrent_ranges)
+    # The range over the end of the object is cut short by S3, so no range after it is fetched,
+    # except those already in flight, which S3 rejects with InvalidRange.
+    actual = list(range_reader.read(_part('key', 4, 40)))
+    assert actual == [data[4:12], data[12:18]]
+    assert fake_reader.ranges == expected_ranges
+
+
+def test_s3_object_part_range_reader_given_part_starting_at_object_end():
+    fake_reader = _FakeS3ObjectReader({'key': bytes(range(16))})
+    range_reader = S3ObjectPartRangeReader(fake_reader, range_size=8, max_concurrent_ranges=1)
+    assert list(range_reader.read(_part('key', 16, 40))) == []
+    assert fake_reader.ranges == [(16, 24)]
+
+
+def test_s3_object_part_range_reader_given_other_client_error_raises():
+    range_reader = S3ObjectPartRangeReader(_FakeS3ObjectReader({}), range_size=8, max_concurrent_ranges=2)
+    with pytest.raises(ClientError):
+        list(range_reader.read(_part('missing', 0, 20)))
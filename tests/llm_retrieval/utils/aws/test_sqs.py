@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+from llm_retrieval.utils.aws import sqs
+from llm_retrieval.utils.aws.sqs import SqsMessageSender
+from llm_retrieval.utils.aws.sqs import SqsMessageSenderError
+from llm_retrieval.utils.aws.sqs import SqsQueueId
+from llm_retrieval.utils.aws.sqs import create_sqs_client
+
+
+class _FakeSqsClient:
+    """Accepts batches of messages, failing those whose bodies are given, each for a number of attempts."""
+
+    def __init__(self, n_failures_by_message: dict = None, sender_fault: bool = False):
+        self._n_failures_by_message = dict(n_failures_by_message or {})
+        self._sender_fault = sender_fault
+        self._lock = threading.Lock()
+        self.messages = []
+        self.batches = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        failed = []
+        with self._lock:
+            self.batches.append([entry['MessageBody'] for entry in Entries])
+            for entry in Entries:
+                message = entry['MessageBody']
+                if self._n_failures_by_message.get(message, 0) > 0:
+                    self._n_failures_by_message[message] -= 1
+                    failed.append({'Id': entry['Id'], 'SenderFault': self._sender_fault, 'Code': 'Throttled'})
+                else:
+                    self.messages.append(message)
+        return {'Successful': [], 'Failed': failed} if failed else {'Successful': []}
+
+
+@pytest.fixture(autouse=True)
+def no_retry_backoff(monkeypatch):
+    monkeypatch.setattr(sqs, 'RETRY_BACKOFF_BASE_SECONDS', 0.0)
+
+
+def test_sqs_message_sender_send_all_given_more_messages_than_a_batch():
+    client = _FakeSqsClient()
+    messages = [str(i) for i in range(25)]
+    n_sent = SqsMessageSender(client).send_all(SqsQueueId(url='queue'), iter(messages), max_concurrent_batches=2)
+    assert n_sent == len(messages)
+    assert sorted(client.messages, key=int) == messages
+    assert sorted(len(batch) for batch in client.batches) == [5, 10, 10]
+
+
+def test_sqs_message_sender_send_all_given_partially_failed_batch_resends_failed_entries_only():
+    client = _FakeSqsClient({'1': 1, '3': 2})
+    messages = [str(i) for i in range(5)]
+    n_sent = SqsMessageSender(client).send_all(SqsQueueId(url='queue'), messages)
+    assert n_sent == len(messages)
+    assert sorted(client.messages) == messages
+    assert client.batches == [messages, ['1', '3'], ['3']]
+
+
+def test_sqs_message_sender_send_all_given_sender_fault_raises():
+    client = _FakeSqsClient({'1': 1}, sender_fault=True)
+    with pytest.raises(SqsMessageSenderError) as error:
+        SqsMessageSender(client).send_all(SqsQueueId(url='queue'), ['0', '1', '2'])
+    assert [e['Id'] for e in error.value.sender_errors] == ['1']
+    # Sender faults are not retried.
+    assert len(client.batches) == 1
+
+
+def test_sqs_message_sender_send_all_given_failures_past_max_attempts_raises():
+    client = _FakeSqsClient({'1': 3})
+    with pytest.raises(SqsMessageSenderError) as error:
+        SqsMessageSender(client).send_all(SqsQueueId(url='queue'), ['0', '1', '2'], max_attempts=3)
+    assert [e['Id'] for e in error.value.sender_errors] == ['1']
+    assert client.batches == [['0', '1', '2'], ['1'], ['1']]
+    assert sorted(client.messages) == ['0', '2']
+
+
+def test_create_sqs_client_given_max_pool_connections(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    client = create_sqs_client(max_pool_connections=80)
+    assert client.meta.config.max_pool_connections == 80
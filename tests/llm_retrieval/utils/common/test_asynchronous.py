@@ -1,9 +1,14 @@
 import concurrent.futures
 import asyncio
+import itertools
+import threading
 
 import pytest
 
 from llm_retrieval.utils.common.asynchronous import BackgroundEventLoop
+from llm_retrieval.utils.common.asynchronous import SharedEventLoop
+from llm_retrieval.utils.common.asynchronous import iterate_in_thread
+from llm_retrieval.utils.common.asynchronous import register_close_at_shutdown
 
 
 @pytest.fixture
@@ -72,3 +77,108 @@ def test_background_event_loop_given_multiple_tasks(loop):
 
         concurrent.futures.wait(tasks)
         assert completed_tasks == num_tasks
+
+
+@pytest.fixture
+def shared_loop():
+    shared_loop = SharedEventLoop()
+    yield shared_loop
+    shared_loop.shutdown()
+
+
+def test_shared_event_loop_given_multiple_gets(shared_loop):
+    loop = shared_loop.get()
+    assert shared_loop.get() is loop
+    assert shared_loop.n_starts == 1
+
+
+def test_shared_event_loop_given_multiple_runs(shared_loop):
+    async def get_running_loop():
+        return asyncio.get_running_loop()
+
+    assert shared_loop.run(get_running_loop()) is shared_loop.run(get_running_loop())
+
+
+def test_shared_event_loop_given_pending_task_at_shutdown(shared_loop):
+    started = threading.Event()
+    cancelled = threading.Event()
+
+    async def task():
+        started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    loop = shared_loop.get()
+    loop.create_task(task())
+    started.wait()
+    shared_loop.shutdown()
+    assert cancelled.is_set()
+    assert loop.is_closed()
+
+
+def test_shared_event_loop_given_closes_registered_at_shutdown(shared_loop):
+    closed_on = []
+
+    async def close():
+        closed_on.append(asyncio.get_running_loop())
+
+    async def register():
+        # Registered twice, but awaited once.
+        register_close_at_shutdown(close)
+        register_close_at_shutdown(close)
+        return asyncio.get_running_loop()
+
+    running_loop = shared_loop.run(register())
+    assert closed_on == []
+    shared_loop.shutdown()
+    assert closed_on == [running_loop]
+    shared_loop.get()
+    shared_loop.shutdown()
+    assert closed_on == [running_loop]
+
+
+def test_shared_event_loop_given_get_after_shutdown(shared_loop):
+    loop = shared_loop.get()
+    shared_loop.shutdown()
+    assert shared_loop.get() is not loop
+    assert shared_loop.n_starts == 2
+
+
+async def _collect(aiterable):
+    return [item async for item in aiterable]
+
+
+def test_iterate_in_thread_given_items(shared_loop):
+    assert shared_loop.run(_collect(iterate_in_thread(range(10), max_buffered=2))) == list(range(10))
+
+
+def test_iterate_in_thread_given_failing_iterable(shared_loop):
+    def items():
+        yield 1
+        raise RuntimeError('iteration failed')
+
+    with pytest.raises(RuntimeError, match='iteration failed'):
+        shared_loop.run(_collect(iterate_in_thread(items())))
+
+
+def test_iterate_in_thread_given_early_close(shared_loop):
+    n_iterated = 0
+
+    def items():
+        nonlocal n_iterated
+        for i in itertools.count():
+            n_iterated += 1
+            yield i
+
+    async def take_one():
+        iterator = iterate_in_thread(items(), max_buffered=2)
+        item = await iterator.__anext__()
+        await iterator.aclose()
+        return item
+
+    assert shared_loop.run(take_one()) == 0
+    # The consumed item, the buffered items and the item waiting to be buffered.
+    assert n_iterated <= 4
@@ -0,0 +1,33 @@
+import pytest
+
+from llm_retrieval.utils.common.bloom import BloomFilter
+
+
+def test_bloom_filter_given_added_keys():
+    bloom_filter = BloomFilter(1000)
+    keys = [f'key {i}'.encode() for i in range(1000)]
+    for key in keys:
+        bloom_filter.add(key)
+    assert all(key in bloom_filter for key in keys)
+    assert len(bloom_filter) == len(keys)
+
+
+def test_bloom_filter_given_absent_keys_at_capacity():
+    false_positive_rate = 0.01
+    bloom_filter = BloomFilter(1000, false_positive_rate)
+    for i in range(1000):
+        bloom_filter.add(f'key {i}'.encode())
+    n_false_positives = sum(f'absent {i}'.encode() in bloom_filter for i in range(10000))
+    # Well within the expected 100, allowing for chance.
+    assert n_false_positives < 10000 * false_positive_rate * 2
+
+
+def test_bloom_filter_given_no_keys():
+    bloom_filter = BloomFilter(10)
+    assert b'key' not in bloom_filter
+
+
+@pytest.mark.parametrize('capacity, false_positive_rate', [(0, 0.01), (10, 0.0), (10, 1.0)])
+def test_bloom_filter_given_invalid_arguments(capacity, false_positive_rate):
+    with pytest.raises(ValueError):
+        BloomFilter(capacity, false_positive_rate)
@@ -0,0 +1,217 @@
+import asyncio
+import threading
+
+import pytest
+
+from llm_retrieval.utils.common import concurrency
+from llm_retrieval.utils.common.concurrency import is_overload_error
+from llm_retrieval.utils.common.concurrency import as_concurrency_limit
+from llm_retrieval.utils.common.concurrency import FixedConcurrencyLimit
+from llm_retrieval.utils.common.concurrency import AimdConcurrencyLimit
+from llm_retrieval.utils.common.concurrency import ConcurrencyGate
+from llm_retrieval.utils.common.concurrency import AsyncConcurrencyGate
+from llm_retrieval.utils.common.concurrency import call_and_record
+
+
+class HttpError(Exception):
+
+    def __init__(self, http_status):
+        self.http_status = http_status
+
+
+class Attempt:
+
+    def __init__(self, exception):
+        self._exception = exception
+        self.failed = True
+
+    def exception(self):
+        return self._exception
+
+
+class RetryError(Exception):
+
+    def __init__(self, exception):
+        self.last_attempt = Attempt(exception)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(concurrency.time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.mark.parametrize('exception, expected', [
+    (HttpError(429), True),
+    (HttpError(500), True),
+    (HttpError(503), True),
+    (HttpError(400), False),
+    (HttpError(404), False),
+    (asyncio.TimeoutError(), True),
+    (ValueError(), False),
+    (RetryError(HttpError(429)), True),
+    (RetryError(ValueError()), False),
+])
+def test_is_overload_error(exception, expected):
+    assert is_overload_error(exception) == expected
+
+
+def test_fixed_concurrency_limit_given_invalid_limit():
+    with pytest.raises(ValueError):
+        FixedConcurrencyLimit(0)
+
+
+def test_fixed_concurrency_limit_given_outcomes():
+    limit = FixedConcurrencyLimit(3)
+    limit.record(1.0)
+    limit.record(10.0, HttpError(429))
+    assert limit.limit == 3
+    assert limit.max_limit == 3
+
+
+def test_as_concurrency_limit():
+    assert as_concurrency_limit(4).limit == 4
+    limit = AimdConcurrencyLimit(2)
+    assert as_concurrency_limit(limit) is limit
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'initial_limit': 0},
+    {'initial_limit': 5, 'max_limit': 4},
+    {'initial_limit': 2, 'min_limit': 3},
+    {'initial_limit': 2, 'decrease_factor': 1},
+    {'initial_limit': 2, 'latency_tolerance': 1},
+])
+def test_aimd_concurrency_limit_given_invalid_arguments(kwargs):
+    with pytest.raises(ValueError):
+        AimdConcurrencyLimit(**kwargs)
+
+
+def test_aimd_concurrency_limit_given_successes_increases_by_one_per_round(clock):
+    limit = AimdConcurrencyLimit(4)
+    for _ in range(4):
+        limit.record(1.0)
+    assert limit.limit == 4
+    limit.record(1.0)
+    assert limit.limit == 5
+
+
+def test_aimd_concurrency_limit_given_successes_stops_at_max(clock):
+    limit = AimdConcurrencyLimit(2, max_limit=3)
+    for _ in range(100):
+        limit.record(1.0)
+    assert limit.limit == 3
+
+
+def test_aimd_concurrency_limit_given_overload_error_decreases(clock):
+    limit = AimdConcurrencyLimit(10)
+    limit.record(1.0)
+    limit.record(1.0, HttpError(429))
+    assert limit.limit == 5
+
+
+def test_aimd_concurrency_limit_given_other_error_does_not_change(clock):
+    limit = AimdConcurrencyLimit(10)
+    limit.record(1.0, ValueError())
+    assert limit.limit == 10
+
+
+def test_aimd_concurrency_limit_given_latency_spike_decreases(clock):
+    limit = AimdConcurrencyLimit(10)
+    limit.record(1.0)
+    limit.record(2.5)
+    assert limit.limit == 5
+    assert limit.typical_latency == pytest.approx(1.15)
+
+
+def test_aimd_concurrency_limit_given_lasting_latency_rise_recovers(clock):
+    limit = AimdConcurrencyLimit(10, max_limit=20)
+    limit.record(0.1)
+    n_spikes = 0
+    for _ in range(50):
+        clock[0] += 0.5
+        limit_before = limit.limit
+        limit.record(0.5)
+        n_spikes += limit.limit < limit_before
+    # The higher latency becomes the typical latency after a few cuts, and the limit grows again.
+    assert limit.typical_latency > 0.4
+    assert n_spikes < 5
+    assert limit.limit > 5
+    limit_after_rise = limit.limit
+    for _ in range(50):
+        clock[0] += 0.5
+        limit.record(0.5)
+    assert limit.limit > limit_after_rise
+
+
+def test_aimd_concurrency_limit_given_overload_errors_within_cooldown_decreases_once(clock):
+    limit = AimdConcurrencyLimit(16)
+    limit.record(1.0)
+    limit.record(1.0, HttpError(503))
+    limit.record(1.0, HttpError(503))
+    assert limit.limit == 8
+    clock[0] += 1.0
+    limit.record(1.0, HttpError(503))
+    assert limit.limit == 4
+
+
+def test_aimd_concurrency_limit_given_overload_errors_stops_at_min(clock):
+    limit = AimdConcurrencyLimit(4, min_limit=2)
+    for _ in range(5):
+        clock[0] += 10
+        limit.record(1.0, HttpError(429))
+    assert limit.limit == 2
+
+
+def test_concurrency_gate_given_limit_admits_up_to_limit():
+    gate = ConcurrencyGate(FixedConcurrencyLimit(2))
+    gate.acquire()
+    gate.acquire()
+    admitted = threading.Event()
+    def acquire():
+        gate.acquire()
+        admitted.set()
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    assert not admitted.wait(0.05)
+    gate.release()
+    assert admitted.wait(1)
+    thread.join()
+
+
+def test_async_concurrency_gate_given_growing_limit_admits_waiters():
+    limit = AimdConcurrencyLimit(1)
+
+    async def run():
+        gate = AsyncConcurrencyGate(limit)
+        await gate.acquire()
+        waiters = [asyncio.ensure_future(gate.acquire()) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert not any(w.done() for w in waiters)
+        # the limit grows from one to two, so releasing one slot admits both waiters
+        limit.record(1.0)
+        gate.release()
+        await asyncio.wait_for(asyncio.gather(*waiters), 1)
+
+    asyncio.run(run())
+
+
+def test_call_and_record_given_failing_request_records_exception():
+    records = []
+
+    async def fail():
+        raise HttpError(429)
+
+    with pytest.raises(HttpError):
+        asyncio.run(call_and_record(fail(), lambda *record: records.append(record)))
+    assert len(records) == 1
+    assert is_overload_error(records[0][1])
+
+
+def test_call_and_record_given_no_recorder_returns_result():
+
+    async def succeed():
+        return 1
+
+    assert asyncio.run(call_and_record(succeed(), None)) == 1
@@ -0,0 +1,104 @@
+import codecs
+
+import pytest
+
+from llm_retrieval.utils.common.encoding import is_ascii_compatible
+from llm_retrieval.utils.common.encoding import has_one_byte_per_char
+from llm_retrieval.utils.common.encoding import encoded_length
+from llm_retrieval.utils.common.encoding import may_start_with_bom
+from llm_retrieval.utils.common.encoding import resolve_bom
+from llm_retrieval.utils.common.encoding import leading_partial_character_size
+from llm_retrieval.utils.common.encoding import detect_encoding
+
+
+@pytest.mark.parametrize('encoding', ['utf-8', 'UTF8', 'ascii', 'latin-1', 'cp1252'])
+def test_is_ascii_compatible_given_ascii_compatible_encoding(encoding):
+    assert is_ascii_compatible(encoding)
+
+
+@pytest.mark.parametrize('encoding', ['utf-16', 'utf-16-le', 'utf-32', 'utf-8-sig', 'cp500', 'not-an-encoding'])
+def test_is_ascii_compatible_given_ascii_incompatible_encoding(encoding):
+    assert not is_ascii_compatible(encoding)
+
+
+def test_has_one_byte_per_char_given_ascii_text():
+    assert has_one_byte_per_char('Hello, world!', 'utf-8')
+
+
+def test_has_one_byte_per_char_given_non_ascii_text():
+    assert not has_one_byte_per_char('Hello, wörld!', 'utf-8')
+
+
+def test_has_one_byte_per_char_given_ascii_incompatible_encoding():
+    assert not has_one_byte_per_char('Hello, world!', 'utf-16-le')
+
+
+@pytest.mark.parametrize('text', ['', 'Hello, world!', 'Hello, wörld!', '日本語 😀'])
+@pytest.mark.parametrize('encoding', ['utf-8', 'utf-16-le', 'utf-32-le'])
+def test_encoded_length(text, encoding):
+    assert encoded_length(text, encoding) == len(text.encode(encoding))
+
+
+@pytest.mark.parametrize('encoding, expected', [
+    ('utf-8', True),
+    ('utf-8-sig', True),
+    ('UTF-16', True),
+    ('utf-16-le', True),
+    ('utf-32', True),
+    ('cp1252', False),
+    ('latin-1', False),
+])
+def test_may_start_with_bom(encoding, expected):
+    assert may_start_with_bom(encoding) == expected
+
+
+@pytest.mark.parametrize('data, encoding, expected', [
+    (codecs.BOM_UTF8 + b'Hello', 'utf-8-sig', ('utf-8', 3)),
+    (b'Hello', 'utf-8-sig', ('utf-8', 0)),
+    (codecs.BOM_UTF16_BE + 'Hi'.encode('utf-16-be'), 'utf-16', ('utf-16-be', 2)),
+    (codecs.BOM_UTF16_LE + 'Hi'.encode('utf-16-le'), 'utf-16', ('utf-16-le', 2)),
+    ('Hi'.encode('utf-16-le'), 'utf-16', ('utf-16-le', 0)),
+    (codecs.BOM_UTF32_LE + 'Hi'.encode('utf-32-le'), 'utf-32', ('utf-32-le', 4)),
+    (codecs.BOM_UTF8 + b'Hello', 'utf-8', ('utf-8', 3)),
+    (b'Hello', 'utf-8', ('utf-8', 0)),
+    (codecs.BOM_UTF16_BE + 'Hi'.encode('utf-16-be'), 'utf-16-le', ('utf-16-le', 0)),
+    (codecs.BOM_UTF16_BE + 'Hi'.encode('utf-16-be'), 'utf-16-be', ('utf-16-be', 2)),
+    (codecs.BOM_UTF8 + b'Hello', 'cp1252', ('cp1252', 0)),
+])
+def test_resolve_bom(data, encoding, expected):
+    assert resolve_bom(data, encoding) == expected
+
+
+@pytest.mark.parametrize('data, start, encoding, expected', [
+    (b'\x80\x80Hello', 12, 'utf-8', 2),
+    (b'Hello', 12, 'utf-8', 0),
+    ('Hello'.encode('utf-16-le')[1:], 1, 'utf-16-le', 1),
+    ('Hello'.encode('utf-16-be'), 0, 'utf-16-be', 0),
+    ('😀Hello'.encode('utf-16-le')[2:], 2, 'utf-16-le', 2),
+    ('😀Hello'.encode('utf-16-be')[2:], 2, 'utf-16-be', 2),
+    ('Hello'.encode('utf-32-le')[3:], 3, 'utf-32-le', 1),
+    (b'\x80Hello', 12, 'cp1252', 0),
+])
+def test_leading_partial_character_size(data, start, encoding, expected):
+    assert leading_partial_character_size(data, start, encoding) == expected
+
+
+@pytest.mark.parametrize('sample, expected', [
+    (b'', 'utf-8'),
+    (b'Hello, world!', 'utf-8'),
+    ('Hello, wörld! 日本語'.encode('utf-8'), 'utf-8'),
+    ('Hello, wörld! 日本語'.encode('utf-8')[:-1], 'utf-8'),
+    ('Hello, wörld!'.encode('utf-8-sig'), 'utf-8'),
+    ('Hello, wörld!'.encode('utf-16'), 'utf-16-le'),
+    (codecs.BOM_UTF16_BE + 'Hello, wörld!'.encode('utf-16-be'), 'utf-16-be'),
+    ('Hello, wörld!'.encode('utf-16-le'), 'utf-16-le'),
+    ('Hello, wörld!'.encode('utf-16-be'), 'utf-16-be'),
+    ('Hello, wörld!'.encode('utf-32'), 'utf-32-le'),
+    ('Hello, wörld!'.encode('utf-32-le'), 'utf-32-le'),
+    ('Hello, wörld!'.encode('utf-32-be'), 'utf-32-be'),
+    ('“Hello”, wörld!'.encode('cp1252'), 'cp1252'),
+    ('Hello, wörld!'.encode('latin-1'), 'cp1252'),
+    ('Hello, wörld!\x81'.encode('latin-1'), 'latin-1'),
+])
+def test_detect_encoding(sample, expected):
+    assert detect_encoding(sample) == expected
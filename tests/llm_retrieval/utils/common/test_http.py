@@ -0,0 +1,163 @@
+import asyncio
+import http.server
+import socket
+import threading
+
+import aiohttp
+import pytest
+
+from llm_retrieval.utils.common.asynchronous import BackgroundEventLoop
+from llm_retrieval.utils.common.asynchronous import SharedEventLoop
+from llm_retrieval.utils.common.http import AsyncHttpSessionPool
+
+
+def test_async_http_session_pool_given_same_loop():
+    pool = AsyncHttpSessionPool(max_connections=4)
+
+    async def get_sessions():
+        sessions = pool.session(), pool.session()
+        assert sessions[0].connector.limit == 4
+        await pool.close()
+        return sessions
+
+    first, second = asyncio.run(get_sessions())
+    assert first is second
+    assert first.closed
+
+
+def test_async_http_session_pool_given_other_loop():
+    pool = AsyncHttpSessionPool()
+
+    async def get_session(close):
+        session = pool.session()
+        if close:
+            await pool.close()
+        return session
+
+    first = asyncio.run(get_session(close=True))
+    second = asyncio.run(get_session(close=True))
+    assert first is not second
+    assert pool.stats()['n_sessions'] == 2
+
+
+def test_async_http_session_pool_given_other_running_loop_closes_its_session():
+    pool = AsyncHttpSessionPool()
+    other_loop = BackgroundEventLoop()
+    other_loop.start()
+    try:
+        async def get_session():
+            return pool.session()
+
+        first = other_loop.create_task(get_session()).result()
+
+        async def get_session_and_close():
+            session = pool.session()
+            await pool.close()
+            return session
+
+        second = asyncio.run(get_session_and_close())
+    finally:
+        other_loop.close()
+    assert first is not second
+    assert first.closed
+
+
+def test_async_http_session_pool_given_other_stopped_loop_raises():
+    pool = AsyncHttpSessionPool()
+    other_loop = asyncio.new_event_loop()
+
+    async def get_session():
+        return pool.session()
+
+    try:
+        other_loop.run_until_complete(get_session())
+        with pytest.raises(RuntimeError):
+            asyncio.run(get_session())
+        other_loop.run_until_complete(pool.close())
+    finally:
+        other_loop.close()
+
+
+def test_async_http_session_pool_given_shared_loop_closes_session_at_shutdown():
+    pool = AsyncHttpSessionPool()
+    shared_loop = SharedEventLoop()
+
+    async def get_session():
+        return pool.session()
+
+    try:
+        session = shared_loop.run(get_session())
+        assert not session.closed
+    finally:
+        shared_loop.shutdown()
+    assert session.closed
+    assert pool.stats()['n_sessions'] == 1
+
+
+def test_async_http_session_pool_stats_given_no_session():
+    assert AsyncHttpSessionPool(max_connections=2).stats() == {
+        'max_connections': 2,
+        'n_sessions': 0,
+        'n_connections_created': 0,
+        'n_connections_reused': 0,
+        'n_requests_in_flight': 0,
+    }
+
+
+class _OkHandler(http.server.BaseHTTPRequestHandler):
+
+    # Keeps connections open between requests, so that clients can reuse them.
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def ok_server_url():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _OkHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/'
+    server.shutdown()
+    server.server_close()
+
+
+def _unused_url():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return f'http://127.0.0.1:{s.getsockname()[1]}/'
+
+
+def test_async_http_session_pool_stats_given_requests(ok_server_url):
+    pool = AsyncHttpSessionPool()
+
+    async def get(url):
+        async with pool.session().get(url) as response:
+            await response.read()
+
+    async def get_all():
+        try:
+            await get(ok_server_url)
+            await get(ok_server_url)
+            with pytest.raises(aiohttp.ClientConnectionError):
+                await get(_unused_url())
+        finally:
+            await pool.close()
+
+    asyncio.run(get_all())
+    stats = pool.stats()
+    assert stats['n_connections_created'] == 1
+    assert stats['n_connections_reused'] == 1
+    # Failed requests are no longer in flight either.
+    assert stats['n_requests_in_flight'] == 0
+
+
+def test_async_http_session_pool_given_invalid_max_connections():
+    with pytest.raises(ValueError):
+        AsyncHttpSessionPool(max_connections=0)
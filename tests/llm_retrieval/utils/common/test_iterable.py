@@ -3,7 +3,10 @@ import asyncio
 import pytest
 
 from llm_retrieval.utils.common.iterable import batched
+from llm_retrieval.utils.common.iterable import abatched_with_budget
+from llm_retrieval.utils.common.iterable import batched_with_budget
 from llm_retrieval.utils.common.iterable import ConcurrentAsyncMapper
+from llm_retrieval.utils.common.concurrency import AimdConcurrencyLimit
 
 
 def test_batched_given_empty_iterable():
@@ -45,6 +48,45 @@ def test_batched_given_multiple_batches():
     assert batches == [(1, 2), (3, 4), (5, 6)]
 
 
+def test_batched_with_budget_given_empty_iterable():
+    batches = list(batched_with_budget((), 2, 10, len))
+    assert batches == []
+
+
+def test_batched_with_budget_given_invalid_n():
+    with pytest.raises(ValueError):
+        list(batched_with_budget(['a'], 0, 10, len))
+
+
+def test_batched_with_budget_given_budget_not_reached():
+    iterable = ['a', 'bb', 'c', 'dd', 'e']
+    batches = list(batched_with_budget(iterable, 2, 10, len))
+    assert batches == [('a', 'bb'), ('c', 'dd'), ('e',)]
+
+
+def test_batched_with_budget_given_budget_reached():
+    iterable = ['aaa', 'bb', 'cc', 'd', 'eeee']
+    batches = list(batched_with_budget(iterable, 10, 5, len))
+    assert batches == [('aaa', 'bb'), ('cc', 'd'), ('eeee',)]
+
+
+def test_batched_with_budget_given_item_over_budget():
+    iterable = ['a', 'bbbbbb', 'c']
+    batches = list(batched_with_budget(iterable, 10, 5, len))
+    assert batches == [('a',), ('bbbbbb',), ('c',)]
+
+
+def test_abatched_with_budget_given_budget_reached():
+    async def aiterable():
+        for item in ['aaa', 'bb', 'cc', 'd', 'eeee']:
+            yield item
+
+    async def collect():
+        return [batch async for batch in abatched_with_budget(aiterable(), 10, 5, len)]
+
+    assert asyncio.run(collect()) == [('aaa', 'bb'), ('cc', 'd'), ('eeee',)]
+
+
 def test_concurrent_async_mapping_given_empty_iterable():
     iterable = ()
     n_complete = 0
@@ -82,3 +124,126 @@ def test_concurrent_async_mapping_given_iterable_of_size_n_and_max_concurrent_ta
     mapper = ConcurrentAsyncMapper(func, max_concurrent_tasks)
     mapper(iterable)
     assert n_complete == 3
+
+
+def test_concurrent_async_mapping_given_concurrency_limit_respects_current_limit():
+    iterable = range(50)
+    n_active = 0
+    max_n_active = 0
+    limit = AimdConcurrencyLimit(2, max_limit=4)
+    async def func(x):
+        nonlocal n_active, max_n_active
+        n_active += 1
+        max_n_active = max(max_n_active, n_active)
+        await asyncio.sleep(0.001)
+        n_active -= 1
+    mapper = ConcurrentAsyncMapper(func, limit)
+    mapper(iterable)
+    assert mapper.concurrency_limit is limit
+    assert limit.limit == 4
+    assert 2 <= max_n_active <= 4
+
+
+def test_concurrent_async_mapping_given_concurrency_limit_records_failures():
+    iterable = range(4)
+    limit = AimdConcurrencyLimit(8)
+    class OverloadError(Exception):
+        http_status = 429
+    async def func(x):
+        raise OverloadError()
+    mapper = ConcurrentAsyncMapper(func, limit)
+    mapper(iterable)
+    assert limit.limit < 8
+
+
+async def _square_after_delay(x):
+    # later items finish first, so that completion order differs from input order
+    await asyncio.sleep(0.001 * (5 - x % 5))
+    return x * x
+
+
+def test_concurrent_async_mapping_given_iterable_reports_outcomes():
+    iterable = [1, 2, 3]
+    mapper = ConcurrentAsyncMapper(_square_after_delay, 2)
+    report = mapper(iterable)
+    assert report.ok
+    assert [o.result for o in report.outcomes] == [1, 4, 9]
+    assert [o.item for o in report.outcomes] == iterable
+
+
+def test_concurrent_async_map_given_iterable_yields_results_in_order():
+    iterable = list(range(10))
+    mapper = ConcurrentAsyncMapper(_square_after_delay, 5)
+    assert list(mapper.map(iterable)) == [x * x for x in iterable]
+
+
+def test_concurrent_async_map_unordered_given_iterable_yields_every_result():
+    iterable = list(range(10))
+    mapper = ConcurrentAsyncMapper(_square_after_delay, 5)
+    actual = list(mapper.map_unordered(iterable))
+    assert sorted(actual) == [x * x for x in iterable]
+
+
+def test_concurrent_async_map_unordered_given_iterable_yields_results_as_completed():
+    iterable = [0, 4]
+    mapper = ConcurrentAsyncMapper(_square_after_delay, 2)
+    assert list(mapper.map_unordered(iterable)) == [16, 0]
+
+
+@pytest.mark.parametrize('map_name', ['map', 'map_unordered'])
+def test_concurrent_async_map_given_failure_fails_fast(map_name):
+    started = []
+    async def func(x):
+        started.append(x)
+        if x == 2:
+            raise ValueError('failed')
+        await asyncio.sleep(1 if x > 2 else 0)
+        return x
+    mapper = ConcurrentAsyncMapper(func, 3)
+    with pytest.raises(ValueError, match='failed'):
+        list(getattr(mapper, map_name)(range(100)))
+    assert len(started) < 10
+
+
+def test_concurrent_async_map_report_given_failures_reports_each_item():
+    async def func(x):
+        await asyncio.sleep(0)
+        if x % 3 == 0:
+            raise ValueError(x)
+        return x
+    mapper = ConcurrentAsyncMapper(func, 2)
+    report = mapper.map_report(range(7))
+    assert not report.ok
+    assert report.exhausted
+    assert [o.item for o in report.failed] == [0, 3, 6]
+    assert [o.result for o in report.succeeded] == [1, 2, 4, 5]
+    assert report.unfinished_items() == [0, 3, 6]
+    with pytest.raises(ValueError):
+        report.raise_first_exception()
+
+
+def test_concurrent_async_map_report_given_fail_fast_cancels_running_items():
+    async def func(x):
+        if x == 1:
+            await asyncio.sleep(0.01)
+            raise ValueError(x)
+        await asyncio.sleep(10)
+    mapper = ConcurrentAsyncMapper(func, 3)
+    report = mapper.map_report(range(100), fail_fast=True)
+    assert not report.exhausted
+    assert [o.item for o in report.failed] == [1]
+    assert [o.item for o in report.cancelled] == [0, 2]
+    assert report.unfinished_items() == [0, 1, 2]
+
+
+def test_concurrent_async_map_given_early_exit_cancels_running_items():
+    finished = []
+    async def func(x):
+        await asyncio.sleep(0 if x == 0 else 10)
+        finished.append(x)
+        return x
+    mapper = ConcurrentAsyncMapper(func, 3)
+    results = mapper.map(range(100))
+    assert next(results) == 0
+    results.close()
+    assert finished == [0]
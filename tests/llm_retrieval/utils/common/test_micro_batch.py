@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from llm_retrieval.utils.common.micro_batch import AsyncMicroBatcher
+
+
+def _recording_batch_call(batches: list):
+
+    async def batch_call(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    return batch_call
+
+
+def test_async_micro_batcher_given_concurrent_submitters():
+    batches = []
+    batcher = AsyncMicroBatcher(_recording_batch_call(batches), max_batch_size=4, max_wait_seconds=0.01)
+
+    async def submit_all():
+        return await asyncio.gather(batcher.submit([1, 2]), batcher.submit([3]), batcher.submit([4, 5, 6]))
+
+    results = asyncio.run(submit_all())
+    assert results == [[10, 20], [30], [40, 50, 60]]
+    assert batches == [[1, 2, 3, 4], [5, 6]]
+    assert batcher.stats()['n_batches'] == 2
+    assert batcher.stats()['n_full_batches'] == 1
+
+
+def test_async_micro_batcher_given_lone_submitter_waits_for_deadline():
+    batches = []
+    batcher = AsyncMicroBatcher(_recording_batch_call(batches), max_batch_size=100, max_wait_seconds=0.01)
+
+    async def submit():
+        started_at = asyncio.get_running_loop().time()
+        results = await batcher.submit([1])
+        return results, asyncio.get_running_loop().time() - started_at
+
+    results, waited = asyncio.run(submit())
+    assert results == [10]
+    assert waited >= 0.01
+    assert batches == [[1]]
+
+
+def test_async_micro_batcher_given_batch_cost():
+    batches = []
+    batcher = AsyncMicroBatcher(
+        _recording_batch_call(batches),
+        max_batch_size=100,
+        max_wait_seconds=0.01,
+        max_batch_cost=5,
+        cost=lambda item: item,
+    )
+
+    async def submit_all():
+        return await asyncio.gather(batcher.submit([1, 2, 3]), batcher.submit([8, 1]))
+
+    results = asyncio.run(submit_all())
+    assert results == [[10, 20, 30], [80, 10]]
+    assert batches == [[1, 2], [3], [8], [1]]
+
+
+def test_async_micro_batcher_given_failing_batch():
+    calls = 0
+
+    async def batch_call(items):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise RuntimeError('batch failed')
+        return items
+
+    batcher = AsyncMicroBatcher(batch_call, max_batch_size=2, max_wait_seconds=0.01)
+
+    async def submit_all():
+        return await asyncio.gather(
+            batcher.submit([1]),
+            batcher.submit([2]),
+            batcher.submit([3]),
+            return_exceptions=True,
+        )
+
+    first, second, third = asyncio.run(submit_all())
+    # The first two items shared the failed batch.
+    assert isinstance(first, RuntimeError)
+    assert isinstance(second, RuntimeError)
+    assert third == [3]
+
+
+def test_async_micro_batcher_given_invalid_batch_size():
+    with pytest.raises(ValueError):
+        AsyncMicroBatcher(_recording_batch_call([]), max_batch_size=0, max_wait_seconds=0.01)
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from llm_retrieval.utils.common import rate_limit
+from llm_retrieval.utils.common.rate_limit import TokenBucket
+from llm_retrieval.utils.common.rate_limit import RateLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_token_bucket_given_invalid_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(0, 1)
+
+
+def test_token_bucket_given_invalid_capacity():
+    with pytest.raises(ValueError):
+        TokenBucket(1, 0)
+
+
+def test_token_bucket_given_reservations_within_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=4)
+    assert bucket.reserve(3) == 0
+    assert bucket.reserve(1) == 0
+
+
+def test_token_bucket_given_reservations_beyond_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=4)
+    assert bucket.reserve(4) == 0
+    assert bucket.reserve(1) == pytest.approx(0.5)
+    assert bucket.reserve(2) == pytest.approx(1.5)
+
+
+def test_token_bucket_given_refill(clock):
+    bucket = TokenBucket(rate=2, capacity=4)
+    bucket.reserve(4)
+    clock[0] += 1
+    assert bucket.reserve(2) == 0
+    assert bucket.reserve(1) == pytest.approx(0.5)
+
+
+def test_token_bucket_given_refill_beyond_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=4)
+    clock[0] += 100
+    assert bucket.reserve(4) == 0
+    assert bucket.reserve(2) == pytest.approx(1)
+
+
+def test_rate_limiter_given_no_limits(clock):
+    limiter = RateLimiter()
+    assert not limiter.limits_tokens
+    assert all(limiter.reserve(1000) == 0 for _ in range(100))
+    assert limiter.stats()['n_acquired'] == 100
+    assert limiter.stats()['n_waited'] == 0
+
+
+def test_rate_limiter_given_requests_per_minute(clock):
+    limiter = RateLimiter(requests_per_minute=120)
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == pytest.approx(0.5)
+    assert limiter.reserve() == pytest.approx(1)
+
+
+def test_rate_limiter_given_tokens_per_minute(clock):
+    limiter = RateLimiter(tokens_per_minute=600)
+    assert limiter.limits_tokens
+    assert limiter.reserve(10) == 0
+    assert limiter.reserve(30) == pytest.approx(3)
+
+
+def test_rate_limiter_given_both_limits_waits_for_longest(clock):
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=600)
+    assert limiter.reserve(10) == 0
+    assert limiter.reserve(50) == pytest.approx(5)
+
+
+def test_rate_limiter_given_low_quota_admits_first_request(clock):
+    limiter = RateLimiter(requests_per_minute=1)
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == pytest.approx(60)
+
+
+def test_rate_limiter_stats_given_waits(clock):
+    limiter = RateLimiter(requests_per_minute=60)
+    limiter.reserve()
+    limiter.reserve()
+    limiter.reserve()
+    assert limiter.stats() == {
+        'n_acquired': 3,
+        'n_waited': 2,
+        'wait_seconds_total': pytest.approx(3),
+        'wait_seconds_max': pytest.approx(2),
+    }
+
+
+def test_rate_limiter_acquire_given_wait():
+    limiter = RateLimiter(requests_per_minute=60 * 50)
+    async def acquire_all():
+        return [await limiter.acquire() for _ in range(52)]
+    waits = asyncio.run(acquire_all())
+    assert waits[:50] == [0] * 50
+    assert all(w > 0 for w in waits[50:])
+    assert limiter.stats()['n_waited'] == 2
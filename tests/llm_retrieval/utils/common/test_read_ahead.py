@@ -0,0 +1,71 @@
+import io
+import time
+
+import pytest
+
+from llm_retrieval.utils.common.read_ahead import ReadAheadReader
+
+
+class _Readable:
+    """A readable without readinto, so every chunk is a new bytes object."""
+
+    def __init__(self, data: bytes, delay: float = 0.0):
+        self._stream = io.BytesIO(data)
+        self._delay = delay
+        self.n_reads = 0
+
+    def read(self, n):
+        self.n_reads += 1
+        time.sleep(self._delay)
+        return self._stream.read(n)
+
+
+@pytest.mark.parametrize('read_ahead', [0, 1, 3])
+@pytest.mark.parametrize('chunk_size', [1, 4, 100])
+def test_read_ahead_reader_given_reused_buffers(read_ahead, chunk_size):
+    data = b'Hello, world! Foo bar! Baz qux! 123'
+    reader = ReadAheadReader(io.BytesIO(data), chunk_size, read_ahead)
+    chunks = []
+    for chunk in reader:
+        # Each chunk is only valid until the next one is requested.
+        chunks.append(bytes(chunk))
+    assert b''.join(chunks) == data
+    assert all(len(chunk) <= chunk_size for chunk in chunks)
+    assert reader.stats()['n_bytes'] == len(data)
+    assert reader.stats()['n_chunks'] == len(chunks)
+
+
+def test_read_ahead_reader_given_readable_without_readinto():
+    data = b'Hello, world!'
+    chunks = list(ReadAheadReader(_Readable(data), 4, 2))
+    assert chunks == [b'Hell', b'o, w', b'orld', b'!']
+
+
+def test_read_ahead_reader_given_slow_consumer():
+    data = bytes(100)
+    readable = _Readable(data)
+    reader = ReadAheadReader(readable, 10, read_ahead=2)
+    chunks = iter(reader)
+    next(chunks)
+    time.sleep(0.05)
+    # The requested chunk, the buffered chunks and the chunk waiting to be buffered.
+    assert readable.n_reads <= 4
+    chunks.close()
+    assert reader.stats()['producer_blocked_seconds'] > 0
+
+
+def test_read_ahead_reader_given_slow_readable():
+    reader = ReadAheadReader(_Readable(bytes(30), delay=0.01), 10, read_ahead=2)
+    assert len(list(reader)) == 3
+    assert reader.stats()['consumer_blocked_seconds'] > 0
+
+
+def test_read_ahead_reader_given_failing_readable():
+
+    class FailingReadable:
+
+        def read(self, n):
+            raise OSError('read failed')
+
+    with pytest.raises(OSError, match='read failed'):
+        list(ReadAheadReader(FailingReadable(), 10, read_ahead=2))
@@ -1,6 +1,6 @@
 import pytest
 
-from llm_retrieval.utils.common.sequence import index_any
+from llm_retrieval.utils.common.sequence import index_any, DelimiterScanner
 
 
 @pytest.fixture(params=[True, False])
@@ -86,3 +86,106 @@ def test_index_any_given_end_out(reverse):
     expected = -1
     actual = index_any(seq, items, end=2, reverse=reverse)
     assert actual == expected
+
+
+@pytest.fixture(params=[str, bytes, bytearray, memoryview])
+def as_seq(request):
+    if request.param is str:
+        return lambda text: text
+    return lambda text: request.param(text.encode('utf-8'))
+
+
+def test_delimiter_scanner_given_no_delimiters(as_seq):
+    scanner = DelimiterScanner('')
+    seq = as_seq('a. b')
+    assert scanner.find(seq) == -1
+    assert scanner.rfind(seq) == -1
+    assert scanner.rfind_end(seq) == -1
+
+
+def test_delimiter_scanner_given_empty_sequence(as_seq):
+    scanner = DelimiterScanner('.!')
+    seq = as_seq('')
+    assert scanner.find(seq) == -1
+    assert scanner.rfind(seq) == -1
+
+
+def test_delimiter_scanner_given_no_match(as_seq):
+    scanner = DelimiterScanner('.!')
+    seq = as_seq('abc def')
+    assert scanner.find(seq) == -1
+    assert scanner.rfind(seq) == -1
+    assert scanner.rfind_end(seq) == -1
+
+
+def test_delimiter_scanner_given_multiple_matches(as_seq):
+    scanner = DelimiterScanner('.!?')
+    seq = as_seq('a. b! c? d')
+    assert scanner.find(seq) == 1
+    assert scanner.rfind(seq) == 7
+    assert scanner.rfind_end(seq) == 8
+
+
+def test_delimiter_scanner_given_bounds(as_seq):
+    scanner = DelimiterScanner('.!?')
+    seq = as_seq('a. b! c? d')
+    assert scanner.find(seq, 2) == 4
+    assert scanner.find(seq, 2, 4) == -1
+    assert scanner.rfind(seq, end=7) == 4
+    assert scanner.rfind(seq, 5, 7) == -1
+    assert scanner.rfind(seq, -4) == 7
+    assert scanner.find(seq, 0, -3) == 1
+
+
+def test_delimiter_scanner_given_regex_metacharacters(as_seq):
+    scanner = DelimiterScanner('-]\\^')
+    seq = as_seq('a^b]c\\d-e')
+    assert scanner.find(seq) == 1
+    assert scanner.rfind(seq) == 7
+
+
+def test_delimiter_scanner_given_newlines(as_seq):
+    scanner = DelimiterScanner('.')
+    seq = as_seq('a.\nb\nc')
+    assert scanner.rfind(seq) == 1
+
+
+def test_delimiter_scanner_given_multibyte_delimiter():
+    scanner = DelimiterScanner(' —')
+    text = 'ab—cd—e f'
+    data = text.encode('utf-8')
+    assert scanner.find(text) == 2
+    assert scanner.find(data) == 2
+    assert scanner.rfind(text) == 7
+    assert scanner.rfind(data) == 11
+    assert scanner.rfind_end(text) == 8
+    assert scanner.rfind_end(data) == 12
+    assert scanner.rfind_end(data, end=11) == 10
+
+
+def test_delimiter_scanner_given_multicharacter_delimiters():
+    scanner = DelimiterScanner(['\n\n', '\n'])
+    text = 'a\n\nb\nc'
+    assert scanner.find(text) == 1
+    assert scanner.rfind(text) == 4
+    assert scanner.rfind_end('a\nb\n\nc') == 5
+
+
+def test_delimiter_scanner_given_non_utf8_encoding():
+    scanner = DelimiterScanner('.', encoding='utf-16-le')
+    data = 'ab.c'.encode('utf-16-le')
+    assert scanner.find(data) == 4
+    assert scanner.rfind_end(data) == 6
+
+
+@pytest.mark.parametrize('delimiters, text', [
+    ('.!?\n', 'Hello, world! How are you?\nFine. Thanks'),
+    (' .,;:!?-—\t\n\r\f\v', 'naïve — 🦜 words\tand\u2028more'),
+    ('xyz', 'no delimiters in here'),
+])
+def test_delimiter_scanner_given_text_matches_index_any(delimiters, text):
+    scanner = DelimiterScanner(delimiters)
+    for start in range(len(text) + 1):
+        for end in range(start, len(text) + 1):
+            assert scanner.find(text, start, end) == index_any(text, set(delimiters), start, end)
+            assert scanner.rfind(text, start, end) == index_any(text, set(delimiters), start, end, reverse=True)
@@ -3,13 +3,16 @@ import asyncio
 
 import pytest
 import pinecone
-from tenacity import retry, stop_after_attempt, wait_exponential
+from unittest.mock import create_autospec
+from tenacity import AsyncRetrying, retry, stop_after_attempt, wait_exponential
 
 from llm_retrieval.configuration import Configuration
 from llm_retrieval.vector.store import StoredVector
 from llm_retrieval.vector.store import StoredVectorMetadata
 from llm_retrieval.vector.store.factory import get_vector_store_client
+from llm_retrieval.vector.store.provider.base import VectorStoreClient
 from llm_retrieval.vector.store.provider.pinecone import PineconeVectorStoreClient
+from llm_retrieval.utils.common.rate_limit import RateLimiter
 
 
 @pytest.fixture
@@ -149,3 +152,30 @@ def test_pinecone_vector_store_client_upsert_batch_async(
         assert stored_vector.id == fetched_stored_vector.id
         assert stored_vector.vector == fetched_stored_vector.values
         assert stored_vector.metadata.dict() == fetched_stored_vector.metadata
+
+
+class FlakyVectorStoreClient(VectorStoreClient):
+    """Fails the first request, and retries it without waiting."""
+
+    UPSERT_BATCH_SIZE = 10
+
+    def __init__(self, rate_limiter):
+        self.rate_limiter = rate_limiter
+        self.n_requests = 0
+
+    def _retrying(self):
+        return AsyncRetrying(stop=stop_after_attempt(2), reraise=True)
+
+    async def _upsert_batch_async(self, vectors):
+        self.n_requests += 1
+        if self.n_requests == 1:
+            raise RuntimeError("rate limited")
+
+
+def test_upsert_batch_async_given_retry_acquires_rate_limiter_again():
+    rate_limiter = create_autospec(RateLimiter, instance=True)
+    client = FlakyVectorStoreClient(rate_limiter)
+    vectors = [StoredVector(id="1", vector=[1.0], metadata=StoredVectorMetadata())]
+    asyncio.run(client.upsert_batch_async(vectors))
+    assert client.n_requests == 2
+    assert rate_limiter.acquire.call_count == 2
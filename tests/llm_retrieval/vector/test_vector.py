@@ -0,0 +1,61 @@
+import numpy
+import pytest
+
+from llm_retrieval.vector import VECTOR_DTYPE
+from llm_retrieval.vector import as_vector
+from llm_retrieval.vector import as_vector_batch
+from llm_retrieval.vector import vector_to_list
+from llm_retrieval.vector.store import StoredVector
+from llm_retrieval.vector.store import StoredVectorMetadata
+
+
+def test_as_vector_given_list():
+    actual = as_vector([1.0, 2.5])
+    assert actual.dtype == VECTOR_DTYPE
+    assert actual.tolist() == [1.0, 2.5]
+
+
+def test_as_vector_given_row_of_batch_does_not_copy():
+    batch = numpy.arange(6, dtype=VECTOR_DTYPE).reshape(2, 3)
+    actual = as_vector(batch[1])
+    assert numpy.shares_memory(actual, batch)
+
+
+def test_as_vector_given_batch():
+    with pytest.raises(ValueError):
+        as_vector([[1.0], [2.0]])
+
+
+def test_as_vector_batch_given_lists():
+    actual = as_vector_batch([[1.0, 2.0], [3.0, 4.0]])
+    assert actual.dtype == VECTOR_DTYPE
+    assert actual.flags.c_contiguous
+    assert actual.tolist() == [[1.0, 2.0], [3.0, 4.0]]
+
+
+def test_as_vector_batch_given_no_vectors():
+    assert as_vector_batch([]).shape == (0, 0)
+
+
+def test_vector_to_list_given_array():
+    actual = vector_to_list(numpy.array([0.5, 1.5], dtype=VECTOR_DTYPE))
+    assert actual == [0.5, 1.5]
+    assert all(type(value) is float for value in actual)
+
+
+def test_stored_vector_given_row_of_batch_does_not_copy():
+    batch = numpy.ones((2, 3), dtype=VECTOR_DTYPE)
+    stored_vector = StoredVector(id='id', vector=batch[0], metadata=StoredVectorMetadata())
+    assert numpy.shares_memory(stored_vector.vector, batch)
+
+
+def test_stored_vector_given_list():
+    stored_vector = StoredVector(id='id', vector=[1.0, 2.0], metadata=StoredVectorMetadata())
+    assert stored_vector.vector.dtype == VECTOR_DTYPE
+    assert stored_vector == StoredVector(id='id', vector=numpy.array([1.0, 2.0]), metadata=StoredVectorMetadata())
+    assert stored_vector != StoredVector(id='id', vector=[1.0, 3.0], metadata=StoredVectorMetadata())
+
+
+def test_stored_vector_json():
+    stored_vector = StoredVector(id='id', vector=[1.0, 2.0], metadata=StoredVectorMetadata())
+    assert stored_vector.json() == '{"id": "id", "vector": [1.0, 2.0], "metadata": {}}'